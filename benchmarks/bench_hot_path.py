@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Hot-path benchmarks for the Premium Queue System
+================================================
+Runs headless in a temporary data directory and reports latency percentiles,
+throughput and bytes written per operation for the counter, persistence,
+rendering and printing paths. Printing goes to the bundled ESC/POS emulator
+on a pseudo-terminal and on a local TCP port, so no printer is needed (the
+serial case is POSIX only and skipped elsewhere).
+
+Bytes per operation come from /proc/self/io and so only count write() calls;
+updates to the memory-mapped counter file show as 0. For printing the column
+shows the bytes the fake printer received per ticket.
+
+Usage:
+    python benchmarks/bench_hot_path.py
+    python benchmarks/bench_hot_path.py --json results.json
+    python benchmarks/bench_hot_path.py --compare results.json --tolerance 1.5
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import logging
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import main  # noqa: E402
+import printer_emulator  # noqa: E402
+
+
+# ======================= Measurement =======================
+def written_bytes():
+    """Bytes this process has passed to write() so far, where the OS reports it"""
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(name, operation, iterations, warmup=10):
+    """Time operation() iterations times; returns a result row"""
+    for _ in range(min(warmup, iterations)):
+        operation()
+
+    timings = []
+    bytes_before = written_bytes()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        operation()
+        timings.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    bytes_after = written_bytes()
+
+    timings.sort()
+    return {
+        "name": name,
+        "iterations": iterations,
+        "p50_ms": percentile(timings, 0.50) * 1000,
+        "p90_ms": percentile(timings, 0.90) * 1000,
+        "p99_ms": percentile(timings, 0.99) * 1000,
+        "max_ms": timings[-1] * 1000,
+        "ops_per_s": iterations / elapsed if elapsed else 0.0,
+        "bytes_per_op": (bytes_after - bytes_before) / iterations if bytes_before is not None else None
+    }
+
+
+# ======================= Benchmarks =======================
+def bench_counter(data_manager, iterations):
+    queue_data = data_manager.load_queue()
+
+    def increment(flush):
+        queue_data["current_number"] = queue_data.get("current_number", 1) + 1
+        data_manager.record_counters(queue_data, flush=flush)
+
+    return [
+        measure("counter.record (flush)", lambda: increment(True), iterations),
+        measure("counter.record (deferred)", lambda: increment(False), iterations)
+    ]
+
+
+def bench_issue(data_manager, iterations):
+    """Everything an issued ticket touches apart from the printer"""
+    queue_data = data_manager.load_queue()
+    statistics = main.StatisticsAggregator(data_manager.writer, data_manager.logger)
+    history = main.TicketHistoryStore(data_manager.logger)
+
+    def issue():
+        number = queue_data.get("current_number", 1)
+        statistics.record_issue(number)
+        history.append("issue", number)
+        queue_data["current_number"] = number + 1
+        queue_data["today_count"] = queue_data.get("today_count", 0) + 1
+        data_manager.record_counters(queue_data)
+
+    try:
+        return [measure("issue (counters + stats + history)", issue, iterations)]
+    finally:
+        history.close()
+
+
+def bench_persistence(data_manager, settings, iterations):
+    results = []
+    queue_data = data_manager.load_queue()
+    for storage_format in ("json", "snapshot"):
+        settings["business_rules"]["storage_format"] = storage_format
+
+        def save_state():
+            settings["current_number"] = settings.get("current_number", 1) + 1
+            queue_data["current_number"] = settings["current_number"]
+            data_manager.save_settings(settings)
+            data_manager.save_queue(queue_data)
+
+        results.append(measure(f"save_current_state ({storage_format})", save_state, iterations))
+        results.append(measure(f"load_settings ({storage_format})", data_manager.load_settings, iterations))
+    settings["business_rules"]["storage_format"] = "json"
+    return results
+
+
+def bench_render(settings, iterations):
+    renderer = main.TicketRenderer()
+    counter = iter(range(1, 10 ** 9))
+    return [
+        measure("render preview image", lambda: renderer.render(next(counter), settings), iterations),
+        measure("render raster bytes", lambda: renderer.render_raster(next(counter), settings), iterations)
+    ]
+
+
+def bench_printer(data_manager, settings, iterations, baud):
+    results = []
+    for transport in ("serial", "tcp"):
+        printer = printer_emulator.PrinterEmulator(settings["printer_settings"].get("paper_width", 80), baud)
+        try:
+            port = printer.start_pty() if transport == "serial" else printer.start_tcp(0)
+        except (ImportError, OSError) as e:
+            print(f"Skipping {transport} printer benchmark: {e}")
+            continue
+
+        settings["printer_settings"]["port"] = port
+        service = main.EnhancedPrinterService(data_manager)
+        counter = iter(range(1, 10 ** 9))
+        try:
+            for mode in ("raster", "text"):
+                settings["printer_settings"]["print_mode"] = mode
+                received = printer.received
+                tickets = len(printer.tickets)
+                row = measure(f"print_ticket ({transport}, {mode}, {baud or 'unlimited'} baud)",
+                              lambda: service.print_ticket_with_design(next(counter), settings),
+                              iterations, warmup=1)
+                if not printer.wait_for_tickets(tickets + iterations + 1, timeout=60):
+                    print(f"Warning: the emulator did not receive every {mode} ticket")
+                row["printer_bytes_per_ticket"] = (printer.received - received) / (iterations + 1)
+                results.append(row)
+        finally:
+            service.transports.close_all()
+            printer.stop()
+    return results
+
+
+# ======================= Report =======================
+def print_report(results):
+    header = f"{'operation':<46} {'n':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} {'ops/s':>10} {'B/op':>10}"
+    print(header)
+    print("-" * len(header))
+    for row in results:
+        bytes_per_op = row.get("printer_bytes_per_ticket", row["bytes_per_op"])
+        bytes_text = f"{bytes_per_op:>10.0f}" if bytes_per_op is not None else f"{'n/a':>10}"
+        print(f"{row['name']:<46} {row['iterations']:>6} {row['p50_ms']:>9.3f} {row['p90_ms']:>9.3f} "
+              f"{row['p99_ms']:>9.3f} {row['max_ms']:>9.3f} {row['ops_per_s']:>10.1f} {bytes_text}")
+
+
+def compare(results, baseline_file, tolerance, min_delta_ms):
+    """Return the operations whose median got slower than baseline * tolerance"""
+    with open(baseline_file, "r", encoding="utf-8") as f:
+        baseline = {row["name"]: row for row in json.load(f)}
+    regressions = []
+    for row in results:
+        previous = baseline.get(row["name"])
+        if (previous and row["p50_ms"] > previous["p50_ms"] * tolerance
+                and row["p50_ms"] - previous["p50_ms"] > min_delta_ms):
+            regressions.append(f"{row['name']}: p50 {previous['p50_ms']:.3f} -> {row['p50_ms']:.3f} ms")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Queue system hot-path benchmarks")
+    parser.add_argument("--iterations", type=int, default=500, help="iterations for fast operations")
+    parser.add_argument("--printer-iterations", type=int, default=20, help="iterations for printing")
+    parser.add_argument("--skip-printer", action="store_true", help="do not benchmark printing")
+    parser.add_argument("--baud", type=int, default=0, help="line speed the printer emulator simulates (0 = unlimited)")
+    parser.add_argument("--json", metavar="FILE", help="write results as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="fail if slower than a saved JSON result")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="allowed slowdown factor for --compare")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05,
+                        help="ignore slowdowns smaller than this (timer noise on microsecond operations)")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    work_dir = tempfile.mkdtemp(prefix="queue_bench_")
+    previous_dir = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        data_manager = main.EnhancedDataManager()
+        settings = data_manager.load_settings()
+        settings["business_rules"]["create_backups"] = False
+
+        results = []
+        results += bench_counter(data_manager, args.iterations)
+        results += bench_issue(data_manager, args.iterations)
+        results += bench_persistence(data_manager, settings, max(20, args.iterations // 5))
+        results += bench_render(settings, max(20, args.iterations // 5))
+        if not args.skip_printer:
+            results += bench_printer(data_manager, settings, args.printer_iterations, args.baud)
+        data_manager.counters.close()
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -8,18 +8,43 @@ Author: Premium Queue System
 
 import os
 import json
+import copy
+import mmap
+import struct
+import zlib
 import tkinter as tk
 from tkinter import ttk, messagebox, colorchooser, simpledialog, filedialog, font
-from datetime import datetime
+import ctypes
+from datetime import datetime, timedelta
 import logging
+import logging.handlers
 from PIL import Image, ImageTk, ImageDraw, ImageFont
 import serial
+import serial.tools.list_ports
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
 import shutil
+import sqlite3
+import socket
+import select
+import queue
+from collections import deque
 import atexit
 import signal
 import sys
+import argparse
+import csv
+import bisect
+import contextlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+try:
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+except ImportError:
+    arabic_reshaper = None
+    get_display = None
 
 # ======================= Configuration =======================
 class Config:
@@ -36,13 +61,34 @@ class Config:
     QUEUE_FILE = os.path.join(DATA_DIR, "queue_data.json")
     LOG_FILE = os.path.join(LOGS_DIR, "system.log")
     AUTO_SAVE_FILE = os.path.join(DATA_DIR, "autosave.json")
+    DESIGNER_AUTO_SAVE_FILE = os.path.join(DATA_DIR, "designer_autosave.json")
+    SETTINGS_SNAPSHOT_FILE = os.path.join(DATA_DIR, "settings.snap")
+    QUEUE_SNAPSHOT_FILE = os.path.join(DATA_DIR, "queue_data.snap")
+    COUNTER_FILE = os.path.join(DATA_DIR, "counter.bin")
+    SHARED_COUNTER_FILE = os.path.join(DATA_DIR, "shared_counter.db")
+    DAY_HISTORY_FILE = os.path.join(DATA_DIR, "day_history.jsonl")
+    STATS_FILE = os.path.join(DATA_DIR, "statistics.json")
+    HISTORY_DIR = os.path.join(DATA_DIR, "history")
     
     # Printer settings
-    SERIAL_PORT = "COM3"  # Change this to your printer port
+    SERIAL_PORT = "COM3"  # Fallback when printer_settings has no port
     BAUD_RATE = 115200
+    PROBE_BAUD_RATES = (115200, 9600, 19200, 38400, 57600)
+    # ESC t numbers (Epson table) for the code pages text mode can switch between
+    ESC_T_CODEPAGES = {
+        "cp437": 0, "cp850": 2, "cp1252": 16, "cp866": 17, "cp852": 18,
+        "cp858": 19, "cp864": 37, "cp1256": 50
+    }
     ESC = b'\x1b'
     GS = b'\x1d'
-    
+    DLE = b'\x10'
+
+    # Ticket rendering
+    TICKET_CANVAS_WIDTH = 800  # Designer canvas size (design coordinates)
+    TICKET_CANVAS_HEIGHT = 600
+    PRINTER_DOTS = {58: 384, 80: 576}  # Printable dots per paper width (mm) at 203 dpi
+    POINTS_TO_PIXELS = 96 / 72
+
     DEFAULT_SETTINGS = {
         "version": "6.5.0",
         "title": "Premium Queue System",
@@ -229,13 +275,15 @@ class Config:
             "watermark_position_x": 200,
             "watermark_position_y": 500,
             "watermark_font_size": 10,
+            "font_family": "",  # Family from fonts/ or the system; empty = first font in fonts/
             "paper_width": 80,
             "design_name": "default",
             "design_timestamp": ""
         },
         
         "printer_settings": {
-            "encoding": "cp437",
+            "encoding": "cp437",  # Preferred code page; others are used for text it cannot hold
+            "print_mode": "text",  # text, or raster to match the design (~31 KB, ~3.5 s per ticket at 115200 baud)
             "paper_width": 80,
             "cut_after_print": True,
             "print_quality": "high",
@@ -243,7 +291,11 @@ class Config:
             "print_speed": 3,
             "align_center": True,
             "bold_header": True,
-            "double_height": True
+            "double_height": True,
+            "port": "COM3",  # Serial port, host:9100 for a network printer, or file:/path
+            "baud_rate": 115200,
+            "secondary_port": "",  # Used automatically while the main printer is offline
+            "status_poll_interval": 15  # Seconds between idle status checks
         },
         
         "ui_layout": {
@@ -275,11 +327,35 @@ class Config:
             "increment_by": 1,
             "max_number": 9999,
             "reset_at_midnight": False,
+            "day_rollover_time": "00:00",  # Local time at which a business day ends
             "auto_increment_after_print": True,
             "sound_effects": True,
             "auto_save_interval": 10,  # Auto-save every 10 seconds
             "create_backups": True,
-            "backup_interval": 60  # Create backup every 60 seconds
+            "backup_interval": 60,  # Create backup every 60 seconds
+            "storage_format": "json",  # json or snapshot (compact, checksummed)
+            "counter_flush_ms": 0,  # 0 flushes the counter file on every ticket
+            "counter_backend": "local"  # local, or shared between kiosks on one data directory
+        },
+        
+        "logging": {
+            "level": "INFO",
+            "format": "text",  # text or jsonl (one JSON object per line)
+            "max_bytes": 1048576,  # Rotate system.log at this size
+            "backup_count": 5,
+            "ticket_budget": 3  # INFO lines allowed per ticket issue/call; 0 = unlimited
+        },
+        
+        "metrics": {
+            "enabled": False,
+            "textfile": "",  # Prometheus text file, e.g. for node_exporter's textfile collector
+            "http_port": 0  # Serve /metrics on 127.0.0.1 at this port; 0 disables
+        },
+        
+        "replication": {
+            "role": "off",  # off, leader or follower
+            "host": "127.0.0.1",  # leader: address to listen on; follower: leader address
+            "port": 9300
         },
         
         "auto_save": {
@@ -287,10 +363,1116 @@ class Config:
             "last_save": "",
             "last_backup": "",
             "save_count": 0,
+            "generation": 0,
             "recovery_data": {}
         }
     }
 
+# ======================= Metrics =======================
+class MetricSpan:
+    """Times one block into a metrics histogram"""
+    
+    __slots__ = ("metrics", "name", "start")
+    
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        if exc_type is not None:
+            self.metrics.increment(f"{self.name}_errors")
+        return False
+
+
+class Metrics:
+    """In-memory counters and latency histograms with Prometheus text export"""
+    
+    BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+    PREFIX = "queue_system"
+    
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.null_span = contextlib.nullcontext()
+        self.http_server = None
+    
+    def span(self, name):
+        """Context manager timing a block; a shared no-op when disabled"""
+        if not self.enabled:
+            return self.null_span
+        return MetricSpan(self, name)
+    
+    def increment(self, name, value=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+    
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = [[0] * (len(self.BUCKETS) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+    
+    def to_prometheus(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                metric = f"{self.PREFIX}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+            for name, (buckets, total, count) in sorted(self.histograms.items()):
+                metric = f"{self.PREFIX}_{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, bucket_count in zip(self.BUCKETS, buckets):
+                    cumulative += bucket_count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {count}')
+                lines.append(f"{metric}_sum {total:.6f}")
+                lines.append(f"{metric}_count {count}")
+        return "\n".join(lines) + "\n"
+    
+    def write_textfile(self, path, writer):
+        """Atomically write the metrics for a textfile collector"""
+        writer.write_bytes(path, self.to_prometheus().encode('utf-8'))
+    
+    def start_http(self, port, host="127.0.0.1"):
+        """Serve GET /metrics on a background thread"""
+        metrics = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.http_server = ThreadingHTTPServer((host, port), Handler)
+        self.http_server.daemon_threads = True
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+    
+    def stop_http(self):
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
+
+
+metrics = Metrics()
+
+# ======================= Logging =======================
+class JsonLinesFormatter(logging.Formatter):
+    """Formats each record as one JSON object per line"""
+    
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TicketLogBudget(logging.Filter):
+    """Limits INFO and DEBUG records emitted while one ticket is handled"""
+    
+    def __init__(self):
+        super().__init__()
+        self.limit = 0
+        # Filters run on whichever thread logs, so each thread keeps its own budget
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.suppressed = 0
+    
+    @contextlib.contextmanager
+    def ticket(self):
+        """Give the calling thread a fresh budget for one ticket operation"""
+        if self.limit <= 0 or getattr(self.local, "remaining", None) is not None:
+            yield
+            return
+        self.local.remaining = self.limit
+        try:
+            yield
+        finally:
+            self.local.remaining = None
+    
+    def filter(self, record):
+        remaining = getattr(self.local, "remaining", None)
+        if record.levelno >= logging.WARNING or remaining is None:
+            return True
+        if remaining > 0:
+            self.local.remaining = remaining - 1
+            return True
+        with self.lock:
+            self.suppressed += 1
+        metrics.increment("log_records_suppressed")
+        return False
+
+
+class LogPipeline:
+    """Queue-based logging: callers only enqueue, a listener thread does the I/O"""
+    
+    TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+    
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self.budget = TicketLogBudget()
+        self.queue_handler = None
+        self.listener = None
+        self.log_file = None
+        self.options = {}
+    
+    def start(self, log_file, options=None):
+        """Route the root logger through the queue; calling it again is harmless"""
+        if self.listener is not None:
+            return
+        self.log_file = log_file
+        self.options = dict(Config.DEFAULT_SETTINGS["logging"], **(options or {}))
+        
+        self.queue_handler = logging.handlers.QueueHandler(self.queue)
+        self.queue_handler.addFilter(self.budget)
+        root = logging.getLogger()
+        root.addHandler(self.queue_handler)
+        
+        self.listener = logging.handlers.QueueListener(self.queue, *self.build_handlers(),
+                                                       respect_handler_level=True)
+        self.listener.start()
+        self.apply_options()
+        atexit.register(self.stop)
+    
+    def build_handlers(self):
+        formatter = (JsonLinesFormatter() if self.options.get("format") == "jsonl"
+                     else logging.Formatter(self.TEXT_FORMAT))
+        file_handler = logging.handlers.RotatingFileHandler(
+            self.log_file,
+            maxBytes=max(0, int(self.options.get("max_bytes", 0))),
+            backupCount=max(0, int(self.options.get("backup_count", 0))),
+            encoding='utf-8'
+        )
+        console_handler = logging.StreamHandler()
+        for handler in (file_handler, console_handler):
+            handler.setFormatter(formatter)
+        return [file_handler, console_handler]
+    
+    def apply_options(self):
+        level = logging.getLevelName(str(self.options.get("level", "INFO")).upper())
+        logging.getLogger().setLevel(level if isinstance(level, int) else logging.INFO)
+        self.budget.limit = max(0, int(self.options.get("ticket_budget", 0)))
+    
+    def configure(self, options):
+        """Apply logging settings, reopening the handlers only if they changed"""
+        options = dict(Config.DEFAULT_SETTINGS["logging"], **(options or {}))
+        if self.listener is None:
+            self.options = options
+            return
+        handler_keys = ("format", "max_bytes", "backup_count")
+        if any(options.get(k) != self.options.get(k) for k in handler_keys):
+            self.options = options
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+            self.listener.handlers = tuple(self.build_handlers())
+            self.listener.start()
+        self.options = options
+        self.apply_options()
+    
+    def ticket(self):
+        return self.budget.ticket()
+    
+    def stop(self):
+        """Drain the queue and close the handlers"""
+        if self.listener is None:
+            return
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+        logging.getLogger().removeHandler(self.queue_handler)
+        self.listener = None
+        self.queue_handler = None
+
+
+log_pipeline = LogPipeline()
+
+# ======================= Atomic File Writer =======================
+class AtomicFileWriter:
+    """Crash-consistent file writes: temp file, fsync, rename"""
+    
+    def __init__(self):
+        self.pending_dirs = set()
+        self.lock = threading.Lock()
+    
+    def write_bytes(self, path, payload, defer_dir_sync=False):
+        """Atomically replace path with payload"""
+        directory = os.path.dirname(os.path.abspath(path))
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+            raise
+        
+        with self.lock:
+            self.pending_dirs.add(directory)
+        if not defer_dir_sync:
+            self.sync_dirs()
+    
+    def write_json(self, path, data, indent=4, ensure_ascii=False, defer_dir_sync=False):
+        """Atomically replace path with data serialized as JSON"""
+        payload = json.dumps(data, indent=indent, ensure_ascii=ensure_ascii).encode('utf-8')
+        self.write_bytes(path, payload, defer_dir_sync)
+    
+    def sync_dirs(self):
+        """Make pending renames durable with one fsync per directory"""
+        with self.lock:
+            directories = self.pending_dirs
+            self.pending_dirs = set()
+        
+        # Directories cannot be opened for fsync on Windows; rename is durable there
+        if os.name == 'nt':
+            return
+        for directory in directories:
+            try:
+                fd = os.open(directory, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError:
+                pass
+
+# ======================= Snapshot Storage =======================
+class SnapshotCodec:
+    """Versioned, checksummed compact encoding for state files"""
+    
+    MAGIC = b"PQSS"
+    VERSION = 1
+    # magic, version, flags, payload length, payload crc32, defaults fingerprint
+    HEADER = struct.Struct("<4sHHIII")
+    _defaults_fingerprint = None
+    
+    @classmethod
+    def defaults_fingerprint(cls):
+        """Fingerprint of the default settings tree this build merges against"""
+        if cls._defaults_fingerprint is None:
+            layout = json.dumps(Config.DEFAULT_SETTINGS, sort_keys=True, ensure_ascii=True)
+            cls._defaults_fingerprint = zlib.crc32(layout.encode('ascii'))
+        return cls._defaults_fingerprint
+    
+    @classmethod
+    def encode(cls, data, fingerprint=0):
+        """Encode data as header + minified JSON"""
+        payload = json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, 0, len(payload), zlib.crc32(payload), fingerprint)
+        return header + payload
+    
+    @classmethod
+    def decode(cls, blob):
+        """Decode a snapshot, returning (data, fingerprint); raises ValueError if damaged"""
+        if len(blob) < cls.HEADER.size:
+            raise ValueError("Snapshot is truncated")
+        magic, version, _, length, crc, fingerprint = cls.HEADER.unpack_from(blob)
+        if magic != cls.MAGIC:
+            raise ValueError("Not a snapshot file")
+        if version > cls.VERSION:
+            raise ValueError(f"Unsupported snapshot version {version}")
+        payload = blob[cls.HEADER.size:cls.HEADER.size + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            raise ValueError("Snapshot checksum mismatch")
+        return json.loads(payload.decode('utf-8')), fingerprint
+
+
+class MappedCounterFile:
+    """Memory-mapped per-service counters with double-buffered, checksummed slots"""
+    
+    MAGIC = b"PQCF"
+    VERSION = 2
+    SERVICES = 8
+    # magic, version, service count
+    HEADER = struct.Struct("<4sHH")
+    # sequence, current, today, total, last update (epoch), crc32
+    SLOT = struct.Struct("<qqqqdI")
+    FIELDS = ("generation", "current_number", "today_count", "total_printed", "last_update")
+    SIZE = HEADER.size + SERVICES * 2 * SLOT.size
+    
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.map = None
+        self.dirty = False
+    
+    def open(self):
+        """Map the counter file, creating or re-initialising it if needed"""
+        if self.map is None:
+            self.file = open(self.path, 'r+b' if os.path.exists(self.path) else 'w+b')
+            if os.fstat(self.file.fileno()).st_size < self.SIZE:
+                self.file.truncate(self.SIZE)
+            self.map = mmap.mmap(self.file.fileno(), self.SIZE)
+            
+            magic, version, services = self.HEADER.unpack_from(self.map)
+            if magic != self.MAGIC or version != self.VERSION or services != self.SERVICES:
+                self.map[:self.SIZE] = bytes(self.SIZE)
+                self.HEADER.pack_into(self.map, 0, self.MAGIC, self.VERSION, self.SERVICES)
+                self.map.flush()
+        return self.map
+    
+    def slot_offset(self, service, slot):
+        return self.HEADER.size + (service * 2 + slot) * self.SLOT.size
+    
+    def read_slot(self, service, slot):
+        """Return the slot fields, or None if it is blank or torn"""
+        offset = self.slot_offset(service, slot)
+        fields = self.SLOT.unpack_from(self.map, offset)
+        if fields[0] <= 0 or fields[-1] != zlib.crc32(self.map[offset:offset + self.SLOT.size - 4]):
+            return None
+        return fields
+    
+    def read(self, service=0):
+        """Return the newest intact counters for a service, or None"""
+        if self.map is None and not os.path.exists(self.path):
+            return None
+        self.open()
+        slots = [fields for fields in (self.read_slot(service, 0), self.read_slot(service, 1)) if fields]
+        if not slots:
+            return None
+        sequence, current, today, total, updated, _ = max(slots)
+        return {
+            "generation": sequence,
+            "current_number": current,
+            "today_count": today,
+            "total_printed": total,
+            "last_update": datetime.fromtimestamp(updated).strftime("%Y-%m-%d %H:%M:%S") if updated else ""
+        }
+    
+    def write(self, queue_data, service=0, flush=True):
+        """Write counters into the older slot so a torn write keeps the newer one"""
+        self.open()
+        first, second = self.read_slot(service, 0), self.read_slot(service, 1)
+        slot = 0 if (first[0] if first else -1) <= (second[0] if second else -1) else 1
+        
+        offset = self.slot_offset(service, slot)
+        body = self.SLOT.pack(
+            queue_data.get("generation", 0),
+            queue_data.get("current_number", 1),
+            queue_data.get("today_count", 0),
+            queue_data.get("total_printed", 0),
+            time.time(), 0
+        )[:self.SLOT.size - 4]
+        self.map[offset:offset + len(body)] = body
+        struct.pack_into("<I", self.map, offset + len(body), zlib.crc32(body))
+        
+        self.dirty = True
+        if flush:
+            self.flush()
+    
+    def flush(self):
+        """Push pending writes to storage"""
+        if self.dirty and self.map is not None:
+            self.map.flush()
+            self.dirty = False
+    
+    def close(self):
+        """Flush, unmap and close the counter file"""
+        if self.map is not None:
+            self.flush()
+            self.map.close()
+            self.file.close()
+            self.map = None
+            self.file = None
+
+# ======================= Shared Counter =======================
+class SharedCounterStore:
+    """Cross-process ticket counter for several kiosks sharing one data directory"""
+    
+    def __init__(self, path, service=0):
+        self.path = path
+        self.service = service
+        self.connection = None
+        self.data_version = None
+    
+    def connect(self):
+        """Open the database and create the counter table"""
+        if self.connection is None:
+            # Rollback journal rather than WAL: WAL needs shared memory, which network shares lack
+            self.connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            self.connection.execute("PRAGMA journal_mode=DELETE")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS counters ("
+                "service INTEGER PRIMARY KEY, current_number INTEGER NOT NULL, "
+                "today_count INTEGER NOT NULL, total_printed INTEGER NOT NULL, "
+                "generation INTEGER NOT NULL, updated REAL NOT NULL)"
+            )
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        return self.connection
+    
+    def seed(self, queue_data):
+        """Create the service row from local state if no kiosk has yet"""
+        self.connect().execute(
+            "INSERT OR IGNORE INTO counters VALUES (?, ?, ?, ?, 0, ?)",
+            (self.service, queue_data.get("current_number", 1), queue_data.get("today_count", 0),
+             queue_data.get("total_printed", 0), time.time())
+        )
+    
+    def row_to_dict(self, row):
+        return {
+            "current_number": row[0],
+            "today_count": row[1],
+            "total_printed": row[2],
+            "shared_generation": row[3]
+        }
+    
+    def read(self):
+        """Read the counters without taking a lock"""
+        row = self.connect().execute(
+            "SELECT current_number, today_count, total_printed, generation FROM counters WHERE service = ?",
+            (self.service,)
+        ).fetchone()
+        return self.row_to_dict(row) if row else None
+    
+    def update(self, change):
+        """Apply change(counters) inside BEGIN IMMEDIATE; returns (before, after)"""
+        connection = self.connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            before = self.read()
+            after = dict(before)
+            change(after)
+            after["shared_generation"] += 1
+            connection.execute(
+                "UPDATE counters SET current_number = ?, today_count = ?, total_printed = ?, "
+                "generation = ?, updated = ? WHERE service = ?",
+                (after["current_number"], after["today_count"], after["total_printed"],
+                 after["shared_generation"], time.time(), self.service)
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return before, after
+    
+    def claim(self, increment=1):
+        """Claim the current number for printing; no other kiosk can receive it"""
+        def change(counters):
+            counters["current_number"] += increment
+        before, after = self.update(change)
+        return before["current_number"], after
+    
+    def mark_printed(self):
+        """Count a successfully printed ticket"""
+        def change(counters):
+            counters["today_count"] += 1
+            counters["total_printed"] += 1
+        return self.update(change)[1]
+    
+    def advance(self, delta, minimum=1):
+        """Move the current number by delta, never below minimum"""
+        def change(counters):
+            counters["current_number"] = max(minimum, counters["current_number"] + delta)
+        return self.update(change)[1]
+    
+    def set_current(self, number):
+        """Set the current number"""
+        def change(counters):
+            counters["current_number"] = number
+        return self.update(change)[1]
+    
+    def rollover(self, business_day, start_number=None):
+        """Start a new business day once across all kiosks; returns the finished day's counters"""
+        connection = self.connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT value FROM meta WHERE key = 'business_day'").fetchone()
+            if row is not None and row[0] >= business_day:
+                connection.execute("COMMIT")
+                return None
+            
+            before = self.read()
+            connection.execute(
+                "UPDATE counters SET today_count = 0, current_number = COALESCE(?, current_number), "
+                "generation = generation + 1, updated = ? WHERE service = ?",
+                (start_number, time.time(), self.service)
+            )
+            connection.execute("INSERT OR REPLACE INTO meta VALUES ('business_day', ?)", (business_day,))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return before
+    
+    def changed(self):
+        """True if another connection committed since the last check"""
+        version = self.connect().execute("PRAGMA data_version").fetchone()[0]
+        changed = version != self.data_version
+        self.data_version = version
+        return changed
+    
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+# ======================= Day Rollover =======================
+class DayRolloverEngine:
+    """Ends business days at a configurable local time and archives each finished day"""
+    
+    def __init__(self, data_manager):
+        self.data_manager = data_manager
+        self.logger = data_manager.logger
+        self.clock_warning_day = None
+        self.invalid_rollover_time = None
+    
+    def parse_rollover_time(self, rollover_time):
+        """(hours, minutes) of an HH:MM rollover time; midnight if it is malformed"""
+        try:
+            hours, minutes = (int(part) for part in str(rollover_time).split(":"))
+            if 0 <= hours < 24 and 0 <= minutes < 60:
+                return hours, minutes
+        except ValueError:
+            pass
+        if rollover_time != self.invalid_rollover_time:
+            self.invalid_rollover_time = rollover_time
+            self.logger.warning(f"Invalid day_rollover_time {rollover_time!r}; using 00:00")
+        return 0, 0
+    
+    def business_day(self, moment, rollover_time="00:00"):
+        """Business day a moment belongs to; days start at rollover_time"""
+        hours, minutes = self.parse_rollover_time(rollover_time)
+        return (moment - timedelta(hours=hours, minutes=minutes)).date().isoformat()
+    
+    def due(self, queue_data, rules, now=None):
+        """Return (finished_day, new_day) if a rollover is due, else None"""
+        now = now or datetime.now()
+        rollover_time = rules.get("day_rollover_time", "00:00")
+        day = self.business_day(now, rollover_time)
+        
+        stored = queue_data.get("business_day")
+        if not stored:
+            # Older queue files: the last update tells which day they belong to
+            try:
+                last_update = datetime.strptime(queue_data.get("last_update", ""), "%Y-%m-%d %H:%M:%S")
+                stored = self.business_day(last_update, rollover_time)
+            except ValueError:
+                stored = day
+            queue_data["business_day"] = stored
+        
+        if stored == day:
+            return None
+        if stored > day:
+            # Clock moved backwards; keep the current day until it catches up
+            if self.clock_warning_day != day:
+                self.clock_warning_day = day
+                self.logger.warning(f"Clock is behind business day {stored}; rollover postponed")
+            return None
+        return stored, day
+    
+    def last_archived_day(self):
+        """Read the last archived day from the tail of the history file"""
+        try:
+            with open(Config.DAY_HISTORY_FILE, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - 4096))
+                lines = f.read().splitlines()
+            for line in reversed(lines):
+                try:
+                    return json.loads(line)["day"]
+                except (ValueError, KeyError):
+                    continue
+        except OSError:
+            pass
+        return None
+    
+    def archive(self, day, counters):
+        """Append the finished day's aggregates once"""
+        last_day = self.last_archived_day()
+        if last_day is not None and last_day >= day:
+            return False
+        
+        record = {
+            "day": day,
+            "issued": counters.get("today_count", 0),
+            "last_number": counters.get("current_number", 0),
+            "total_printed": counters.get("total_printed", 0),
+            "closed_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        with open(Config.DAY_HISTORY_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, separators=(',', ':')) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.logger.info(f"Business day {day} archived: {record['issued']} tickets")
+        return True
+
+# ======================= Statistics =======================
+class StatisticsAggregator:
+    """Incremental per-hour, per-day and per-service ticket statistics"""
+    
+    HOURS = 30 * 24
+    DAYS = 366
+    PENDING_LIMIT = 10000
+    
+    def __init__(self, writer, logger, path=None):
+        self.writer = writer
+        self.logger = logger
+        self.path = path or Config.STATS_FILE
+        # Ring slots: [key, issued, called, wait seconds, waits]; key is hours/days since epoch
+        self.hour_slots = [[-1, 0, 0, 0.0, 0] for _ in range(self.HOURS)]
+        self.day_slots = [[-1, 0, 0, 0.0, 0] for _ in range(self.DAYS)]
+        # Totals by hour of day over the hour ring, kept in step as slots are recycled
+        self.hour_of_day = [[0, 0, 0.0, 0] for _ in range(24)]
+        self.services = {}
+        self.pending = {}
+        self.swept_key = -1
+        self.dirty = False
+    
+    @staticmethod
+    def local_hour(ts):
+        """Local hours since the epoch"""
+        moment = datetime.fromtimestamp(ts)
+        return (moment.toordinal() * 24 + moment.hour), moment
+    
+    def evict(self, slot):
+        """Drop an hour slot and its share of the hour-of-day totals"""
+        if slot[0] >= 0:
+            totals = self.hour_of_day[slot[0] % 24]
+            for i in range(4):
+                totals[i] -= slot[i + 1]
+        slot[:] = [-1, 0, 0, 0.0, 0]
+    
+    def expire(self, current_key):
+        """Evict hours older than the window; each hour is swept once"""
+        cutoff = current_key - self.HOURS
+        if self.swept_key >= cutoff:
+            return
+        if cutoff - self.swept_key >= self.HOURS:
+            indexes = range(self.HOURS)
+        else:
+            indexes = (key % self.HOURS for key in range(self.swept_key + 1, cutoff + 1))
+        for index in indexes:
+            slot = self.hour_slots[index]
+            if 0 <= slot[0] <= cutoff:
+                self.evict(slot)
+        self.swept_key = cutoff
+    
+    def hour_slot(self, hour_key):
+        slot = self.hour_slots[hour_key % self.HOURS]
+        if slot[0] != hour_key:
+            self.evict(slot)
+            slot[0] = hour_key
+        return slot
+    
+    def day_slot(self, day_key):
+        slot = self.day_slots[day_key % self.DAYS]
+        if slot[0] != day_key:
+            slot[:] = [day_key, 0, 0, 0.0, 0]
+        return slot
+    
+    def add(self, ts, service, index, value=1):
+        hour_key, moment = self.local_hour(ts)
+        self.expire(self.local_hour(time.time())[0])
+        if hour_key > self.swept_key:
+            self.hour_slot(hour_key)[index + 1] += value
+            self.hour_of_day[moment.hour][index] += value
+        self.day_slot(moment.toordinal())[index + 1] += value
+        totals = self.services.setdefault(str(service), [0, 0, 0.0, 0])
+        totals[index] += value
+        self.dirty = True
+    
+    def record_issue(self, number, service=0, ts=None):
+        """Count an issued ticket and remember when it was issued"""
+        ts = ts or time.time()
+        self.add(ts, service, 0)
+        if len(self.pending) >= self.PENDING_LIMIT:
+            self.pending.pop(next(iter(self.pending)))
+        self.pending[f"{service}:{number}"] = ts
+    
+    def record_call(self, number, service=0, ts=None):
+        """Count a called number and its wait since issue, if known"""
+        ts = ts or time.time()
+        self.add(ts, service, 1)
+        issued = self.pending.pop(f"{service}:{number}", None)
+        if issued is not None and ts >= issued:
+            self.add(ts, service, 2, ts - issued)
+            self.add(ts, service, 3)
+    
+    def oldest_waiting(self, service=0):
+        """Longest-waiting issued number that has not been called yet, or None"""
+        prefix = f"{service}:"
+        for key in self.pending:
+            if key.startswith(prefix):
+                return int(key[len(prefix):])
+        return None
+    
+    def last_30_days_by_hour(self, now=None):
+        """Hourly (hour start, issued, called, average wait) for the last 30 days, oldest first"""
+        current_key, _ = self.local_hour(now or time.time())
+        rows = []
+        for hour_key in range(current_key - self.HOURS + 1, current_key + 1):
+            slot = self.hour_slots[hour_key % self.HOURS]
+            day = datetime.fromordinal(hour_key // 24)
+            start = day.replace(hour=hour_key % 24)
+            if slot[0] == hour_key:
+                rows.append((start, slot[1], slot[2], slot[3] / slot[4] if slot[4] else 0.0))
+            else:
+                rows.append((start, 0, 0, 0.0))
+        return rows
+    
+    def day_totals(self, days=7, now=None):
+        """(date, issued, called, average wait) for the last days, oldest first"""
+        today = datetime.fromtimestamp(now or time.time()).toordinal()
+        rows = []
+        for day_key in range(today - days + 1, today + 1):
+            slot = self.day_slots[day_key % self.DAYS]
+            if slot[0] == day_key:
+                rows.append((datetime.fromordinal(day_key).date(), slot[1], slot[2],
+                             slot[3] / slot[4] if slot[4] else 0.0))
+            else:
+                rows.append((datetime.fromordinal(day_key).date(), 0, 0, 0.0))
+        return rows
+    
+    def summary(self, now=None):
+        """Today's totals, issue rate over the last hours, average wait and peak hour"""
+        now = now or time.time()
+        hour_key, moment = self.local_hour(now)
+        self.expire(hour_key)
+        today = self.day_slots[moment.toordinal() % self.DAYS]
+        today = today if today[0] == moment.toordinal() else [0, 0, 0, 0.0, 0]
+        
+        # Rate over the previous two full hours plus the current one
+        recent = sum(slot[1] for slot in (self.hour_slots[key % self.HOURS] for key in range(hour_key - 2, hour_key + 1))
+                     if slot[0] >= hour_key - 2)
+        span_hours = 2 + (moment.minute * 60 + moment.second) / 3600
+        
+        peak = max(range(24), key=lambda hour: self.hour_of_day[hour][0])
+        return {
+            "issued_today": today[1],
+            "called_today": today[2],
+            "average_wait_today": today[3] / today[4] if today[4] else 0.0,
+            "issue_rate_per_hour": recent / span_hours if span_hours else 0.0,
+            "peak_hour": peak if self.hour_of_day[peak][0] else None,
+            "by_hour_of_day": [totals[0] for totals in self.hour_of_day],
+            "services": {service: totals[0] for service, totals in self.services.items()}
+        }
+    
+    def load(self):
+        """Restore rollups saved by flush"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for slot in data.get("hours", []):
+                self.hour_slots[slot[0] % self.HOURS] = list(slot)
+                for i in range(4):
+                    self.hour_of_day[slot[0] % 24][i] += slot[i + 1]
+            for slot in data.get("days", []):
+                self.day_slots[slot[0] % self.DAYS] = list(slot)
+            self.services = data.get("services", {})
+            self.pending = data.get("pending", {})
+            self.expire(self.local_hour(time.time())[0])
+        except Exception as e:
+            self.logger.error(f"Error loading statistics: {e}")
+    
+    def flush(self):
+        """Write the rollups if anything changed since the last flush"""
+        if not self.dirty:
+            return
+        try:
+            data = {
+                "hours": [slot for slot in self.hour_slots if slot[0] >= 0],
+                "days": [slot for slot in self.day_slots if slot[0] >= 0],
+                "services": self.services,
+                "pending": self.pending
+            }
+            self.writer.write_json(self.path, data, indent=None)
+            self.dirty = False
+        except Exception as e:
+            self.logger.error(f"Error saving statistics: {e}")
+
+# ======================= Ticket History =======================
+class TicketHistoryStore:
+    """Append-only ticket events partitioned into one file per day and service"""
+    
+    EXPORT_FIELDS = ("time", "event", "number", "service")
+    
+    def __init__(self, logger, history_dir=None):
+        self.logger = logger
+        self.history_dir = history_dir or Config.HISTORY_DIR
+        self.partition = None
+        self.file = None
+    
+    def partition_path(self, day, service):
+        """history/YYYY-MM/YYYY-MM-DD_s<service>.jsonl"""
+        return os.path.join(self.history_dir, day[:7], f"{day}_s{service}.jsonl")
+    
+    def append(self, event, number, service=0, moment=None):
+        """Record a ticket event"""
+        moment = moment or datetime.now()
+        day = moment.strftime("%Y-%m-%d")
+        try:
+            if self.partition != (day, service):
+                self.close()
+                path = self.partition_path(day, service)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self.file = open(path, 'a', encoding='utf-8')
+                self.partition = (day, service)
+            record = {"time": moment.strftime("%Y-%m-%d %H:%M:%S"), "event": event, "number": number}
+            self.file.write(json.dumps(record, separators=(',', ':')) + "\n")
+            self.file.flush()
+        except Exception as e:
+            self.logger.error(f"Error writing ticket history: {e}")
+    
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.partition = None
+    
+    def partitions(self, start_day=None, end_day=None, services=None):
+        """Yield (day, service, path) for matching partitions, by name only"""
+        if not os.path.isdir(self.history_dir):
+            return
+        for month in sorted(os.listdir(self.history_dir)):
+            # Whole months outside the range are skipped without listing them
+            if (start_day and month < start_day[:7]) or (end_day and month > end_day[:7]):
+                continue
+            month_dir = os.path.join(self.history_dir, month)
+            if not os.path.isdir(month_dir):
+                continue
+            for name in sorted(os.listdir(month_dir)):
+                if not name.endswith(".jsonl") or "_s" not in name:
+                    continue
+                day, service = name[:-len(".jsonl")].rsplit("_s", 1)
+                if (start_day and day < start_day) or (end_day and day > end_day):
+                    continue
+                if services is not None and service not in services:
+                    continue
+                yield day, service, os.path.join(month_dir, name)
+    
+    def iter_records(self, start_day=None, end_day=None, services=None):
+        """Stream matching records one at a time"""
+        services = {str(service) for service in services} if services is not None else None
+        for day, service, path in self.partitions(start_day, end_day, services):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    record["service"] = int(service)
+                    yield record
+    
+    def export(self, file_path, export_format="csv", start_day=None, end_day=None, services=None):
+        """Stream history to CSV or JSON Lines in constant memory; returns the row count"""
+        if self.file is not None:
+            self.file.flush()
+        count = 0
+        with open(file_path, 'w', encoding='utf-8', newline='') as out:
+            if export_format == "jsonl":
+                for record in self.iter_records(start_day, end_day, services):
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    count += 1
+            else:
+                writer = csv.writer(out)
+                writer.writerow(self.EXPORT_FIELDS)
+                for record in self.iter_records(start_day, end_day, services):
+                    writer.writerow([record.get(field, "") for field in self.EXPORT_FIELDS])
+                    count += 1
+        return count
+
+# ======================= Replication =======================
+class ReplicationLeader:
+    """Streams counter changes to follower kiosks as JSON lines over TCP"""
+    
+    LOG_SIZE = 1024
+    HEARTBEAT = 5
+    
+    def __init__(self, host, port, logger, state):
+        self.host = host
+        self.port = port
+        self.logger = logger
+        # A new epoch tells followers that sequence numbers restarted
+        self.epoch = f"{os.getpid()}-{int(time.time() * 1000)}"
+        self.seq = 0
+        self.state = dict(state)
+        self.log = deque(maxlen=self.LOG_SIZE)
+        self.clients = []
+        self.lock = threading.Lock()
+        self.server = None
+        self.running = False
+    
+    def start(self):
+        """Listen for followers"""
+        self.server = socket.create_server((self.host, self.port))
+        self.running = True
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+        self.logger.info(f"Replication leader listening on {self.host}:{self.port}")
+    
+    def stop(self):
+        self.running = False
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+    
+    def accept_loop(self):
+        while self.running:
+            try:
+                connection, address = self.server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.serve_follower, args=(connection, address), daemon=True).start()
+    
+    def publish(self, kind, state):
+        """Send a state change to every follower; unchanged state is not sent"""
+        with self.lock:
+            if state == self.state:
+                return
+            self.seq += 1
+            self.state = dict(state)
+            event = {"type": kind, "seq": self.seq, "state": self.state}
+            self.log.append(event)
+            for outbox in self.clients:
+                outbox.put(event)
+    
+    def serve_follower(self, connection, address):
+        """Resume a follower from its sequence number, or resync it from a snapshot"""
+        outbox = queue.Queue()
+        try:
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            hello = json.loads(connection.makefile('r', encoding='utf-8').readline() or "{}")
+            last_seq = hello.get("last_seq", 0)
+            
+            with self.lock:
+                resumable = hello.get("epoch") == self.epoch and (
+                    last_seq == self.seq or (self.log and last_seq >= self.log[0]["seq"] - 1))
+                if resumable:
+                    backlog = [event for event in self.log if event["seq"] > last_seq]
+                else:
+                    backlog = [{"type": "snapshot", "seq": self.seq, "epoch": self.epoch, "state": self.state}]
+                # Queue the catch-up before live events so the follower never sees them out of order
+                for event in backlog:
+                    outbox.put(event)
+                self.clients.append(outbox)
+            
+            self.logger.info(f"Follower {address[0]}:{address[1]} connected "
+                             f"({'resumed from ' + str(last_seq) if resumable else 'snapshot'})")
+            
+            while self.running:
+                try:
+                    event = outbox.get(timeout=self.HEARTBEAT)
+                except queue.Empty:
+                    event = {"type": "heartbeat", "seq": self.seq}
+                connection.sendall((json.dumps(event) + "\n").encode('utf-8'))
+        except (OSError, ValueError) as e:
+            self.logger.info(f"Follower {address[0]}:{address[1]} disconnected: {e}")
+        finally:
+            with self.lock:
+                if outbox in self.clients:
+                    self.clients.remove(outbox)
+            connection.close()
+
+
+class ReplicationFollower:
+    """Receives counter changes from a leader kiosk and queues them for the Tk thread"""
+    
+    def __init__(self, host, port, logger):
+        self.host = host
+        self.port = port
+        self.logger = logger
+        self.events = queue.Queue()
+        self.last_seq = 0
+        self.epoch = None
+        self.connection = None
+        self.connected = False
+        self.running = False
+    
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+    
+    def stop(self):
+        self.running = False
+        if self.connection is not None:
+            try:
+                self.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+    
+    def run(self):
+        """Connect, stream events and reconnect with backoff"""
+        delay = 0.5
+        while self.running:
+            try:
+                with socket.create_connection((self.host, self.port), timeout=5) as connection:
+                    self.connection = connection
+                    connection.settimeout(ReplicationLeader.HEARTBEAT * 3)
+                    hello = {"last_seq": self.last_seq, "epoch": self.epoch}
+                    connection.sendall((json.dumps(hello) + "\n").encode('utf-8'))
+                    self.connected = True
+                    delay = 0.5
+                    self.logger.info(f"Following leader at {self.host}:{self.port} from sequence {self.last_seq}")
+                    
+                    for line in connection.makefile('r', encoding='utf-8'):
+                        event = json.loads(line)
+                        if event["type"] == "heartbeat":
+                            continue
+                        if event["type"] == "snapshot":
+                            if event["epoch"] == self.epoch and event["seq"] <= self.last_seq:
+                                continue
+                            self.epoch = event["epoch"]
+                        elif event["seq"] <= self.last_seq:
+                            continue
+                        self.last_seq = event["seq"]
+                        self.events.put(event)
+            except (OSError, ValueError) as e:
+                if self.running:
+                    self.logger.debug(f"Replication connection lost: {e}")
+            finally:
+                self.connection = None
+                self.connected = False
+            
+            if self.running:
+                time.sleep(delay)
+                delay = min(delay * 2, 5)
+    
+    def drain(self):
+        """Return the events received since the last call"""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
 # ======================= Enhanced Data Manager =======================
 class EnhancedDataManager:
     """Enhanced data management with auto-save and recovery"""
@@ -298,25 +1480,23 @@ class EnhancedDataManager:
     def __init__(self):
         self.setup_directories()
         self.logger = self.setup_logging()
+        self.writer = AtomicFileWriter()
+        self.counters = MappedCounterFile(Config.COUNTER_FILE)
+        self.storage_format = "json"
+        self.queue_extras = None
         self.auto_save_enabled = True
         self.setup_signal_handlers()
         
     def setup_directories(self):
         """Create necessary directories"""
         for directory in [Config.DATA_DIR, Config.ASSETS_DIR, Config.LOGS_DIR, 
-                         Config.FONTS_DIR, Config.TICKET_DESIGNS_DIR, Config.BACKUP_DIR]:
+                         Config.FONTS_DIR, Config.TICKET_DESIGNS_DIR, Config.BACKUP_DIR,
+                         Config.HISTORY_DIR]:
             os.makedirs(directory, exist_ok=True)
     
     def setup_logging(self):
         """Setup logging"""
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(Config.LOG_FILE, encoding='utf-8'),
-                logging.StreamHandler()
-            ]
-        )
+        log_pipeline.start(Config.LOG_FILE)
         return logging.getLogger(__name__)
     
     def setup_signal_handlers(self):
@@ -330,63 +1510,83 @@ class EnhancedDataManager:
         signal.signal(signal.SIGTERM, signal_handler)
         atexit.register(self.cleanup)
     
+    def read_json(self, path):
+        """Read a JSON object, returning None if it is missing or damaged"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else None
+        except Exception as e:
+            self.logger.error(f"Ignoring damaged file {path}: {e}")
+            return None
+    
+    def read_snapshot(self, path):
+        """Read a snapshot file, returning (data, fingerprint) or (None, 0)"""
+        if not os.path.exists(path):
+            return None, 0
+        try:
+            with open(path, 'rb') as f:
+                data, fingerprint = SnapshotCodec.decode(f.read())
+            return (data, fingerprint) if isinstance(data, dict) else (None, 0)
+        except Exception as e:
+            self.logger.error(f"Ignoring damaged snapshot {path}: {e}")
+            return None, 0
+    
+    @staticmethod
+    def get_generation(data):
+        """Return the save generation recorded in settings or queue data"""
+        if not isinstance(data, dict):
+            return 0
+        if "generation" in data:
+            return data.get("generation", 0)
+        return data.get("auto_save", {}).get("generation", 0)
+    
     def load_settings(self):
-        """Load settings with auto-recovery"""
-        # First check for auto-save file
-        if os.path.exists(Config.AUTO_SAVE_FILE):
-            try:
-                with open(Config.AUTO_SAVE_FILE, 'r', encoding='utf-8') as f:
-                    auto_save_data = json.load(f)
-                
-                self.logger.info("Found auto-save data, attempting recovery...")
-                
-                # Check if auto-save data is newer than regular settings
-                if os.path.exists(Config.SETTINGS_FILE):
-                    settings_mtime = os.path.getmtime(Config.SETTINGS_FILE)
-                    auto_save_mtime = os.path.getmtime(Config.AUTO_SAVE_FILE)
-                    
-                    if auto_save_mtime > settings_mtime:
-                        self.logger.info("Auto-save data is newer, using it for recovery")
-                        # Merge auto-save data
-                        recovered_settings = auto_save_data.get("settings", {})
-                        recovered_queue = auto_save_data.get("queue", {})
-                        
-                        # Load regular settings and merge
-                        with open(Config.SETTINGS_FILE, 'r', encoding='utf-8') as f:
-                            regular_settings = json.load(f)
-                        
-                        # Merge recovered data
-                        self.merge_settings(regular_settings, recovered_settings)
-                        
-                        # Save merged settings
-                        with open(Config.SETTINGS_FILE, 'w', encoding='utf-8') as f:
-                            json.dump(regular_settings, f, indent=4, ensure_ascii=False)
-                        
-                        # Update queue if needed
-                        if recovered_queue:
-                            with open(Config.QUEUE_FILE, 'w', encoding='utf-8') as f:
-                                json.dump(recovered_queue, f, indent=4)
-                        
-                        self.logger.info("Settings recovered from auto-save")
-            except Exception as e:
-                self.logger.error(f"Error recovering from auto-save: {e}")
+        """Load the newest valid settings generation"""
+        # Candidates ranked by generation; ties prefer the main file
+        candidates = []
+        settings = self.read_json(Config.SETTINGS_FILE)
+        if settings is not None:
+            candidates.append((self.get_generation(settings), 1, "settings file", settings))
+        
+        snapshot, fingerprint = self.read_snapshot(Config.SETTINGS_SNAPSHOT_FILE)
+        if snapshot is not None:
+            # A snapshot written against the same defaults is already complete
+            if fingerprint == SnapshotCodec.defaults_fingerprint():
+                candidates.append((self.get_generation(snapshot), 2, "snapshot", snapshot))
+            else:
+                candidates.append((self.get_generation(snapshot), 2, "snapshot (older layout)", snapshot))
+        
+        auto_save_data = self.read_json(Config.AUTO_SAVE_FILE)
+        if auto_save_data and isinstance(auto_save_data.get("settings"), dict):
+            recovered = auto_save_data["settings"]
+            candidates.append((self.get_generation(recovered), 0, "auto-save", recovered))
+        
+        # Backups are only needed when both primary copies are unreadable
+        if not candidates:
+            for backup_file in reversed(self.list_backups()):
+                backup_data = self.read_json(os.path.join(Config.BACKUP_DIR, backup_file))
+                if backup_data and isinstance(backup_data.get("settings"), dict):
+                    recovered = backup_data["settings"]
+                    candidates.append((self.get_generation(recovered), 0, f"backup {backup_file}", recovered))
+                    break
         
-        # Load settings normally
-        if os.path.exists(Config.SETTINGS_FILE):
-            try:
-                with open(Config.SETTINGS_FILE, 'r', encoding='utf-8') as f:
-                    settings = json.load(f)
-                
+        if candidates:
+            generation, _, source, settings = max(candidates, key=lambda c: (c[0], c[1]))
+            
+            if source != "snapshot":
                 # Merge with defaults for missing keys
-                default = Config.DEFAULT_SETTINGS.copy()
+                default = copy.deepcopy(Config.DEFAULT_SETTINGS)
                 self.merge_settings(default, settings)
-                self.logger.info("Settings loaded successfully")
-                return default
-            except Exception as e:
-                self.logger.error(f"Error loading settings: {e}")
+                settings = default
+            self.storage_format = settings["business_rules"].get("storage_format", "json")
+            self.logger.info(f"Settings loaded from {source} (generation {generation})")
+            return settings
         
         self.logger.info("Using default settings")
-        return Config.DEFAULT_SETTINGS.copy()
+        return copy.deepcopy(Config.DEFAULT_SETTINGS)
     
     def merge_settings(self, default, user):
         """Merge user settings with defaults"""
@@ -399,27 +1599,37 @@ class EnhancedDataManager:
     
     def save_settings(self, settings):
         """Save settings with auto-save backup"""
-        try:
-            # Save to main file
-            with open(Config.SETTINGS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(settings, f, indent=4, ensure_ascii=False)
-            
-            # Create auto-save backup
-            self.create_auto_save(settings)
-            
-            # Create periodic backup if enabled
-            if settings.get("business_rules", {}).get("create_backups", True):
-                self.create_backup(settings)
-            
-            self.logger.info("Settings saved successfully with backup")
-            return True
-        except Exception as e:
-            self.logger.error(f"Error saving settings: {e}")
-            # Try emergency save
-            self.emergency_save_simple(settings)
-            return False
+        with metrics.span("save_settings"):
+            try:
+                # Every save gets a new generation so recovery can pick the newest copy
+                auto_save = settings.setdefault("auto_save", {})
+                auto_save["generation"] = auto_save.get("generation", 0) + 1
+                
+                # Save to main file
+                self.storage_format = settings.get("business_rules", {}).get("storage_format", "json")
+                if self.storage_format == "snapshot":
+                    payload = SnapshotCodec.encode(settings, SnapshotCodec.defaults_fingerprint())
+                    self.writer.write_bytes(Config.SETTINGS_SNAPSHOT_FILE, payload, defer_dir_sync=True)
+                else:
+                    self.writer.write_json(Config.SETTINGS_FILE, settings, defer_dir_sync=True)
+                
+                # Create auto-save backup
+                self.create_auto_save(settings, defer_dir_sync=True)
+                
+                # Create periodic backup if enabled
+                if settings.get("business_rules", {}).get("create_backups", True):
+                    self.create_backup(settings, defer_dir_sync=True)
+                
+                self.writer.sync_dirs()
+                self.logger.info("Settings saved successfully with backup")
+                return True
+            except Exception as e:
+                self.logger.error(f"Error saving settings: {e}")
+                # Try emergency save
+                self.emergency_save_simple(settings)
+                return False
     
-    def create_auto_save(self, settings):
+    def create_auto_save(self, settings, defer_dir_sync=False):
         """Create auto-save file with current state"""
         try:
             auto_save_data = {
@@ -429,8 +1639,7 @@ class EnhancedDataManager:
                 "current_number": settings.get("current_number", 1)
             }
             
-            with open(Config.AUTO_SAVE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(auto_save_data, f, indent=4, ensure_ascii=False)
+            self.writer.write_json(Config.AUTO_SAVE_FILE, auto_save_data, defer_dir_sync=defer_dir_sync)
             
             # Update settings with last save time
             if "auto_save" not in settings:
@@ -444,7 +1653,7 @@ class EnhancedDataManager:
             self.logger.error(f"Error creating auto-save: {e}")
             return False
     
-    def create_backup(self, settings):
+    def create_backup(self, settings, defer_dir_sync=False):
         """Create periodic backup"""
         try:
             now = datetime.now()
@@ -460,8 +1669,7 @@ class EnhancedDataManager:
                 "version": settings.get("version", "unknown")
             }
             
-            with open(backup_file, 'w', encoding='utf-8') as f:
-                json.dump(backup_data, f, indent=4, ensure_ascii=False)
+            self.writer.write_json(backup_file, backup_data, defer_dir_sync=defer_dir_sync)
             
             # Update last backup time
             if "auto_save" in settings:
@@ -477,16 +1685,20 @@ class EnhancedDataManager:
             self.logger.error(f"Error creating backup: {e}")
             return False
     
+    def list_backups(self):
+        """Return backup file names, oldest first"""
+        try:
+            return sorted(file for file in os.listdir(Config.BACKUP_DIR)
+                          if file.startswith("backup_") and file.endswith(".json"))
+        except OSError:
+            return []
+    
     def clean_old_backups(self):
         """Clean old backup files, keep only last 10"""
         try:
-            backup_files = []
-            for file in os.listdir(Config.BACKUP_DIR):
-                if file.startswith("backup_") and file.endswith(".json"):
-                    backup_files.append(file)
+            backup_files = self.list_backups()
             
             if len(backup_files) > 10:
-                backup_files.sort()
                 files_to_delete = backup_files[:-10]  # Keep last 10
                 
                 for file in files_to_delete:
@@ -496,29 +1708,80 @@ class EnhancedDataManager:
             self.logger.error(f"Error cleaning old backups: {e}")
     
     def load_queue(self):
-        """Load queue data with recovery"""
-        if os.path.exists(Config.QUEUE_FILE):
-            try:
-                with open(Config.QUEUE_FILE, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except:
-                pass
-        return {"current_number": 1, "today_count": 0, "total_printed": 0, "last_update": ""}
+        """Load the newest valid queue generation"""
+        candidates = []
+        queue_data = self.read_json(Config.QUEUE_FILE)
+        if queue_data is not None:
+            candidates.append((self.get_generation(queue_data), 1, queue_data))
+        
+        auto_save_data = self.read_json(Config.AUTO_SAVE_FILE)
+        if auto_save_data and isinstance(auto_save_data.get("queue"), dict) and auto_save_data["queue"]:
+            candidates.append((self.get_generation(auto_save_data["queue"]), 0, auto_save_data["queue"]))
+        
+        snapshot, _ = self.read_snapshot(Config.QUEUE_SNAPSHOT_FILE)
+        if snapshot is not None:
+            candidates.append((self.get_generation(snapshot), 2, snapshot))
+        
+        try:
+            counters = self.counters.read()
+        except Exception as e:
+            self.logger.error(f"Error reading counter record: {e}")
+            counters = None
+        
+        # The newest full record keeps the other queue fields; the mapped counters are overlaid when newer
+        if candidates:
+            queue_data = dict(max(candidates, key=lambda c: (c[0], c[1]))[2])
+            if counters is not None and counters["generation"] >= self.get_generation(queue_data):
+                queue_data.update(counters)
+            return queue_data
+        if counters is not None:
+            return dict(counters)
+        return {"current_number": 1, "today_count": 0, "total_printed": 0, "last_update": "", "generation": 0}
     
     def save_queue(self, queue_data):
         """Save queue data with timestamp"""
+        with metrics.span("save_queue"):
+            try:
+                queue_data["last_update"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                queue_data["generation"] = queue_data.get("generation", 0) + 1
+                self.counters.write(queue_data)
+                
+                if self.storage_format == "snapshot":
+                    # Counters live in the mapped file; the rest is written only when it changes
+                    extras = {key: value for key, value in queue_data.items() if key not in MappedCounterFile.FIELDS}
+                    if extras != self.queue_extras:
+                        self.writer.write_bytes(Config.QUEUE_SNAPSHOT_FILE, SnapshotCodec.encode(queue_data))
+                        self.queue_extras = extras
+                    return True
+                
+                self.writer.write_json(Config.QUEUE_FILE, queue_data, ensure_ascii=True, defer_dir_sync=True)
+                
+                # Also update auto-save
+                self.update_auto_save_queue(queue_data)
+                self.writer.sync_dirs()
+                
+                return True
+            except Exception as e:
+                self.logger.error(f"Error saving queue: {e}")
+                return False
+    
+    def record_counters(self, queue_data, flush=True):
+        """Durably record a counter change without rewriting any JSON file"""
+        with metrics.span("record_counters"):
+            try:
+                queue_data["generation"] = queue_data.get("generation", 0) + 1
+                self.counters.write(queue_data, flush=flush)
+                return True
+            except Exception as e:
+                self.logger.error(f"Error recording counters: {e}")
+                return False
+    
+    def flush_counters(self):
+        """Flush counter writes made with a deferred durability cadence"""
         try:
-            queue_data["last_update"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            with open(Config.QUEUE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(queue_data, f, indent=4)
-            
-            # Also update auto-save
-            self.update_auto_save_queue(queue_data)
-            
-            return True
+            self.counters.flush()
         except Exception as e:
-            self.logger.error(f"Error saving queue: {e}")
-            return False
+            self.logger.error(f"Error flushing counters: {e}")
     
     def update_auto_save_queue(self, queue_data):
         """Update queue data in auto-save file"""
@@ -530,8 +1793,7 @@ class EnhancedDataManager:
                 auto_save["queue"] = queue_data
                 auto_save["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 
-                with open(Config.AUTO_SAVE_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(auto_save, f, indent=4, ensure_ascii=False)
+                self.writer.write_json(Config.AUTO_SAVE_FILE, auto_save, defer_dir_sync=True)
             except:
                 pass
     
@@ -550,8 +1812,7 @@ class EnhancedDataManager:
             
             # Save design
             design_data["last_saved"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            with open(design_file, 'w', encoding='utf-8') as f:
-                json.dump(design_data, f, indent=4, ensure_ascii=False)
+            self.writer.write_json(design_file, design_data)
             
             self.logger.info(f"Ticket design '{design_name}' saved successfully with backup")
             return True
@@ -592,8 +1853,7 @@ class EnhancedDataManager:
                 "settings_version": settings.get("version", "unknown")
             }
             
-            with open(emergency_file, 'w', encoding='utf-8') as f:
-                json.dump(emergency_data, f, indent=4)
+            self.writer.write_json(emergency_file, emergency_data, ensure_ascii=True)
             
             self.logger.info(f"Emergency save created: {emergency_file}")
         except:
@@ -602,6 +1862,7 @@ class EnhancedDataManager:
     def cleanup(self):
         """Cleanup on exit"""
         self.logger.info("Performing cleanup...")
+        self.counters.close()
         # Remove auto-save file on normal exit
         if os.path.exists(Config.AUTO_SAVE_FILE):
             try:
@@ -617,48 +1878,26 @@ class AutoSaveManager:
     def __init__(self, app):
         self.app = app
         self.is_running = False
-        self.save_thread = None
         
     def start(self):
-        """Start auto-save thread"""
+        """Register the auto-save job with the app scheduler"""
+        interval = self.app.settings.get("business_rules", {}).get("auto_save_interval", 10)
         self.is_running = True
-        self.save_thread = threading.Thread(target=self.auto_save_loop, daemon=True)
-        self.save_thread.start()
+        self.app.scheduler.add("auto_save", interval, self.perform_auto_save)
         self.app.data_manager.logger.info("Auto-save manager started")
     
     def stop(self):
-        """Stop auto-save thread"""
+        """Remove the auto-save job"""
         self.is_running = False
-        if self.save_thread:
-            self.save_thread.join(timeout=2)
+        self.app.scheduler.remove("auto_save")
         self.app.data_manager.logger.info("Auto-save manager stopped")
     
-    def auto_save_loop(self):
-        """Auto-save loop running in background"""
-        while self.is_running:
-            try:
-                # Get save interval from settings
-                interval = self.app.settings.get("business_rules", {}).get("auto_save_interval", 10)
-                
-                # Wait for interval
-                time.sleep(interval)
-                
-                # Perform auto-save
-                if self.is_running:
-                    self.perform_auto_save()
-                    
-            except Exception as e:
-                self.app.data_manager.logger.error(f"Error in auto-save loop: {e}")
-    
     def perform_auto_save(self):
         """Perform auto-save operation"""
         try:
-            # Save current state
+            # Save current state (this also refreshes the auto-save file)
             self.app.save_current_state()
             
-            # Create auto-save file
-            self.app.data_manager.create_auto_save(self.app.settings)
-            
             # Log auto-save
             save_count = self.app.settings.get("auto_save", {}).get("save_count", 0)
             self.app.data_manager.logger.debug(f"Auto-save #{save_count} completed")
@@ -666,144 +1905,1413 @@ class AutoSaveManager:
         except Exception as e:
             self.app.data_manager.logger.error(f"Error in auto-save: {e}")
 
+# ======================= Periodic Scheduler =======================
+class PeriodicScheduler:
+    """Runs every periodic job from a single timer on the Tk loop"""
+    
+    def __init__(self, root, logger):
+        self.root = root
+        self.logger = logger
+        self.tasks = {}
+        self.after_id = None
+        self.running = False
+        self.label_texts = {}
+    
+    def add(self, name, interval, callback):
+        """Add or replace a job; wake-ups are aligned to multiples of the interval"""
+        interval = max(0.1, float(interval))
+        now = time.time()
+        self.tasks[name] = {
+            "interval": interval,
+            "callback": callback,
+            "next_run": (now // interval + 1) * interval
+        }
+        self.reschedule()
+    
+    def remove(self, name):
+        """Remove a job if it is registered"""
+        if self.tasks.pop(name, None) is not None:
+            self.reschedule()
+    
+    def start(self):
+        """Start the timer"""
+        self.running = True
+        self.reschedule()
+    
+    def stop(self):
+        """Stop the timer"""
+        self.running = False
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+    
+    def reschedule(self):
+        """Arm the timer for the earliest due job"""
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+        if not self.running or not self.tasks:
+            return
+        
+        next_run = min(task["next_run"] for task in self.tasks.values())
+        delay = max(1, int((next_run - time.time()) * 1000) + 1)
+        self.after_id = self.root.after(delay, self.tick)
+    
+    def tick(self):
+        """Run due jobs once each, skipping runs missed while the loop was busy"""
+        self.after_id = None
+        now = time.time()
+        
+        for name, task in list(self.tasks.items()):
+            if task["next_run"] > now:
+                continue
+            missed = int((now - task["next_run"]) // task["interval"])
+            task["next_run"] += task["interval"] * (missed + 1)
+            try:
+                task["callback"]()
+            except Exception as e:
+                self.logger.error(f"Error in periodic job '{name}': {e}")
+        
+        self.reschedule()
+    
+    def set_label_text(self, label, text):
+        """Update a label only when its text actually changes"""
+        if self.label_texts.get(label) != text:
+            self.label_texts[label] = text
+            label.config(text=text)
+
+# ======================= Printer Transports =======================
+class PrinterTransport:
+    """Buffered byte channel to a printer; subclasses supply the raw I/O"""
+    
+    BUFFER_SIZE = 4096
+    has_status = True  # Can answer DLE EOT status requests
+    
+    def __init__(self, target):
+        self.target = target
+        self.buffer = bytearray()
+    
+    @staticmethod
+    def create(target, baud):
+        """Pick a transport from the target: tcp://host:port, host:port, file:path or a serial port"""
+        if target.startswith("file:"):
+            path = target[5:]
+            return FileTransport(path[2:] if path.startswith("//") else path)
+        if target.startswith("tcp://") or TcpTransport.looks_like_address(target):
+            return TcpTransport(target)
+        return SerialTransport(target, baud)
+    
+    def open(self):
+        pass
+    
+    def close(self):
+        pass
+    
+    def write_raw(self, data):
+        raise NotImplementedError
+    
+    def read(self, size, timeout):
+        return b''
+    
+    def discard_input(self):
+        pass
+    
+    def write(self, data):
+        """Queue bytes, sending full buffers as they fill"""
+        self.buffer += data
+        if len(self.buffer) >= self.BUFFER_SIZE:
+            self.flush()
+    
+    def flush(self):
+        """Send everything queued so far"""
+        while self.buffer:
+            chunk = bytes(self.buffer[:self.BUFFER_SIZE])
+            self.write_raw(chunk)
+            del self.buffer[:len(chunk)]
+    
+    def query_status(self, requests, timeout=0.3):
+        """Send DLE EOT n for each request; returns {n: reply byte} or None if silent"""
+        self.flush()
+        self.discard_input()
+        replies = {}
+        for request in requests:
+            self.write_raw(Config.DLE + b'\x04' + bytes([request]))
+            reply = self.read(1, timeout)
+            if not reply:
+                return None
+            replies[request] = reply[0]
+        return replies
+
+
+class SerialTransport(PrinterTransport):
+    """USB-serial or RS-232 printer, kept open between tickets"""
+    
+    BUFFER_SIZE = 1024
+    
+    def __init__(self, target, baud):
+        super().__init__(target)
+        self.baud = baud
+        self.serial = None
+    
+    def open(self):
+        self.serial = serial.Serial(
+            self.target,
+            self.baud,
+            timeout=2,
+            write_timeout=10,
+            bytesize=serial.EIGHTBITS,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE
+        )
+    
+    def close(self):
+        if self.serial is not None:
+            self.serial.close()
+            self.serial = None
+    
+    def write_raw(self, data):
+        self.serial.write(data)
+    
+    def flush(self):
+        super().flush()
+        self.serial.flush()  # Returns once the driver has sent everything
+    
+    def read(self, size, timeout):
+        previous = self.serial.timeout
+        self.serial.timeout = timeout
+        try:
+            return self.serial.read(size)
+        finally:
+            self.serial.timeout = previous
+    
+    def discard_input(self):
+        self.serial.reset_input_buffer()
+
+
+class TcpTransport(PrinterTransport):
+    """Raw network printer (port 9100) over a persistent keep-alive socket"""
+    
+    BUFFER_SIZE = 16384
+    DEFAULT_PORT = 9100
+    
+    def __init__(self, target):
+        super().__init__(target)
+        address = target[6:] if target.startswith("tcp://") else target
+        host, _, port = address.rpartition(":") if ":" in address else (address, "", "")
+        self.address = (host, int(port) if port else self.DEFAULT_PORT)
+        self.sock = None
+    
+    @staticmethod
+    def looks_like_address(target):
+        host, _, port = target.rpartition(":")
+        return bool(host) and port.isdigit() and "/" not in host and "\\" not in host
+    
+    def open(self):
+        self.sock = socket.create_connection(self.address, timeout=5)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for option, value in (("TCP_KEEPIDLE", 30), ("TCP_KEEPINTVL", 10), ("TCP_KEEPCNT", 3)):
+            if hasattr(socket, option):
+                self.sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+    
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+    
+    def ensure_connected(self):
+        """Reconnect if the printer closed an idle connection"""
+        if self.sock is not None:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            if readable:
+                try:
+                    self.sock.setblocking(False)
+                    closed = self.sock.recv(4096) == b''
+                except BlockingIOError:
+                    closed = False
+                except OSError:
+                    closed = True
+                finally:
+                    if self.sock is not None:
+                        self.sock.settimeout(5)
+                if closed:
+                    self.close()
+        if self.sock is None:
+            self.open()
+    
+    def write_raw(self, data):
+        self.ensure_connected()
+        self.sock.sendall(data)
+    
+    def read(self, size, timeout):
+        self.sock.settimeout(timeout)
+        try:
+            return self.sock.recv(size)
+        except socket.timeout:
+            return b''
+        finally:
+            self.sock.settimeout(5)
+    
+    def discard_input(self):
+        self.ensure_connected()
+
+
+class FileTransport(PrinterTransport):
+    """Appends to a file or device node, e.g. /dev/usb/lp0 or a capture file"""
+    
+    BUFFER_SIZE = 65536
+    has_status = False
+    
+    def __init__(self, target):
+        super().__init__(target)
+        self.file = None
+    
+    def open(self):
+        self.file = open(self.target, 'ab', buffering=0)
+    
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+    
+    def write_raw(self, data):
+        self.file.write(data)
+
+
+class PrinterTransportPool:
+    """Open transports by target, shared by printing and status polling"""
+    
+    def __init__(self, baud=None):
+        self.lock = threading.RLock()  # Held while a transport is in use
+        self.baud = baud or Config.BAUD_RATE
+        self.transports = {}
+    
+    def configure(self, baud, targets=None):
+        """Close transports whose settings changed or that are no longer used"""
+        with self.lock:
+            for target, transport in list(self.transports.items()):
+                stale_baud = isinstance(transport, SerialTransport) and transport.baud != baud
+                if stale_baud or (targets is not None and target not in targets):
+                    self.drop(target)
+            self.baud = baud
+    
+    def get(self, target):
+        """Return an open transport, connecting on first use"""
+        with self.lock:
+            transport = self.transports.get(target)
+            if transport is None:
+                transport = PrinterTransport.create(target, self.baud)
+                transport.open()
+                self.transports[target] = transport
+            return transport
+    
+    def drop(self, target):
+        with self.lock:
+            transport = self.transports.pop(target, None)
+            if transport is not None:
+                try:
+                    transport.close()
+                except Exception:
+                    pass
+    
+    def close_all(self):
+        with self.lock:
+            for target in list(self.transports):
+                self.drop(target)
+
+class PrinterPortScanner:
+    """Finds ESC/POS printers by sending DLE EOT 1 to candidate ports in parallel"""
+    
+    def __init__(self, transports, timeout=0.3):
+        self.transports = transports
+        self.timeout = timeout
+    
+    @staticmethod
+    def candidate_ports():
+        """Serial ports the OS reports, plus USB printer device nodes"""
+        ports = [p.device for p in serial.tools.list_ports.comports()]
+        if os.name != 'nt' and os.path.isdir("/dev/usb"):
+            ports += sorted(os.path.join("/dev/usb", n) for n in os.listdir("/dev/usb") if n.startswith("lp"))
+        return ports
+    
+    @staticmethod
+    def valid_status(byte):
+        # Bits 1 and 4 are fixed high, bits 0 and 7 fixed low in every status reply
+        return byte & 0x93 == 0x12
+    
+    def probe(self, target, baud):
+        """Return True if an ESC/POS printer answers on target at baud"""
+        live = self.transports.transports.get(target)
+        if live is not None and getattr(live, "baud", baud) == baud:
+            # Already connected; ask through the open session instead of a second handle
+            with self.transports.lock:
+                replies = live.query_status((1,), self.timeout)
+            return bool(replies) and self.valid_status(replies[1])
+        
+        transport = PrinterTransport.create(target, baud)
+        if not transport.has_status:
+            transport.open()
+            transport.close()
+            return True
+        try:
+            transport.open()
+            replies = transport.query_status((1,), self.timeout)
+            return bool(replies) and self.valid_status(replies[1])
+        finally:
+            transport.close()
+    
+    def probe_port(self, target, bauds):
+        """Try each baud rate on one port; returns (target, baud) or None"""
+        for baud in bauds:
+            try:
+                if self.probe(target, baud):
+                    return target, baud
+            except (serial.SerialException, OSError, ValueError):
+                if not isinstance(PrinterTransport.create(target, baud), SerialTransport):
+                    return None
+        return None
+    
+    def scan(self, ports=None, bauds=Config.PROBE_BAUD_RATES):
+        """Probe ports concurrently (each port's baud rates in turn); returns [(port, baud)]"""
+        ports = self.candidate_ports() if ports is None else ports
+        if not ports:
+            return []
+        with ThreadPoolExecutor(max_workers=min(8, len(ports))) as pool:
+            results = pool.map(lambda port: self.probe_port(port, bauds), ports)
+            return [r for r in results if r]
+
+# ======================= Printer Supervisor =======================
+class PrinterSupervisor:
+    """Polls printer status (DLE EOT) while idle and picks a working printer"""
+    
+    STATUS_REQUESTS = (1, 2, 4)  # Printer, offline cause, roll paper sensor
+    
+    def __init__(self, logger, transports=None):
+        self.logger = logger
+        self.transports = transports or PrinterTransportPool()
+        self.states = {}
+        self.ports = []
+        self.interval = 15
+        self.last_activity = 0.0
+        self.running = False
+        self.wake = threading.Event()
+        self.thread = None
+    
+    def configure(self, ports, baud, interval):
+        """Set the printers in priority order"""
+        self.ports = [p for i, p in enumerate(ports) if p and p not in ports[:i]]
+        self.transports.configure(baud, self.ports)
+        self.interval = max(1, interval)
+        for port in list(self.states):
+            if port not in self.ports:
+                del self.states[port]
+        self.wake.set()
+    
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="printer-supervisor", daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        self.running = False
+        self.wake.set()
+    
+    def run(self):
+        while self.running:
+            woken = self.wake.wait(self.interval)
+            self.wake.clear()
+            if not self.running:
+                break
+            # Only poll while idle unless asked to; a recent print already told us how the printer is
+            if woken or time.monotonic() - self.last_activity >= self.interval:
+                self.poll(blocking=False)
+    
+    def poll(self, blocking=True):
+        """Query every configured printer"""
+        for port in list(self.ports):
+            if not self.transports.lock.acquire(blocking=blocking):
+                return
+            try:
+                state = self.query(port)
+            finally:
+                self.transports.lock.release()
+            self.update(port, state)
+    
+    def query(self, port):
+        """Ask one printer for its real-time status"""
+        try:
+            transport = self.transports.get(port)
+            if not transport.has_status:
+                return self.parse_status({})
+            replies = transport.query_status(self.STATUS_REQUESTS)
+        except (serial.SerialException, OSError, ValueError) as e:
+            self.transports.drop(port)
+            return self.offline_state(str(e))
+        if replies is None:
+            return self.offline_state("no status reply")
+        return self.parse_status(replies)
+    
+    @staticmethod
+    def offline_state(error):
+        return {"online": False, "cover_open": False, "paper_out": False,
+                "paper_near_end": False, "error": error}
+    
+    @staticmethod
+    def parse_status(replies):
+        """Decode DLE EOT 1, 2 and 4 reply bytes"""
+        printer = replies.get(1, 0)
+        cause = replies.get(2, 0)
+        paper = replies.get(4, 0)
+        return {
+            "online": not printer & 0x08,
+            "cover_open": bool(cause & 0x04),
+            "paper_out": bool(cause & 0x20 or paper & 0x60),
+            "paper_near_end": bool(paper & 0x0C),
+            "error": "printer error" if cause & 0x40 else ""
+        }
+    
+    def update(self, port, state):
+        if port not in self.ports:
+            return
+        previous = self.describe(port)
+        state["checked"] = datetime.now().strftime("%H:%M:%S")
+        self.states[port] = state
+        current = self.describe(port)
+        if current != previous:
+            log = self.logger.info if self.usable(port) else self.logger.warning
+            log(f"Printer {port}: {current}" + (f" ({state['error']})" if state["error"] else ""))
+    
+    def mark_failed(self, port, error):
+        """Record a failed job so later jobs skip the port until it recovers"""
+        self.update(port, self.offline_state(error))
+    
+    def mark_ok(self, port):
+        state = dict(self.states.get(port) or self.parse_status({}))
+        state.update(online=True, error="")
+        self.update(port, state)
+    
+    def usable(self, port):
+        state = self.states.get(port)
+        return state is None or (state["online"] and not state["paper_out"]
+                                 and not state["cover_open"] and not state["error"])
+    
+    def candidates(self):
+        """Ports to try for the next job, best first; known-bad ports are left out"""
+        self.last_activity = time.monotonic()
+        ports = [p for p in self.ports if self.usable(p)]
+        if not ports and self.ports:
+            # Everything looked bad last time; try the main printer now and re-probe in the background
+            self.wake.set()
+            ports = self.ports[:1]
+        return ports
+    
+    def describe(self, port):
+        state = self.states.get(port)
+        if state is None:
+            return "unknown"
+        if not state["online"] and not (state["paper_out"] or state["cover_open"]):
+            return "offline"
+        if state["cover_open"]:
+            return "cover open"
+        if state["paper_out"]:
+            return "paper out"
+        if state["error"]:
+            return state["error"]
+        if state["paper_near_end"]:
+            return "paper low"
+        return "ready"
+    
+    def summary(self):
+        """One line for the status bar"""
+        if not self.ports:
+            return "🖨️ No printer configured"
+        primary = self.ports[0]
+        text = f"🖨️ Printer: {self.describe(primary)}"
+        if not self.usable(primary):
+            backup = next((p for p in self.ports[1:] if self.usable(p)), None)
+            text += f" | Using {backup}" if backup else " | No printer available"
+        return text
+
+# ======================= Text Encoding =======================
+class EscPosTextEncoder:
+    """Encodes text as code page segments, each introduced by ESC t"""
+    
+    CACHE_SIZE = 1024
+    
+    def __init__(self, preferred="cp437"):
+        self.preferred = preferred
+        codepages = list(Config.ESC_T_CODEPAGES)
+        if preferred in codepages:
+            codepages.remove(preferred)
+            codepages.insert(0, preferred)
+        self.codepages = codepages
+        self.char_pages = {}
+        self.cache = {}
+    
+    def pages_for(self, char):
+        """Code pages that contain a character, in preference order"""
+        pages = self.char_pages.get(char)
+        if pages is None:
+            pages = []
+            for codepage in self.codepages:
+                try:
+                    char.encode(codepage)
+                    pages.append(codepage)
+                except UnicodeEncodeError:
+                    pass
+            pages = self.char_pages[char] = tuple(pages)
+        return pages
+    
+    def segments(self, text):
+        """Split text into (code page, text) runs; None if a character fits no code page"""
+        text = "".join(c if self.pages_for(c) else text_shaper.nearest_form(c) for c in text)
+        runs = []
+        i = 0
+        while i < len(text):
+            candidates = self.pages_for(text[i])
+            if not candidates:
+                return None
+            # Take the code page that covers the longest run from here
+            best_page, best_end = None, i
+            for codepage in candidates:
+                end = i + 1
+                while end < len(text) and codepage in self.pages_for(text[end]):
+                    end += 1
+                if end > best_end:
+                    best_page, best_end = codepage, end
+            if runs and runs[-1][0] == best_page:
+                runs[-1] = (best_page, runs[-1][1] + text[i:best_end])
+            else:
+                runs.append((best_page, text[i:best_end]))
+            i = best_end
+        return runs
+    
+    def encode(self, text):
+        """ESC t switches plus encoded bytes, or None if the text needs rasterizing"""
+        if text in self.cache:
+            return self.cache[text]
+        runs = self.segments(text)
+        encoded = None
+        if runs is not None:
+            encoded = b''.join(Config.ESC + b't' + bytes([Config.ESC_T_CODEPAGES[page]]) + part.encode(page)
+                               for page, part in runs)
+        if len(self.cache) >= self.CACHE_SIZE:
+            self.cache.clear()
+        self.cache[text] = encoded
+        return encoded
+
 # ======================= Enhanced Printer Service =======================
 class EnhancedPrinterService:
     """Handles ticket printing with design support"""
     
-    def __init__(self, data_manager):
+    def __init__(self, data_manager, renderer=None, supervisor=None):
         self.data_manager = data_manager
+        self.renderer = renderer or TicketRenderer()
+        self.supervisor = supervisor
+        self.transports = supervisor.transports if supervisor else PrinterTransportPool()
+        self.encoder = None
+        self.text_key = None
+        self.text_parts = None
     
-    def encode_text(self, text, encoding="cp437"):
-        """Encode text for printer"""
-        try:
-            return text.encode(encoding)
-        except:
-            return text.encode('utf-8', errors='ignore')
+    def get_encoder(self, encoding):
+        """Encoder for the preferred code page, rebuilt only when it changes"""
+        if self.encoder is None or self.encoder.preferred != encoding:
+            self.encoder = EscPosTextEncoder(encoding)
+        return self.encoder
+    
+    def encode_text(self, text, encoding="cp437"):
+        """Encode text for printer; None if no supported code page can hold it"""
+        return self.get_encoder(encoding).encode(text)
     
-    def print_ticket_with_design(self, ticket_no, settings, ticket_design=None):
-        """Print ticket with specific design including custom logo"""
-        try:
-            # Use custom design if provided, otherwise use default
+    @staticmethod
+    def rasterize_text(element, text):
+        """Print text no code page can hold as an image of the element"""
+        x0, y0, x1, y1 = element["box"]
+        width = max(x1 - x0, int(element["font"].getlength(text)) if text else 1)
+        img = Image.new("RGB", (max(1, width), max(1, y1 - y0)), "white")
+        ImageDraw.Draw(img).text((0, 0), text, font=element["font"], fill="black")
+        return TicketRenderer.to_raster(img)
+    
+    def build_ticket_bytes(self, ticket_no, settings, ticket_design=None):
+        """Build the ESC/POS stream for a ticket from the cached design layout"""
+        with metrics.span("build_ticket_bytes"):
             if ticket_design is None:
                 ticket_design = settings["ticket_design"]
             
-            # Open serial connection
-            ser = serial.Serial(
-                Config.SERIAL_PORT,
-                Config.BAUD_RATE,
-                timeout=2,
-                bytesize=serial.EIGHTBITS,
-                parity=serial.PARITY_NONE,
-                stopbits=serial.STOPBITS_ONE
-            )
-            time.sleep(0.5)
+            printer_settings = settings["printer_settings"]
+            data = [Config.ESC + b'@']
             
-            # Initialize printer
-            ser.write(Config.ESC + b'@')
-            time.sleep(0.1)
+            if printer_settings.get("print_mode", "text") == "raster":
+                data.append(self.renderer.render_raster(ticket_no, settings, ticket_design))
+            else:
+                data.append(self.build_text_stream(ticket_no, settings, ticket_design))
             
-            printer_settings = settings["printer_settings"]
-            encoding = printer_settings.get("encoding", "cp437")
+            # Feed and cut
+            data.append(b'\n' * 3)
+            if printer_settings.get("cut_after_print", True):
+                data.append(Config.GS + b'V' + b'\x00')
             
-            # Check if there's a custom ticket logo path
-            ticket_logo_path = ticket_design.get("ticket_logo_path", "")
-            use_ticket_logo = ticket_logo_path and os.path.exists(ticket_logo_path)
+            return b''.join(data)
+    
+    def build_text_stream(self, ticket_no, settings, ticket_design):
+        """Build a text-mode stream following the element order of the layout"""
+        printer_settings = settings["printer_settings"]
+        encoding = printer_settings.get("encoding", "cp437")
+        layout = self.renderer.get_layout(settings, ticket_design)
+        key = (layout.key, encoding, printer_settings.get("align_center", True),
+               printer_settings.get("double_height", True), printer_settings.get("bold_header", True))
+        if key != self.text_key:
+            self.text_parts = self.build_text_parts(layout, printer_settings, encoding)
+            self.text_key = key
+        
+        now = datetime.now()
+        data = []
+        for part in self.text_parts:
+            if isinstance(part, bytes):
+                data.append(part)
+                continue
+            text = self.renderer.get_dynamic_text(part["name"], ticket_no, ticket_design, now)
+            encoded = self.encode_text(text + "\n", encoding)
+            data.append(encoded if encoded is not None else self.rasterize_text(part, text))
+        return b''.join(data)
+    
+    def build_text_parts(self, layout, printer_settings, encoding):
+        """Encode everything but the per-ticket text once per design; dynamic elements stay as dicts"""
+        page_width = layout.size[0]
+        parts = []
+        
+        for element in layout.reading_order():
+            x0, y0, x1, y1 = element["box"]
+            
+            # Alignment from the element position on the page
+            if printer_settings.get("align_center", True) or abs((x0 + x1) / 2 - page_width / 2) < page_width * 0.15:
+                parts.append(Config.ESC + b'a\x01')
+            elif x0 > page_width * 0.55:
+                parts.append(Config.ESC + b'a\x02')
+            else:
+                parts.append(Config.ESC + b'a\x00')
+            
+            if element["kind"] == "image":
+                background = Image.new("RGB", element["image"].size, "white")
+                background.paste(element["image"], (0, 0), element["image"])
+                parts.append(TicketRenderer.to_raster(background))
+                continue
+            
+            # Map the element size onto the printer's character sizes
+            if element["pixel_size"] >= 40:
+                mode = b'\x30'  # Double height and width
+            elif element["pixel_size"] >= 24 or (element["name"] == "company" and printer_settings.get("double_height", True)):
+                mode = b'\x10'  # Double height
+            else:
+                mode = b'\x00'
+            bold = element["bold"] or (element["name"] == "company" and printer_settings.get("bold_header", True))
+            
+            parts.append(Config.ESC + b'!' + mode)
+            if bold:
+                parts.append(Config.ESC + b'E\x01')
+            if element["dynamic"]:
+                parts.append(element)
+            else:
+                encoded = self.encode_text(element["text"] + "\n", encoding)
+                if encoded is None:
+                    self.data_manager.logger.info(f"Printing '{element['name']}' as an image: no code page fits")
+                    encoded = self.rasterize_text(element, element["text"])
+                parts.append(encoded)
+            if bold:
+                parts.append(Config.ESC + b'E\x00')
+            parts.append(Config.ESC + b'!\x00')
+        
+        parts.append(Config.ESC + b'a\x00')
+        
+        # Merge neighbouring byte strings so each ticket joins only a few parts
+        merged = []
+        for part in parts:
+            if isinstance(part, bytes) and merged and isinstance(merged[-1], bytes):
+                merged[-1] += part
+            else:
+                merged.append(part)
+        return merged
+    
+    def send(self, port, payload):
+        """Write one ticket through the port's transport, reopening it next time on failure"""
+        with self.transports.lock:
+            try:
+                transport = self.transports.get(port)
+                transport.write(payload)
+                transport.flush()
+            except Exception:
+                self.transports.drop(port)
+                raise
+    
+    def print_ticket_with_design(self, ticket_no, settings, ticket_design=None):
+        """Print ticket with specific design including custom logo"""
+        with metrics.span("print_ticket"):
+            try:
+                # Use custom design if provided, otherwise use default
+                if ticket_design is None:
+                    ticket_design = settings["ticket_design"]
+                
+                payload = self.build_ticket_bytes(ticket_no, settings, ticket_design)
+            except Exception as e:
+                metrics.increment("print_failures")
+                self.data_manager.logger.error(f"Printing failed: {e}")
+                return False
             
-            # Print custom logo if enabled and exists
-            if ticket_design.get("show_logo", True) and use_ticket_logo:
-                try:
-                    # Note: Actual logo printing requires special printer commands
-                    # For now, we'll just print text indication
-                    ser.write(self.encode_text("[TICKET LOGO]\n", encoding))
-                    ser.write(self.encode_text("-" * 32 + "\n", encoding))
-                except:
-                    pass  # Skip if logo printing fails
+            if self.supervisor:
+                ports = self.supervisor.candidates()
+            else:
+                printer_settings = settings["printer_settings"]
+                self.transports.configure(printer_settings.get("baud_rate", Config.BAUD_RATE))
+                ports = [printer_settings.get("port") or Config.SERIAL_PORT]
+            if not ports:
+                metrics.increment("print_failures")
+                self.data_manager.logger.error(f"Printing failed: no printer available for ticket #{ticket_no}")
+                return False
             
-            # Print company info if enabled
-            if ticket_design.get("company_info", True):
-                if settings.get("company_name"):
-                    if printer_settings.get("align_center", True):
-                        ser.write(Config.ESC + b'a\x01')  # Center align
-                    
-                    if printer_settings.get("bold_header", True):
-                        ser.write(Config.ESC + b'E\x01')  # Bold on
-                    
-                    if printer_settings.get("double_height", True):
-                        ser.write(Config.ESC + b'!\x30')  # Double height and width
-                    
-                    ser.write(self.encode_text(settings["company_name"] + "\n", encoding))
-                    ser.write(Config.ESC + b'!\x00')  # Normal text
-                    ser.write(Config.ESC + b'E\x00')  # Bold off
+            for port in ports:
+                try:
+                    self.send(port, payload)
+                except Exception as e:
+                    self.data_manager.logger.error(f"Printing on {port} failed: {e}")
+                    if self.supervisor:
+                        self.supervisor.mark_failed(port, str(e))
+                    continue
                 
-                if settings.get("company_address"):
-                    ser.write(self.encode_text(settings["company_address"] + "\n", encoding))
+                if self.supervisor:
+                    self.supervisor.mark_ok(port)
+                    if port != self.supervisor.ports[0]:
+                        metrics.increment("printer_failovers")
                 
-                if settings.get("company_phone"):
-                    ser.write(self.encode_text(settings["company_phone"] + "\n", encoding))
+                # Log successful print
+                design_name = ticket_design.get("design_name", "default")
+                self.data_manager.logger.info(
+                    f"Ticket #{ticket_no} printed successfully on {port} with design '{design_name}'"
+                )
                 
-                ser.write(b'\n' + self.encode_text("=" * 32 + "\n\n", encoding))
-            
-            # Print ticket number
-            ser.write(Config.ESC + b'a\x01')  # Center align
-            prefix = ticket_design.get("number_prefix", "Ticket #")
-            ser.write(self.encode_text(prefix + "\n", encoding))
-            
-            # Large ticket number
-            ser.write(Config.ESC + b'!\x30')  # Double height and width
-            ser.write(self.encode_text(f"{ticket_no:04d}\n\n", encoding))
-            ser.write(Config.ESC + b'!\x00')  # Normal text
+                return True
             
-            # Print date and time
-            now = datetime.now()
+            metrics.increment("print_failures")
+            return False
+
+# ======================= Font Registry =======================
+class FontRegistry:
+    """Discovers fonts in FONTS_DIR and shares Tk and PIL font objects across the app"""
+    
+    FONT_EXTENSIONS = (".ttf", ".otf", ".ttc")
+    # System fonts tried for PIL when a family has no file in fonts/
+    FALLBACK_FILES = {
+        False: ["arial.ttf", "Arial.ttf", "DejaVuSans.ttf", "LiberationSans-Regular.ttf"],
+        True: ["arialbd.ttf", "Arial Bold.ttf", "DejaVuSans-Bold.ttf", "LiberationSans-Bold.ttf"]
+    }
+    MEASURE_CACHE_SIZE = 4096
+    
+    def __init__(self):
+        self.files = {}  # (family lower-case, bold) -> path
+        self.families = []
+        self.pil_fonts = {}
+        self.tk_fonts = {}
+        self.measurements = {}
+        self.discovered = False
+    
+    def discover(self, directory=None):
+        """Index the font files in the fonts folder by family and weight"""
+        directory = directory or Config.FONTS_DIR
+        self.discovered = True
+        if not os.path.isdir(directory):
+            return 0
+        found = 0
+        for name in sorted(os.listdir(directory)):
+            if not name.lower().endswith(self.FONT_EXTENSIONS):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                family, style = ImageFont.truetype(path, 12).getname()
+            except OSError:
+                continue
+            bold = "bold" in (style or "").lower()
+            self.files.setdefault((family.lower(), bold), path)
+            if family not in self.families:
+                self.families.append(family)
+            self.register_with_os(path)
+            found += 1
+        return found
+    
+    @staticmethod
+    def register_with_os(path):
+        """Make a font file usable by Tk for this process (Windows only)"""
+        if os.name == 'nt':
+            try:
+                ctypes.windll.gdi32.AddFontResourceExW(os.path.abspath(path), 0x10, 0)  # FR_PRIVATE
+            except (AttributeError, OSError):
+                pass
+    
+    def default_family(self):
+        if not self.discovered:
+            self.discover()
+        return self.families[0] if self.families else "Arial"
+    
+    def pil_font(self, family, size, bold=False):
+        """PIL font in pixels, loaded once per (family, size, weight)"""
+        if not self.discovered:
+            self.discover()
+        family = family or self.default_family()
+        key = (family.lower(), size, bold)
+        loaded = self.pil_fonts.get(key)
+        if loaded is not None:
+            return loaded
+        
+        candidates = [self.files.get((family.lower(), bold)), self.files.get((family.lower(), not bold))]
+        candidates += self.FALLBACK_FILES[bold]
+        for font_file in candidates:
+            if not font_file:
+                continue
+            try:
+                loaded = ImageFont.truetype(font_file, size)
+                break
+            except OSError:
+                continue
+        if loaded is None:
+            try:
+                loaded = ImageFont.load_default(size)
+            except TypeError:
+                loaded = ImageFont.load_default()
+        self.pil_fonts[key] = loaded
+        return loaded
+    
+    def tk_font(self, family, size, bold=False):
+        """Shared tkinter Font per (family, size, weight); needs a Tk root"""
+        key = (family, size, bold)
+        tk_font = self.tk_fonts.get(key)
+        if tk_font is None:
+            tk_font = self.tk_fonts[key] = font.Font(family=family, size=size,
+                                                     weight="bold" if bold else "normal")
+        return tk_font
+    
+    def measure(self, text, family, size, bold=False):
+        """Width of text in pixels on screen, memoized"""
+        key = (text, family, size, bold)
+        width = self.measurements.get(key)
+        if width is None:
+            width = self.tk_font(family, size, bold).measure(text)
+            if len(self.measurements) >= self.MEASURE_CACHE_SIZE:
+                self.measurements.clear()
+            self.measurements[key] = width
+        return width
+    
+    def preload(self, specs):
+        """Create Tk fonts ahead of first use; specs are (family, size, bold)"""
+        for family, size, bold in specs:
+            self.tk_font(family, size, bold)
+
+
+font_registry = FontRegistry()
+
+# ======================= Text Shaping =======================
+class TextShaper:
+    """Arabic contextual shaping and right-to-left reordering for text drawn by PIL or Tk"""
+    
+    # Letter -> first presentation form and how many follow (isolated, final[, initial, medial])
+    FORM_RANGES = {
+        '\u0621': (0xFE80, 1), '\u0622': (0xFE81, 2), '\u0623': (0xFE83, 2), '\u0624': (0xFE85, 2),
+        '\u0625': (0xFE87, 2), '\u0626': (0xFE89, 4), '\u0627': (0xFE8D, 2), '\u0628': (0xFE8F, 4),
+        '\u0629': (0xFE93, 2), '\u062A': (0xFE95, 4), '\u062B': (0xFE99, 4), '\u062C': (0xFE9D, 4),
+        '\u062D': (0xFEA1, 4), '\u062E': (0xFEA5, 4), '\u062F': (0xFEA9, 2), '\u0630': (0xFEAB, 2),
+        '\u0631': (0xFEAD, 2), '\u0632': (0xFEAF, 2), '\u0633': (0xFEB1, 4), '\u0634': (0xFEB5, 4),
+        '\u0635': (0xFEB9, 4), '\u0636': (0xFEBD, 4), '\u0637': (0xFEC1, 4), '\u0638': (0xFEC5, 4),
+        '\u0639': (0xFEC9, 4), '\u063A': (0xFECD, 4), '\u0641': (0xFED1, 4), '\u0642': (0xFED5, 4),
+        '\u0643': (0xFED9, 4), '\u0644': (0xFEDD, 4), '\u0645': (0xFEE1, 4), '\u0646': (0xFEE5, 4),
+        '\u0647': (0xFEE9, 4), '\u0648': (0xFEED, 2), '\u0649': (0xFEEF, 2), '\u064A': (0xFEF1, 4),
+        '\u067E': (0xFB56, 4), '\u0686': (0xFB7A, 4), '\u0698': (0xFB8A, 2), '\u06A9': (0xFB8E, 4),
+        '\u06AF': (0xFB92, 4), '\u06CC': (0xFBFC, 4)
+    }
+    LAM = '\u0644'
+    LAM_ALEF = {'\u0622': 0xFEF5, '\u0623': 0xFEF7, '\u0625': 0xFEF9, '\u0627': 0xFEFB}
+    TATWEEL = '\u0640'
+    MIRRORED = {"(": ")", ")": "(", "[": "]", "]": "[", "{": "}", "}": "{", "<": ">", ">": "<"}
+    CACHE_SIZE = 2048
+    
+    # Tk on Windows shapes and reorders through the OS itself
+    NATIVE_TK = os.name == 'nt'
+    
+    def __init__(self):
+        self.cache = {}
+        self.form_of = {first + form: (first, form)
+                        for first, count in self.FORM_RANGES.values() for form in range(count)}
+    
+    def nearest_form(self, char):
+        """A simpler presentation form for code pages that lack this one (e.g. PC864)"""
+        first, form = self.form_of.get(ord(char), (None, 0))
+        if first is None or form == 0:
+            return char
+        # Medial falls back to initial, initial and final to isolated
+        return chr(first + (2 if form == 3 else 0))
+    
+    @staticmethod
+    def is_rtl(char):
+        # Arabic-Indic digits sit in the Arabic block but are numbers, laid out left to right
+        if char.isdigit():
+            return False
+        return '\u0590' <= char <= '\u08FF' or '\uFB1D' <= char <= '\uFDFF' or '\uFE70' <= char <= '\uFEFC'
+    
+    @staticmethod
+    def is_transparent(char):
+        # Harakat and other marks do not break joining
+        return '\u064B' <= char <= '\u065F' or char == '\u0670'
+    
+    def display(self, text):
+        """Visual-order, shaped form of text; strings without RTL characters pass through"""
+        visual = self.cache.get(text)
+        if visual is not None:
+            return visual
+        if not any(self.is_rtl(c) for c in text):
+            visual = text
+        elif arabic_reshaper is not None and get_display is not None:
+            visual = get_display(arabic_reshaper.reshape(text))
+        else:
+            visual = "\n".join(self.reorder(self.shape(line)) for line in text.split("\n"))
+        if len(self.cache) >= self.CACHE_SIZE:
+            self.cache.clear()
+        self.cache[text] = visual
+        return visual
+    
+    def for_tk(self, text):
+        """Text for a Tk widget"""
+        return text if self.NATIVE_TK else self.display(text)
+    
+    def joins_forward(self, char):
+        return char == self.TATWEEL or self.FORM_RANGES.get(char, (0, 0))[1] == 4
+    
+    def joins(self, char):
+        return char == self.TATWEEL or char in self.FORM_RANGES
+    
+    def shape(self, text):
+        """Replace Arabic letters with their contextual presentation forms"""
+        letters = [i for i, c in enumerate(text) if not self.is_transparent(c)]
+        result = [text[:letters[0]] if letters else text]
+        skip = None
+        for position, i in enumerate(letters):
+            char = text[i]
+            end = letters[position + 1] if position + 1 < len(letters) else len(text)
+            if i == skip:
+                result.extend(text[i + 1:end])
+                continue
+            before = text[letters[position - 1]] if position > 0 else ""
+            after = text[letters[position + 1]] if position + 1 < len(letters) else ""
+            joined_before = bool(before) and self.joins_forward(before) and self.joins(char)
+            
+            if char == self.LAM and after in self.LAM_ALEF:
+                result.append(chr(self.LAM_ALEF[after] + (1 if joined_before else 0)))
+                skip = letters[position + 1]
+            elif char in self.FORM_RANGES:
+                first, count = self.FORM_RANGES[char]
+                joined_after = count == 4 and self.joins(after)
+                if joined_before and joined_after:
+                    form = 3
+                elif joined_after:
+                    form = 2
+                elif joined_before and count > 1:
+                    form = 1
+                else:
+                    form = 0
+                result.append(chr(first + form))
+            else:
+                result.append(char)
             
+            # Keep marks after the letter they belong to
+            result.extend(text[i + 1:end])
+        return "".join(result)
+    
+    def reorder(self, line):
+        """Lay out one line in visual order: RTL runs reversed, LTR runs and numbers kept
+
+        >>> TextShaper().reorder("رقم ١٢٣ هنا") == "انه ١٢٣ مقر"
+        True
+        >>> TextShaper().reorder("رقم 45 هنا") == "انه 45 مقر"
+        True
+        """
+        kinds = ["R" if self.is_rtl(c) else "L" if c.isalnum() else "N" for c in line]
+        strong = next((k for c, k in zip(line, kinds) if k != "N" and not c.isdigit()), "L")
+        
+        # Neutrals take the direction around them, or the line's when the sides differ
+        i = 0
+        while i < len(kinds):
+            if kinds[i] != "N":
+                i += 1
+                continue
+            j = i
+            while j < len(kinds) and kinds[j] == "N":
+                j += 1
+            before = kinds[i - 1] if i > 0 else strong
+            after = kinds[j] if j < len(kinds) else strong
+            kinds[i:j] = [before if before == after else strong] * (j - i)
+            i = j
+        
+        # Group marks with their letter so reversing a run keeps them after it
+        runs = []
+        for char, kind in zip(line, kinds):
+            if runs and self.is_transparent(char):
+                runs[-1][1][-1] += char
+            elif runs and runs[-1][0] == kind:
+                runs[-1][1].append(char)
+            else:
+                runs.append((kind, [char]))
+        pieces = ["".join(self.MIRRORED.get(c, c) for c in reversed(clusters)) if kind == "R" else "".join(clusters)
+                  for kind, clusters in runs]
+        return "".join(reversed(pieces)) if strong == "R" else "".join(pieces)
+
+
+text_shaper = TextShaper()
+
+# ======================= Ticket Renderer =======================
+class TicketLayout:
+    """Element boxes for one ticket design, in printer dots"""
+
+    def __init__(self, key, scale, size):
+        self.key = key
+        self.scale = scale
+        self.size = size
+        self.elements = []
+
+    def add(self, name, kind, box, text="", font=None, color="black", bold=False,
+            dynamic=False, image=None, pixel_size=0):
+        """Add an element box"""
+        self.elements.append({
+            "name": name,
+            "kind": kind,
+            "box": box,
+            "text": text,
+            "font": font,
+            "color": color,
+            "bold": bold,
+            "dynamic": dynamic,
+            "image": image,
+            "pixel_size": pixel_size
+        })
+
+    def static_elements(self):
+        return [e for e in self.elements if not e["dynamic"]]
+
+    def dynamic_elements(self):
+        return [e for e in self.elements if e["dynamic"]]
+
+    def dynamic_rows(self):
+        """Row ranges touched by elements that change per ticket"""
+        return [(e["box"][1], e["box"][3]) for e in self.dynamic_elements()]
+
+    def reading_order(self):
+        """Elements sorted top-to-bottom, then left-to-right"""
+        return sorted(self.elements, key=lambda e: (e["box"][1], e["box"][0]))
+
+class TicketRenderer:
+    """Rasterizes a ticket design into a single PIL image at printer resolution"""
+
+    # (element, text source, font size key, default size, bold, color)
+    STATIC_TEXT_ELEMENTS = [
+        ("company", "company_name", "company_font_size", 18, False, "black"),
+        ("address", "company_address", None, 12, False, "black"),
+        ("prefix", "number_prefix", None, 14, False, "black"),
+        ("thank", "thank_message", "thank_font_size", 14, False, "black"),
+        ("warning", "warning_message", "warning_font_size", 12, False, "black"),
+        ("custom", "custom_message", "message_font_size", 12, False, "black"),
+        ("watermark", "watermark_text", "watermark_font_size", 10, False, "#888888"),
+    ]
+
+    DEFAULT_POSITIONS = {
+        "logo": (50, 50),
+        "ticket_logo": (50, 50),
+        "company": (200, 50),
+        "address": (200, 80),
+        "prefix": (50, 150),
+        "number": (50, 180),
+        "thank": (50, 280),
+        "warning": (50, 320),
+        "custom": (50, 450),
+        "date": (50, 370),
+        "time": (50, 400),
+        "watermark": (200, 500)
+    }
+
+    RASTER_BAND_HEIGHT = 256
+    INK_LUT = [255 if p < 160 else 0 for p in range(256)]  # Dark pixels become printed dots
+
+    TEXT_CACHE_SIZE = 4096
+
+    def __init__(self):
+        self.font_family = ""
+        self.logo_cache = {}
+        self.text_cache = {}
+        self.layout = None
+        self.static_key = None
+        self.static_image = None
+        self.static_bands = {}
+
+    def get_scale(self, ticket_design):
+        """Scale factor from design coordinates to printer dots"""
+        paper_width = ticket_design.get("paper_width", 80)
+        dots = Config.PRINTER_DOTS.get(paper_width, int(paper_width * 7.2))
+        return dots / Config.TICKET_CANVAS_WIDTH
+
+    def get_font(self, size, bold=False):
+        """Font in pixels for the current design's family, shared through the registry"""
+        return font_registry.pil_font(self.font_family, size, bold)
+
+    def get_position(self, ticket_design, element):
+        """Return the saved position of an element in design coordinates"""
+        default_x, default_y = self.DEFAULT_POSITIONS.get(element, (50, 50))
+        if element == "address":
+            # Older designs only stored the company position
+            default_x = ticket_design.get("company_position_x", default_x)
+            default_y = ticket_design.get("company_position_y", default_y - 30) + 30
+        return (ticket_design.get(f"{element}_position_x", default_x),
+                ticket_design.get(f"{element}_position_y", default_y))
+
+    def load_logo(self, path, width, height, opacity=1.0):
+        """Load, resize and fade a logo once per (path, mtime, size, opacity)"""
+        try:
+            key = (path, os.path.getmtime(path), width, height, opacity)
+        except OSError:
+            return None
+        if key not in self.logo_cache:
+            try:
+                img = Image.open(path).convert('RGBA')
+                img = img.resize((max(1, width), max(1, height)), Image.Resampling.LANCZOS)
+                if opacity < 1.0:
+                    lut = [int(i * opacity) for i in range(256)]
+                    img.putalpha(img.getchannel('A').point(lut))
+                self.logo_cache[key] = img
+            except Exception:
+                self.logo_cache[key] = None
+        return self.logo_cache[key]
+
+    def make_layout_key(self, settings, ticket_design):
+        """Build a cache key covering everything that affects the layout"""
+        logo_paths = [settings.get("logo", ""), ticket_design.get("ticket_logo_path", "")]
+        mtimes = [os.path.getmtime(p) if p and os.path.exists(p) else 0 for p in logo_paths]
+        return json.dumps({
+            "design": ticket_design,
+            "company_name": settings.get("company_name", ""),
+            "company_address": settings.get("company_address", ""),
+            "logo": logo_paths,
+            "mtimes": mtimes
+        }, sort_keys=True, default=str)
+
+    def prepare_text(self, text, font):
+        """Shaped, visual-order text and its bounding box, cached per (text, font, size)"""
+        key = (text, getattr(font, "path", id(font)), getattr(font, "size", 0))
+        prepared = self.text_cache.get(key)
+        if prepared is None:
+            visual = text_shaper.display(text)
+            prepared = (visual, font.getbbox(visual) if visual else None)
+            if len(self.text_cache) >= self.TEXT_CACHE_SIZE:
+                self.text_cache.clear()
+            self.text_cache[key] = prepared
+        return prepared
+
+    def text_box(self, ticket_design, scale, element, text, size, bold):
+        """Measure a text element and return (font, pixel size, box, visual text)"""
+        x, y = self.get_position(ticket_design, element)
+        pixel_size = max(6, int(size * Config.POINTS_TO_PIXELS * scale))
+        font = self.get_font(pixel_size, bold)
+        left, top = int(x * scale), int(y * scale)
+        visual, bbox = self.prepare_text(text, font)
+        x0, y0, x1, y1 = bbox or (0, 0, 0, pixel_size)
+        return font, pixel_size, (left, top, left + x1, top + max(y1, pixel_size)), visual
+
+    def get_layout(self, settings, ticket_design):
+        """Compute element boxes once per design"""
+        key = self.make_layout_key(settings, ticket_design)
+        if self.layout is not None and self.layout.key == key:
+            return self.layout
+
+        with metrics.span("layout"):
+            self.font_family = ticket_design.get("font_family", "")
+            scale = self.get_scale(ticket_design)
+            size = (int(Config.TICKET_CANVAS_WIDTH * scale), int(Config.TICKET_CANVAS_HEIGHT * scale))
+            layout = TicketLayout(key, scale, size)
+
+            # Logos
+            if ticket_design.get("show_logo", True):
+                logo_width = int(ticket_design.get("logo_width", 150) * scale)
+                logo_height = int(ticket_design.get("logo_height", 100) * scale)
+                logos = [("logo", settings.get("logo", ""), 1.0),
+                         ("ticket_logo", ticket_design.get("ticket_logo_path", ""),
+                          ticket_design.get("logo_opacity", 1.0))]
+                for element, path, opacity in logos:
+                    if path and os.path.exists(path):
+                        logo = self.load_logo(path, logo_width, logo_height, opacity)
+                        if logo is not None:
+                            x, y = self.get_position(ticket_design, element)
+                            left, top = int(x * scale), int(y * scale)
+                            layout.add(element, "image", (left, top, left + logo.width, top + logo.height),
+                                       image=logo)
+
+            # Static text
+            for element, source, size_key, default_size, bold, color in self.STATIC_TEXT_ELEMENTS:
+                if element in ("company", "address") and not ticket_design.get("company_info", True):
+                    continue
+                if element == "watermark" and not ticket_design.get("watermark", True):
+                    continue
+
+                if source in ticket_design:
+                    text = ticket_design.get(source, "")
+                else:
+                    text = settings.get(source, "")
+                if not text:
+                    continue
+
+                font_size = ticket_design.get(size_key, default_size) if size_key else default_size
+                font, pixel_size, box, visual = self.text_box(ticket_design, scale, element, text, font_size, bold)
+                layout.add(element, "text", box, text=visual, font=font, color=color, bold=bold,
+                           pixel_size=pixel_size)
+
+            # Dynamic text, measured with a representative sample
+            sample = datetime.now()
+            dynamic = [("number", "0000", ticket_design.get("number_size", 72), True, "#FF5722")]
             if ticket_design.get("show_date", True):
-                date_format = ticket_design.get("date_format", "%Y-%m-%d")
-                ser.write(self.encode_text(f"Date: {now.strftime(date_format)}\n", encoding))
-            
+                dynamic.append(("date", f"Date: {sample.strftime(ticket_design.get('date_format', '%Y-%m-%d'))}",
+                                12, False, "black"))
             if ticket_design.get("show_time", True):
-                time_format = ticket_design.get("time_format", "%H:%M:%S")
-                ser.write(self.encode_text(f"Time: {now.strftime(time_format)}\n", encoding))
-            
-            ser.write(b'\n')
-            
-            # Print messages based on design
-            if ticket_design.get("thank_message"):
-                ser.write(self.encode_text(ticket_design["thank_message"] + "\n", encoding))
-            
-            if ticket_design.get("warning_message"):
-                ser.write(self.encode_text(ticket_design["warning_message"] + "\n", encoding))
-            
-            if ticket_design.get("custom_message"):
-                ser.write(self.encode_text(ticket_design["custom_message"] + "\n", encoding))
-            
-            # Watermark
-            if ticket_design.get("watermark", True) and ticket_design.get("watermark_text"):
-                ser.write(b'\n' + self.encode_text("-" * 32 + "\n", encoding))
-                ser.write(self.encode_text(ticket_design["watermark_text"] + "\n", encoding))
-            
-            # Feed and cut
-            ser.write(b'\n' * 3)
-            
-            if printer_settings.get("cut_after_print", True):
-                ser.write(Config.GS + b'V' + b'\x00')
-                time.sleep(0.5)
-            
-            ser.close()
-            
-            # Log successful print
-            design_name = ticket_design.get("design_name", "default")
-            self.data_manager.logger.info(
-                f"Ticket #{ticket_no} printed successfully with design '{design_name}'"
-            )
-            
-            # Auto-save after printing
-            self.data_manager.create_auto_save(settings)
-            
-            return True
-            
-        except Exception as e:
-            self.data_manager.logger.error(f"Printing failed: {e}")
-            return False
+                dynamic.append(("time", f"Time: {sample.strftime(ticket_design.get('time_format', '%H:%M:%S'))}",
+                                12, False, "black"))
+            for element, text, font_size, bold, color in dynamic:
+                font, pixel_size, box, visual = self.text_box(ticket_design, scale, element, text, font_size, bold)
+                layout.add(element, "text", box, text=visual, font=font, color=color, bold=bold,
+                           dynamic=True, pixel_size=pixel_size)
+
+            self.layout = layout
+            return layout
+
+    def get_dynamic_text(self, element, ticket_no, ticket_design, now):
+        """Text of an element that changes per ticket, in visual order"""
+        if element == "number":
+            return f"{ticket_no:04d}"
+        if element == "date":
+            return text_shaper.display(f"Date: {now.strftime(ticket_design.get('date_format', '%Y-%m-%d'))}")
+        return text_shaper.display(f"Time: {now.strftime(ticket_design.get('time_format', '%H:%M:%S'))}")
+
+    def render_static(self, settings, ticket_design):
+        """Render (or reuse) the layer that does not change between tickets"""
+        layout = self.get_layout(settings, ticket_design)
+        if layout.key == self.static_key:
+            return self.static_image
+
+        img = Image.new("RGB", layout.size, "white")
+        draw = ImageDraw.Draw(img)
+
+        # Border
+        if ticket_design.get("border_style", "solid") != "none":
+            border_width = max(1, int(ticket_design.get("border_width", 2) * layout.scale))
+            draw.rectangle([0, 0, layout.size[0] - 1, layout.size[1] - 1],
+                           outline="black", width=border_width)
+
+        for element in layout.static_elements():
+            if element["kind"] == "image":
+                img.paste(element["image"], element["box"][:2], element["image"])
+            else:
+                draw.text(element["box"][:2], element["text"], font=element["font"], fill=element["color"])
+
+        self.static_key = layout.key
+        self.static_image = img
+        self.static_bands = {}
+        return img
+
+    def render(self, ticket_no, settings, ticket_design=None, now=None):
+        """Render a complete ticket, redrawing only the number and timestamp"""
+        with metrics.span("render"):
+            if ticket_design is None:
+                ticket_design = settings["ticket_design"]
+            if now is None:
+                now = datetime.now()
+
+            img = self.render_static(settings, ticket_design).copy()
+            draw = ImageDraw.Draw(img)
+
+            for element in self.layout.dynamic_elements():
+                text = self.get_dynamic_text(element["name"], ticket_no, ticket_design, now)
+                draw.text(element["box"][:2], text, font=element["font"], fill=element["color"])
+
+            return img
+
+    @staticmethod
+    def to_raster(img):
+        """Convert an image to a GS v 0 raster command"""
+        mono = img.convert("L").point(TicketRenderer.INK_LUT).convert("1")
+        width_bytes = (mono.width + 7) // 8
+        height = mono.height
+        header = Config.GS + b'v0\x00' + bytes([width_bytes % 256, width_bytes // 256,
+                                                 height % 256, height // 256])
+        return header + mono.tobytes()
+
+    def render_raster(self, ticket_no, settings, ticket_design=None, now=None):
+        """Render a ticket as ESC/POS raster bands, reusing bands without dynamic content"""
+        with metrics.span("render_raster"):
+            if ticket_design is None:
+                ticket_design = settings["ticket_design"]
+
+            img = self.render(ticket_no, settings, ticket_design, now)
+            dynamic_rows = self.layout.dynamic_rows()
+            data = []
+            for top in range(0, img.height, self.RASTER_BAND_HEIGHT):
+                bottom = min(top + self.RASTER_BAND_HEIGHT, img.height)
+                is_static = all(y1 <= top or y0 >= bottom for y0, y1 in dynamic_rows)
+                if is_static and top in self.static_bands:
+                    data.append(self.static_bands[top])
+                    continue
+
+                band = self.to_raster(img.crop((0, top, img.width, bottom)))
+                if is_static:
+                    self.static_bands[top] = band
+                data.append(band)
+            return b''.join(data)
+
+    def export_png(self, file_path, ticket_no, settings, ticket_design=None):
+        """Export a rendered ticket to a PNG file"""
+        img = self.render(ticket_no, settings, ticket_design)
+        img.save(file_path, "PNG")
+        return file_path
+
+class TicketPreviewWindow:
+    """Preview window showing a rendered ticket as a single image"""
+
+    def __init__(self, parent_window, renderer, ticket_no, settings, ticket_design=None):
+        self.renderer = renderer
+        self.ticket_no = ticket_no
+        self.settings = settings
+        self.ticket_design = ticket_design
+
+        self.window = tk.Toplevel(parent_window)
+        self.window.title("Ticket Preview - Visual Design")
+        self.window.configure(bg="white")
+
+        img = self.renderer.render(ticket_no, settings, ticket_design)
+        self.photo = ImageTk.PhotoImage(img)
+
+        tk.Label(self.window, image=self.photo, bg="white", relief="solid", bd=2).pack(padx=20, pady=20)
+
+        buttons_frame = tk.Frame(self.window, bg="white")
+        buttons_frame.pack(pady=10)
+
+        tk.Button(buttons_frame, text="💾 Export PNG", command=self.export_png,
+                 bg="#3498DB", fg="white", font=("Arial", 12)).pack(side="left", padx=5)
+        tk.Button(buttons_frame, text="Close", command=self.window.destroy,
+                 bg="#E74C3C", fg="white", font=("Arial", 12)).pack(side="left", padx=5)
+
+    def export_png(self):
+        """Ask for a file name and export the ticket"""
+        file_path = filedialog.asksaveasfilename(
+            title="Export Ticket",
+            defaultextension=".png",
+            initialfile=f"ticket_{self.ticket_no:04d}.png",
+            filetypes=[("PNG files", "*.png")]
+        )
+        if file_path:
+            try:
+                self.renderer.export_png(file_path, self.ticket_no, self.settings, self.ticket_design)
+                messagebox.showinfo("Success", f"Ticket exported to {file_path}")
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to export ticket: {str(e)}")
 
 # ======================= Modern Button =======================
 class ModernButton(tk.Canvas):
@@ -824,7 +3332,7 @@ class ModernButton(tk.Canvas):
         self.is_hovered = False
         
         self.text = text
-        self.font_style = (self.font_family, self.font_size, "bold" if self.bold else "normal")
+        self.font_style = font_registry.tk_font(self.font_family, self.font_size, self.bold)
         
         self.bind("<Enter>", self.on_enter)
         self.bind("<Leave>", self.on_leave)
@@ -922,18 +3430,122 @@ class ModernButton(tk.Canvas):
         if corner_radius is not None:
             self.corner_radius = corner_radius
         
-        self.font_style = (self.font_family, self.font_size, "bold" if self.bold else "normal")
+        self.font_style = font_registry.tk_font(self.font_family, self.font_size, self.bold)
         self.draw_button()
 
+# ======================= Debouncer =======================
+class Debouncer:
+    """Coalesces rapid calls into a single call after a quiet period"""
+    
+    def __init__(self, widget, delay_ms, callback):
+        self.widget = widget
+        self.delay_ms = delay_ms
+        self.callback = callback
+        self.after_id = None
+    
+    def __call__(self, *args):
+        """Restart the quiet period"""
+        self.cancel()
+        self.after_id = self.widget.after(self.delay_ms, self.fire, *args)
+    
+    def fire(self, *args):
+        self.after_id = None
+        self.callback(*args)
+    
+    def cancel(self):
+        """Drop a pending call"""
+        if self.after_id is not None:
+            self.widget.after_cancel(self.after_id)
+            self.after_id = None
+
+# ======================= Number Display =======================
+class NumberDisplay:
+    """Draws the big number from pre-rendered glyph images, updating only changed digits"""
+    
+    PULSE_SCALE = 1.1
+    PULSE_MS = 200
+    PRELOAD_CHARS = "0123456789"
+    
+    def __init__(self, canvas, center, family, size, color):
+        self.canvas = canvas
+        self.center = center
+        self.color = color
+        # Tk sizes are points; glyphs are drawn in screen pixels
+        pixels_per_point = canvas.winfo_fpixels('1i') / 72
+        self.fonts = {
+            False: font_registry.pil_font(family, int(round(size * pixels_per_point)), True),
+            True: font_registry.pil_font(family, int(round(size * self.PULSE_SCALE * pixels_per_point)), True)
+        }
+        self.glyphs = {}
+        self.items = []  # (canvas item, char, x) per position
+        self.text = None
+        self.pulsed = False
+        self.revert = Debouncer(canvas, self.PULSE_MS, lambda: self.show(self.text, pulse=False))
+        for pulse in (False, True):
+            for char in self.PRELOAD_CHARS:
+                self.get_glyph(char, pulse)
+    
+    def get_glyph(self, char, pulse):
+        """PhotoImage and advance width of one character, rendered once"""
+        key = (char, pulse)
+        glyph = self.glyphs.get(key)
+        if glyph is None:
+            glyph_font = self.fonts[pulse]
+            ascent, descent = glyph_font.getmetrics()
+            advance = max(1, int(round(glyph_font.getlength(char))))
+            img = Image.new("RGBA", (advance, ascent + descent), (0, 0, 0, 0))
+            ImageDraw.Draw(img).text((0, 0), char, font=glyph_font, fill=self.color)
+            glyph = self.glyphs[key] = (ImageTk.PhotoImage(img, master=self.canvas), advance)
+        return glyph
+    
+    def show(self, text, pulse=False):
+        """Display text, touching only the canvas items whose character or position changed"""
+        if text == self.text and pulse == self.pulsed:
+            return
+        glyphs = [self.get_glyph(char, pulse) for char in text]
+        x = self.center[0] - sum(advance for _, advance in glyphs) / 2
+        
+        for index, (char, (image, advance)) in enumerate(zip(text, glyphs)):
+            if index == len(self.items):
+                item = self.canvas.create_image(x, self.center[1], image=image, anchor="w")
+                self.items.append((item, char, x))
+            else:
+                item, old_char, old_x = self.items[index]
+                if old_char != char or pulse != self.pulsed:
+                    self.canvas.itemconfig(item, image=image)
+                if old_x != x:
+                    self.canvas.coords(item, x, self.center[1])
+                self.items[index] = (item, char, x)
+            x += advance
+        
+        for item, _, _ in self.items[len(text):]:
+            self.canvas.delete(item)
+        del self.items[len(text):]
+        self.text = text
+        self.pulsed = pulse
+    
+    def pulse(self, text):
+        """Show text enlarged, restarting the single pending shrink-back"""
+        self.show(text, pulse=True)
+        self.revert()
+    
+    def cancel(self):
+        self.revert.cancel()
+
 # ======================= Enhanced Ticket Designer =======================
 class TicketDesigner:
     """Interactive ticket designer with drag and drop"""
     
-    def __init__(self, parent_window, settings, on_save_callback):
+    def __init__(self, parent_window, settings, on_save_callback, data_manager, printer):
         self.parent_window = parent_window
         self.settings = settings.copy()
         self.on_save_callback = on_save_callback
+        # Shared with the app so test prints reuse its printer connections
+        self.data_manager = data_manager
+        self.printer = printer
         self.ticket_design = settings["ticket_design"].copy()
+        self.renderer = TicketRenderer()
+        self.writer = AtomicFileWriter()
         self.dragging = False
         self.drag_widget = None
         self.drag_start_x = 0
@@ -948,6 +3560,23 @@ class TicketDesigner:
         # Bind close event for auto-save
         self.window.protocol("WM_DELETE_WINDOW", self.on_closing)
         
+        # Slider updates are debounced; logo resizing runs on a worker thread
+        self.font_debouncer = Debouncer(self.window, 150, self.update_font_sizes)
+        self.logo_debouncer = Debouncer(self.window, 150, self.update_logo_size)
+        self.logo_worker = ThreadPoolExecutor(max_workers=1)
+        self.logo_job = 0
+        self.logo_cache_lock = threading.Lock()
+        self.logo_sources = {}
+        self.resized_logos = {}
+        self.opacity_luts = {}
+        self.applied_label_config = {}
+        
+        # Auto-save state is tracked from UI events
+        self.design_dirty = False
+        self.element_positions = {}
+        self.restored_elements = {}
+        self.restore_auto_save()
+        
         # Create main container
         main_container = tk.Frame(self.window, bg="#f0f0f0")
         main_container.pack(fill="both", expand=True, padx=10, pady=10)
@@ -981,22 +3610,19 @@ class TicketDesigner:
         
         tk.Label(logo_frame, text="Logo Width:", bg="#ffffff").pack(anchor="w", pady=2)
         self.logo_width_var = tk.IntVar(value=self.ticket_design.get("logo_width", 150))
-        tk.Entry(logo_frame, textvariable=self.logo_width_var, width=10).pack(side="left", padx=5)
-        tk.Button(logo_frame, text="Apply", command=self.update_logo_size,
-                 bg="#95A5A6", fg="white", font=("Arial", 8)).pack(side="left", padx=5)
+        tk.Scale(logo_frame, from_=20, to=400, variable=self.logo_width_var, orient="horizontal",
+                bg="#ffffff", highlightthickness=0, command=self.schedule_logo_update).pack(fill="x")
         
         tk.Label(logo_frame, text="Logo Height:", bg="#ffffff").pack(anchor="w", pady=2)
         self.logo_height_var = tk.IntVar(value=self.ticket_design.get("logo_height", 100))
-        tk.Entry(logo_frame, textvariable=self.logo_height_var, width=10).pack(side="left", padx=5)
-        tk.Button(logo_frame, text="Apply", command=self.update_logo_size,
-                 bg="#95A5A6", fg="white", font=("Arial", 8)).pack(side="left", padx=5)
+        tk.Scale(logo_frame, from_=20, to=300, variable=self.logo_height_var, orient="horizontal",
+                bg="#ffffff", highlightthickness=0, command=self.schedule_logo_update).pack(fill="x")
         
         # Logo opacity control
         tk.Label(logo_frame, text="Logo Opacity (0-100):", bg="#ffffff").pack(anchor="w", pady=2)
         self.logo_opacity_var = tk.DoubleVar(value=self.ticket_design.get("logo_opacity", 1.0) * 100)
-        tk.Entry(logo_frame, textvariable=self.logo_opacity_var, width=10).pack(side="left", padx=5)
-        tk.Button(logo_frame, text="Apply", command=self.update_logo_opacity,
-                 bg="#95A5A6", fg="white", font=("Arial", 8)).pack(side="left", padx=5)
+        tk.Scale(logo_frame, from_=0, to=100, variable=self.logo_opacity_var, orient="horizontal",
+                bg="#ffffff", highlightthickness=0, command=self.schedule_logo_update).pack(fill="x")
         
         # Company info controls
         company_frame = tk.LabelFrame(left_panel, text="Company Info", font=("Arial", 12, "bold"),
@@ -1009,9 +3635,8 @@ class TicketDesigner:
         
         tk.Label(company_frame, text="Font Size:", bg="#ffffff").pack(anchor="w", pady=2)
         self.company_font_var = tk.IntVar(value=self.ticket_design.get("company_font_size", 18))
-        tk.Entry(company_frame, textvariable=self.company_font_var, width=10).pack(side="left", padx=5)
-        tk.Button(company_frame, text="Apply", command=self.update_font_sizes,
-                 bg="#95A5A6", fg="white", font=("Arial", 8)).pack(side="left", padx=5)
+        tk.Scale(company_frame, from_=8, to=40, variable=self.company_font_var, orient="horizontal",
+                bg="#ffffff", highlightthickness=0, command=self.schedule_font_update).pack(fill="x")
         
         # Ticket number controls
         number_frame = tk.LabelFrame(left_panel, text="Ticket Number", font=("Arial", 12, "bold"),
@@ -1020,9 +3645,8 @@ class TicketDesigner:
         
         tk.Label(number_frame, text="Font Size:", bg="#ffffff").pack(anchor="w", pady=2)
         self.number_size_var = tk.IntVar(value=self.ticket_design.get("number_size", 72))
-        tk.Entry(number_frame, textvariable=self.number_size_var, width=10).pack(side="left", padx=5)
-        tk.Button(number_frame, text="Apply", command=self.update_font_sizes,
-                 bg="#95A5A6", fg="white", font=("Arial", 8)).pack(side="left", padx=5)
+        tk.Scale(number_frame, from_=20, to=150, variable=self.number_size_var, orient="horizontal",
+                bg="#ffffff", highlightthickness=0, command=self.schedule_font_update).pack(fill="x")
         
         tk.Label(number_frame, text="Prefix:", bg="#ffffff").pack(anchor="w", pady=2)
         self.number_prefix_var = tk.StringVar(value=self.ticket_design.get("number_prefix", "Ticket #"))
@@ -1041,9 +3665,8 @@ class TicketDesigner:
         
         tk.Label(messages_frame, text="Font Size:", bg="#ffffff").pack(anchor="w", pady=2)
         self.thank_font_var = tk.IntVar(value=self.ticket_design.get("thank_font_size", 14))
-        tk.Entry(messages_frame, textvariable=self.thank_font_var, width=10).pack(side="left", padx=5)
-        tk.Button(messages_frame, text="Apply", command=self.update_font_sizes,
-                 bg="#95A5A6", fg="white", font=("Arial", 8)).pack(side="left", padx=5)
+        tk.Scale(messages_frame, from_=8, to=30, variable=self.thank_font_var, orient="horizontal",
+                bg="#ffffff", highlightthickness=0, command=self.schedule_font_update).pack(fill="x")
         
         tk.Label(messages_frame, text="Warning Message:", bg="#ffffff").pack(anchor="w", pady=2)
         self.warning_var = tk.StringVar(value=self.ticket_design.get("warning_message", "Please wait in the waiting area"))
@@ -1052,9 +3675,8 @@ class TicketDesigner:
         
         tk.Label(messages_frame, text="Font Size:", bg="#ffffff").pack(anchor="w", pady=2)
         self.warning_font_var = tk.IntVar(value=self.ticket_design.get("warning_font_size", 12))
-        tk.Entry(messages_frame, textvariable=self.warning_font_var, width=10).pack(side="left", padx=5)
-        tk.Button(messages_frame, text="Apply", command=self.update_font_sizes,
-                 bg="#95A5A6", fg="white", font=("Arial", 8)).pack(side="left", padx=5)
+        tk.Scale(messages_frame, from_=8, to=30, variable=self.warning_font_var, orient="horizontal",
+                bg="#ffffff", highlightthickness=0, command=self.schedule_font_update).pack(fill="x")
         
         # Date & Time controls
         datetime_frame = tk.LabelFrame(left_panel, text="Date & Time", font=("Arial", 12, "bold"),
@@ -1081,9 +3703,8 @@ class TicketDesigner:
         
         tk.Label(custom_frame, text="Font Size:", bg="#ffffff").pack(anchor="w", pady=2)
         self.custom_font_var = tk.IntVar(value=self.ticket_design.get("message_font_size", 12))
-        tk.Entry(custom_frame, textvariable=self.custom_font_var, width=10).pack(side="left", padx=5)
-        tk.Button(custom_frame, text="Apply", command=self.update_font_sizes,
-                 bg="#95A5A6", fg="white", font=("Arial", 8)).pack(side="left", padx=5)
+        tk.Scale(custom_frame, from_=8, to=30, variable=self.custom_font_var, orient="horizontal",
+                bg="#ffffff", highlightthickness=0, command=self.schedule_font_update).pack(fill="x")
         
         # Watermark
         watermark_frame = tk.LabelFrame(left_panel, text="Watermark", font=("Arial", 12, "bold"),
@@ -1101,9 +3722,8 @@ class TicketDesigner:
         
         tk.Label(watermark_frame, text="Font Size:", bg="#ffffff").pack(anchor="w", pady=2)
         self.watermark_font_var = tk.IntVar(value=self.ticket_design.get("watermark_font_size", 10))
-        tk.Entry(watermark_frame, textvariable=self.watermark_font_var, width=10).pack(side="left", padx=5)
-        tk.Button(watermark_frame, text="Apply", command=self.update_font_sizes,
-                 bg="#95A5A6", fg="white", font=("Arial", 8)).pack(side="left", padx=5)
+        tk.Scale(watermark_frame, from_=6, to=20, variable=self.watermark_font_var, orient="horizontal",
+                bg="#ffffff", highlightthickness=0, command=self.schedule_font_update).pack(fill="x")
         
         # Design Management
         management_frame = tk.LabelFrame(left_panel, text="Design Management", 
@@ -1160,6 +3780,9 @@ class TicketDesigner:
         tk.Button(action_frame, text="🖨️ Print Test", command=self.print_test,
                  bg="#E67E22", fg="white", font=("Arial", 11)).pack(fill="x", pady=5)
         
+        tk.Button(action_frame, text="👁️ Rendered Preview", command=self.show_rendered_preview,
+                 bg="#3498DB", fg="white", font=("Arial", 11)).pack(fill="x", pady=5)
+        
         tk.Button(action_frame, text="❌ Close", command=self.on_closing,
                  bg="#E74C3C", fg="white", font=("Arial", 11)).pack(fill="x", pady=5)
         
@@ -1203,6 +3826,18 @@ class TicketDesigner:
         # Draw ticket border
         self.draw_ticket_border()
         
+        # Any edit to a control marks the design dirty
+        for var in [self.show_logo_var, self.logo_width_var, self.logo_height_var, self.logo_opacity_var,
+                    self.show_company_var, self.company_font_var, self.number_size_var,
+                    self.number_prefix_var, self.thank_var, self.thank_font_var, self.warning_var,
+                    self.warning_font_var, self.show_date_var, self.show_time_var, self.custom_var,
+                    self.custom_font_var, self.watermark_var, self.watermark_text_var,
+                    self.watermark_font_var]:
+            var.trace_add("write", self.mark_dirty)
+        
+        # A restored session stays dirty until it has been written again
+        self.design_dirty = bool(self.restored_elements)
+        
         # Start auto-save for designer
         self.start_designer_auto_save()
         
@@ -1210,64 +3845,100 @@ class TicketDesigner:
         """Start auto-save for designer window"""
         self.designer_auto_save_id = self.window.after(30000, self.auto_save_design)  # Every 30 seconds
     
+    def mark_dirty(self, *args):
+        """Flag the design as changed since the last auto-save"""
+        self.design_dirty = True
+    
+    def show_element(self, widget, x, y):
+        """Place an element and record its position for auto-save"""
+        widget.place(x=x, y=y)
+        self.record_element(widget, x=x, y=y, visible=True)
+    
+    def hide_element(self, widget):
+        """Hide an element and record its visibility for auto-save"""
+        widget.place_forget()
+        self.record_element(widget, visible=False)
+    
+    def record_element(self, widget, **state):
+        """Record element state from UI events instead of querying widgets"""
+        element_type = getattr(widget, 'element_type', None)
+        if element_type is None:
+            return
+        self.element_positions.setdefault(element_type, {"x": 0, "y": 0, "visible": True}).update(state)
+        self.mark_dirty()
+    
     def auto_save_design(self):
-        """Auto-save current design state"""
+        """Auto-save current design state if it changed"""
         try:
-            # Save current design to temporary file
-            temp_file = os.path.join(Config.DATA_DIR, "designer_autosave.json")
-            design_data = {
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "ticket_design": self.ticket_design.copy(),
-                "elements": {}
-            }
-            
-            # Save element positions
-            for widget in self.ticket_frame.winfo_children():
-                if hasattr(widget, 'element_type'):
-                    element_type = widget.element_type
-                    design_data["elements"][element_type] = {
-                        "x": widget.winfo_x(),
-                        "y": widget.winfo_y(),
-                        "visible": widget.winfo_ismapped()
-                    }
-            
-            with open(temp_file, 'w', encoding='utf-8') as f:
-                json.dump(design_data, f, indent=4, ensure_ascii=False)
-            
+            if self.design_dirty:
+                design_data = {
+                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "ticket_design": self.ticket_design.copy(),
+                    "elements": {name: state.copy() for name, state in self.element_positions.items()}
+                }
+                
+                self.writer.write_json(Config.DESIGNER_AUTO_SAVE_FILE, design_data)
+                
+                self.design_dirty = False
+        except Exception as e:
+            print(f"Error in designer auto-save: {e}")
+        finally:
             # Schedule next auto-save
             self.designer_auto_save_id = self.window.after(30000, self.auto_save_design)
-            
+    
+    def restore_auto_save(self):
+        """Offer to restore a designer session that was not closed normally"""
+        if not os.path.exists(Config.DESIGNER_AUTO_SAVE_FILE):
+            return
+        
+        try:
+            with open(Config.DESIGNER_AUTO_SAVE_FILE, 'r', encoding='utf-8') as f:
+                auto_save_data = json.load(f)
         except Exception as e:
-            print(f"Error in designer auto-save: {e}")
+            print(f"Error reading designer auto-save: {e}")
+            return
+        
+        timestamp = auto_save_data.get("timestamp", "unknown time")
+        if messagebox.askyesno("Restore Design",
+                               f"Unsaved designer changes from {timestamp} were found.\n\nRestore them?",
+                               parent=self.window):
+            self.ticket_design.update(auto_save_data.get("ticket_design", {}))
+            for element_type, state in auto_save_data.get("elements", {}).items():
+                self.ticket_design[f"{element_type}_position_x"] = state.get("x", 50)
+                self.ticket_design[f"{element_type}_position_y"] = state.get("y", 50)
+            self.restored_elements = auto_save_data.get("elements", {})
+        else:
+            try:
+                os.remove(Config.DESIGNER_AUTO_SAVE_FILE)
+            except OSError:
+                pass
     
     def on_closing(self):
         """Handle designer window closing"""
-        # Cancel auto-save
+        # Cancel auto-save and pending slider updates
         if hasattr(self, 'designer_auto_save_id'):
             self.window.after_cancel(self.designer_auto_save_id)
+        self.font_debouncer.cancel()
+        self.logo_debouncer.cancel()
+        self.logo_job += 1
+        self.logo_worker.shutdown(wait=False)
         
         # Remove temporary auto-save file
-        temp_file = os.path.join(Config.DATA_DIR, "designer_autosave.json")
-        if os.path.exists(temp_file):
+        if os.path.exists(Config.DESIGNER_AUTO_SAVE_FILE):
             try:
-                os.remove(temp_file)
+                os.remove(Config.DESIGNER_AUTO_SAVE_FILE)
             except:
                 pass
         
         self.window.destroy()
         
+    def design_font(self, size, bold=False):
+        """Shared Tk font in the ticket's family"""
+        family = self.ticket_design.get("font_family") or font_registry.default_family()
+        return font_registry.tk_font(family, size, bold)
+    
     def create_ticket_elements(self):
         """Create draggable ticket elements"""
-        # Check for auto-save file first
-        temp_file = os.path.join(Config.DATA_DIR, "designer_autosave.json")
-        if os.path.exists(temp_file):
-            try:
-                with open(temp_file, 'r', encoding='utf-8') as f:
-                    auto_save_data = json.load(f)
-                self.ticket_design = auto_save_data.get("ticket_design", self.ticket_design.copy())
-            except:
-                pass
-        
         # Logo
         self.logo_label = tk.Label(self.ticket_frame, bg="white")
         self.load_logo()
@@ -1280,8 +3951,8 @@ class TicketDesigner:
         # Company name
         self.company_label = tk.Label(
             self.ticket_frame,
-            text=self.settings.get("company_name", "Your Company"),
-            font=("Arial", self.ticket_design.get("company_font_size", 18)),
+            text=text_shaper.for_tk(self.settings.get("company_name", "Your Company")),
+            font=self.design_font(self.ticket_design.get("company_font_size", 18)),
             bg="white",
             fg="black"
         )
@@ -1290,7 +3961,7 @@ class TicketDesigner:
         # Company address
         self.address_label = tk.Label(
             self.ticket_frame,
-            text=self.settings.get("company_address", "123 Business Street"),
+            text=text_shaper.for_tk(self.settings.get("company_address", "123 Business Street")),
             font=("Arial", 12),
             bg="white",
             fg="black"
@@ -1300,7 +3971,7 @@ class TicketDesigner:
         # Ticket number prefix
         self.prefix_label = tk.Label(
             self.ticket_frame,
-            text=self.ticket_design.get("number_prefix", "Ticket #"),
+            text=text_shaper.for_tk(self.ticket_design.get("number_prefix", "Ticket #")),
             font=("Arial", 14),
             bg="white",
             fg="black"
@@ -1311,7 +3982,7 @@ class TicketDesigner:
         self.number_label = tk.Label(
             self.ticket_frame,
             text="0001",
-            font=("Arial", self.ticket_design.get("number_size", 72), "bold"),
+            font=self.design_font(self.ticket_design.get("number_size", 72), bold=True),
             bg="white",
             fg="#FF5722"
         )
@@ -1320,8 +3991,8 @@ class TicketDesigner:
         # Thank message
         self.thank_label = tk.Label(
             self.ticket_frame,
-            text=self.ticket_design.get("thank_message", "Thank you for choosing our services"),
-            font=("Arial", self.ticket_design.get("thank_font_size", 14)),
+            text=text_shaper.for_tk(self.ticket_design.get("thank_message", "Thank you for choosing our services")),
+            font=self.design_font(self.ticket_design.get("thank_font_size", 14)),
             bg="white",
             fg="black"
         )
@@ -1330,8 +4001,8 @@ class TicketDesigner:
         # Warning message
         self.warning_label = tk.Label(
             self.ticket_frame,
-            text=self.ticket_design.get("warning_message", "Please wait in the waiting area"),
-            font=("Arial", self.ticket_design.get("warning_font_size", 12)),
+            text=text_shaper.for_tk(self.ticket_design.get("warning_message", "Please wait in the waiting area")),
+            font=self.design_font(self.ticket_design.get("warning_font_size", 12)),
             bg="white",
             fg="black"
         )
@@ -1340,8 +4011,8 @@ class TicketDesigner:
         # Custom message
         self.custom_label = tk.Label(
             self.ticket_frame,
-            text=self.ticket_design.get("custom_message", "We appreciate your patience"),
-            font=("Arial", self.ticket_design.get("message_font_size", 12)),
+            text=text_shaper.for_tk(self.ticket_design.get("custom_message", "We appreciate your patience")),
+            font=self.design_font(self.ticket_design.get("message_font_size", 12)),
             bg="white",
             fg="black"
         )
@@ -1370,8 +4041,8 @@ class TicketDesigner:
         # Watermark
         self.watermark_label = tk.Label(
             self.ticket_frame,
-            text=self.ticket_design.get("watermark_text", "OFFICIAL TICKET"),
-            font=("Arial", self.ticket_design.get("watermark_font_size", 10)),
+            text=text_shaper.for_tk(self.ticket_design.get("watermark_text", "OFFICIAL TICKET")),
+            font=self.design_font(self.ticket_design.get("watermark_font_size", 10)),
             bg="white",
             fg="#888888"
         )
@@ -1413,6 +4084,7 @@ class TicketDesigner:
             # Save position to settings
             self.ticket_design[f"{self.drag_widget.element_type}_position_x"] = x
             self.ticket_design[f"{self.drag_widget.element_type}_position_y"] = y
+            self.record_element(self.drag_widget, x=x, y=y)
             
             self.drag_widget = None
             
@@ -1436,28 +4108,71 @@ class TicketDesigner:
         for element_type, widget in elements.items():
             x = self.ticket_design.get(f"{element_type}_position_x", 50)
             y = self.ticket_design.get(f"{element_type}_position_y", 50)
-            widget.place(x=x, y=y)
+            self.show_element(widget, x, y)
+            if not self.restored_elements.get(element_type, {}).get("visible", True):
+                self.hide_element(widget)
             
     def load_logo(self):
         """Load and display logo"""
-        logo_path = self.settings["logo"]
-        if os.path.exists(logo_path):
-            try:
-                img = Image.open(logo_path)
-                width = self.ticket_design.get("logo_width", 150)
-                height = self.ticket_design.get("logo_height", 100)
-                img = img.resize((width, height), Image.Resampling.LANCZOS)
-                
-                if img.mode != 'RGBA':
-                    img = img.convert('RGBA')
-                
-                self.logo_img = ImageTk.PhotoImage(img)
-                self.logo_label.config(image=self.logo_img, bg="white")
-            except Exception as e:
-                self.logo_label.config(text="[LOGO]", font=("Arial", 10), bg="white", fg="#888888")
+        img = self.get_resized_logo(self.settings["logo"],
+                                    self.ticket_design.get("logo_width", 150),
+                                    self.ticket_design.get("logo_height", 100))
+        self.show_system_logo(img)
+    
+    def show_system_logo(self, img):
+        """Display the system logo image or a placeholder"""
+        if img is not None:
+            self.logo_img = ImageTk.PhotoImage(img)
+            self.logo_label.config(image=self.logo_img, bg="white")
         else:
             self.logo_label.config(text="[LOGO]", font=("Arial", 10), bg="white", fg="#888888")
     
+    def get_resized_logo(self, path, width, height):
+        """Return a resized RGBA logo, loading the source from disk only once"""
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        
+        key = (path, mtime, width, height)
+        with self.logo_cache_lock:
+            if key in self.resized_logos:
+                return self.resized_logos[key]
+            source = self.logo_sources.get((path, mtime))
+        
+        try:
+            if source is None:
+                source = Image.open(path).convert('RGBA')
+                source.load()
+            img = source.resize((max(1, width), max(1, height)), Image.Resampling.LANCZOS)
+        except Exception as e:
+            print(f"Error loading logo {path}: {e}")
+            return None
+        
+        with self.logo_cache_lock:
+            self.logo_sources[(path, mtime)] = source
+            self.resized_logos[key] = img
+            while len(self.resized_logos) > 8:
+                self.resized_logos.pop(next(iter(self.resized_logos)))
+        return img
+    
+    def apply_opacity(self, img, opacity):
+        """Apply opacity to a cached image with a precomputed lookup table"""
+        if img is None or opacity >= 1.0:
+            return img
+        level = max(0, int(round(opacity * 100)))
+        if level not in self.opacity_luts:
+            self.opacity_luts[level] = [i * level // 100 for i in range(256)]
+        faded = img.copy()
+        faded.putalpha(img.getchannel('A').point(self.opacity_luts[level]))
+        return faded
+    
+    def prepare_logo_images(self, system_path, ticket_path, width, height, opacity):
+        """Build both logo images (runs on the worker thread)"""
+        system_img = self.get_resized_logo(system_path, width, height)
+        ticket_img = self.apply_opacity(self.get_resized_logo(ticket_path, width, height), opacity)
+        return system_img, ticket_img
+    
     def upload_ticket_logo(self):
         """Upload logo for ticket"""
         file_path = filedialog.askopenfilename(
@@ -1498,37 +4213,19 @@ class TicketDesigner:
     def load_ticket_logo(self):
         """Load and display ticket logo"""
         logo_path = self.ticket_design.get("ticket_logo_path", self.settings.get("logo", ""))
-        
-        if os.path.exists(logo_path):
-            try:
-                img = Image.open(logo_path)
-                width = self.ticket_design.get("logo_width", 150)
-                height = self.ticket_design.get("logo_height", 100)
-                opacity = self.ticket_design.get("logo_opacity", 1.0)
-                
-                # Resize
-                img = img.resize((width, height), Image.Resampling.LANCZOS)
-                
-                # Apply opacity if needed
-                if opacity < 1.0 and img.mode == 'RGBA':
-                    # Create alpha channel with opacity
-                    alpha = img.split()[3]
-                    alpha = alpha.point(lambda p: p * opacity)
-                    img.putalpha(alpha)
-                elif img.mode != 'RGBA':
-                    img = img.convert('RGBA')
-                    alpha = Image.new('L', img.size, int(255 * opacity))
-                    img.putalpha(alpha)
-                
-                self.ticket_logo_img = ImageTk.PhotoImage(img)
-                self.ticket_logo_label.config(image=self.ticket_logo_img, bg="white")
-                
-                if not hasattr(self.ticket_logo_label, 'element_type'):
-                    self.make_draggable(self.ticket_logo_label, "ticket_logo")
-                    
-            except Exception as e:
-                print(f"Error loading ticket logo: {e}")
-                self.ticket_logo_label.config(text="[TICKET LOGO]", font=("Arial", 10), bg="white", fg="#888888")
+        img = self.get_resized_logo(logo_path,
+                                    self.ticket_design.get("logo_width", 150),
+                                    self.ticket_design.get("logo_height", 100))
+        self.show_ticket_logo(self.apply_opacity(img, self.ticket_design.get("logo_opacity", 1.0)))
+    
+    def show_ticket_logo(self, img):
+        """Display the ticket logo image or a placeholder"""
+        if img is not None:
+            self.ticket_logo_img = ImageTk.PhotoImage(img)
+            self.ticket_logo_label.config(image=self.ticket_logo_img, bg="white")
+            
+            if not hasattr(self.ticket_logo_label, 'element_type'):
+                self.make_draggable(self.ticket_logo_label, "ticket_logo")
         else:
             self.ticket_logo_label.config(text="[TICKET LOGO]", font=("Arial", 10), bg="white", fg="#888888")
             
@@ -1537,78 +4234,91 @@ class TicketDesigner:
         if self.show_logo_var.get():
             x = self.ticket_design.get("logo_position_x", 50)
             y = self.ticket_design.get("logo_position_y", 50)
-            self.logo_label.place(x=x, y=y)
+            self.show_element(self.logo_label, x, y)
         else:
-            self.logo_label.place_forget()
+            self.hide_element(self.logo_label)
+    
+    def schedule_logo_update(self, value=None):
+        """Debounce logo size and opacity slider changes"""
+        self.logo_debouncer()
+    
+    def schedule_font_update(self, value=None):
+        """Debounce font size slider changes"""
+        self.font_debouncer()
     
     def update_logo_opacity(self):
         """Update logo opacity"""
-        opacity = self.logo_opacity_var.get() / 100.0
-        self.ticket_design["logo_opacity"] = opacity
-        self.load_ticket_logo()
+        self.update_logo_size()
             
     def update_logo_size(self):
-        """Update logo size"""
+        """Update logo size and opacity, resizing on the worker thread"""
         width = self.logo_width_var.get()
         height = self.logo_height_var.get()
+        opacity = self.logo_opacity_var.get() / 100.0
         
         self.ticket_design["logo_width"] = width
         self.ticket_design["logo_height"] = height
+        self.ticket_design["logo_opacity"] = opacity
         
-        # Update system logo
-        if os.path.exists(self.settings["logo"]):
-            try:
-                img = Image.open(self.settings["logo"])
-                img = img.resize((width, height), Image.Resampling.LANCZOS)
-                
-                if img.mode != 'RGBA':
-                    img = img.convert('RGBA')
-                
-                self.logo_img = ImageTk.PhotoImage(img)
-                self.logo_label.config(image=self.logo_img)
-            except:
-                pass
+        self.logo_job += 1
+        future = self.logo_worker.submit(
+            self.prepare_logo_images,
+            self.settings["logo"],
+            self.ticket_design.get("ticket_logo_path", self.settings.get("logo", "")),
+            width, height, opacity
+        )
+        self.poll_logo_job(self.logo_job, future)
+    
+    def poll_logo_job(self, job, future):
+        """Show worker results on the Tk thread, dropping superseded jobs"""
+        if job != self.logo_job:
+            return
+        if not future.done():
+            self.window.after(20, lambda: self.poll_logo_job(job, future))
+            return
         
-        # Update ticket logo
-        self.load_ticket_logo()
+        try:
+            system_img, ticket_img = future.result()
+        except Exception as e:
+            print(f"Error updating logo: {e}")
+            return
+        
+        self.show_system_logo(system_img)
+        self.show_ticket_logo(ticket_img)
                 
     def update_company_visibility(self):
         """Update company info visibility"""
         if self.show_company_var.get():
-            self.company_label.place(x=self.ticket_design.get("company_position_x", 200),
-                                    y=self.ticket_design.get("company_position_y", 50))
-            self.address_label.place(x=self.ticket_design.get("address_position_x", 200),
-                                    y=self.ticket_design.get("address_position_y", 80))
+            self.show_element(self.company_label, self.ticket_design.get("company_position_x", 200),
+                                    self.ticket_design.get("company_position_y", 50))
+            self.show_element(self.address_label, self.ticket_design.get("address_position_x", 200),
+                                    self.ticket_design.get("address_position_y", 80))
         else:
-            self.company_label.place_forget()
-            self.address_label.place_forget()
+            self.hide_element(self.company_label)
+            self.hide_element(self.address_label)
             
     def update_font_sizes(self):
-        """Update font sizes"""
-        # Company font
-        self.company_label.config(font=("Arial", self.company_font_var.get()))
-        
-        # Ticket number
-        self.number_label.config(font=("Arial", self.number_size_var.get(), "bold"))
-        
-        # Thank message
-        self.thank_label.config(font=("Arial", self.thank_font_var.get()))
-        self.thank_label.config(text=self.thank_var.get())
-        
-        # Warning message
-        self.warning_label.config(font=("Arial", self.warning_font_var.get()))
-        self.warning_label.config(text=self.warning_var.get())
-        
-        # Custom message
-        self.custom_label.config(font=("Arial", self.custom_font_var.get()))
-        self.custom_label.config(text=self.custom_var.get())
-        
-        # Watermark
-        self.watermark_label.config(font=("Arial", self.watermark_font_var.get()))
-        self.watermark_label.config(text=self.watermark_text_var.get())
-        
-        # Update prefix
-        self.prefix_label.config(text=self.number_prefix_var.get())
+        """Update font sizes and texts, touching only labels that changed"""
+        updates = [
+            (self.company_label, self.design_font(self.company_font_var.get()), None),
+            (self.number_label, self.design_font(self.number_size_var.get(), bold=True), None),
+            (self.thank_label, self.design_font(self.thank_font_var.get()), self.thank_var.get()),
+            (self.warning_label, self.design_font(self.warning_font_var.get()), self.warning_var.get()),
+            (self.custom_label, self.design_font(self.custom_font_var.get()), self.custom_var.get()),
+            (self.watermark_label, self.design_font(self.watermark_font_var.get()), self.watermark_text_var.get()),
+            (self.prefix_label, None, self.number_prefix_var.get())
+        ]
+        
+        for label, font_spec, text in updates:
+            applied = self.applied_label_config.get(label, (None, None))
+            changes = {}
+            if font_spec is not None and font_spec != applied[0]:
+                changes["font"] = font_spec
+            if text is not None and text != applied[1]:
+                changes["text"] = text_shaper.for_tk(text)
+            if changes:
+                label.config(**changes)
+                self.applied_label_config[label] = (font_spec, text)
         
         # Save to design
         self.ticket_design["company_font_size"] = self.company_font_var.get()
@@ -1626,16 +4336,16 @@ class TicketDesigner:
     def update_datetime_visibility(self):
         """Update date/time visibility"""
         if self.show_date_var.get():
-            self.date_label.place(x=self.ticket_design.get("date_position_x", 50),
-                                 y=self.ticket_design.get("date_position_y", 370))
+            self.show_element(self.date_label, self.ticket_design.get("date_position_x", 50),
+                                 self.ticket_design.get("date_position_y", 370))
         else:
-            self.date_label.place_forget()
+            self.hide_element(self.date_label)
             
         if self.show_time_var.get():
-            self.time_label.place(x=self.ticket_design.get("time_position_x", 50),
-                                 y=self.ticket_design.get("time_position_y", 400))
+            self.show_element(self.time_label, self.ticket_design.get("time_position_x", 50),
+                                 self.ticket_design.get("time_position_y", 400))
         else:
-            self.time_label.place_forget()
+            self.hide_element(self.time_label)
             
         self.ticket_design["show_date"] = self.show_date_var.get()
         self.ticket_design["show_time"] = self.show_time_var.get()
@@ -1645,9 +4355,9 @@ class TicketDesigner:
         if self.watermark_var.get():
             x = self.ticket_design.get("watermark_position_x", 200)
             y = self.ticket_design.get("watermark_position_y", 500)
-            self.watermark_label.place(x=x, y=y)
+            self.show_element(self.watermark_label, x, y)
         else:
-            self.watermark_label.place_forget()
+            self.hide_element(self.watermark_label)
         
         self.ticket_design["watermark"] = self.watermark_var.get()
         
@@ -1686,7 +4396,7 @@ class TicketDesigner:
                         "y": widget.winfo_y(),
                         "visible": widget.winfo_ismapped(),
                         "text": widget.cget("text") if hasattr(widget, 'cget') else "",
-                        "font_size": widget.cget("font")[1] if hasattr(widget, 'cget') and widget.cget("font") else 12,
+                        "font_size": self.widget_font_size(widget),
                         "color": widget.cget("fg") if hasattr(widget, 'cget') else "black"
                     }
             
@@ -1703,12 +4413,19 @@ class TicketDesigner:
             else:
                 messagebox.showerror("Error", "Failed to save design!")
                 
+    @staticmethod
+    def widget_font_size(widget, default=12):
+        """Size of a widget's font, asked of Tk directly instead of building a Font object"""
+        spec = widget.cget("font") if hasattr(widget, 'cget') else ""
+        if not spec:
+            return default
+        return int(widget.tk.call("font", "actual", spec, "-size"))
+    
     def save_design_to_file(self, design_name, design_data):
         """Save design to file"""
         try:
             design_file = os.path.join(Config.TICKET_DESIGNS_DIR, f"{design_name}.json")
-            with open(design_file, 'w', encoding='utf-8') as f:
-                json.dump(design_data, f, indent=4, ensure_ascii=False)
+            self.writer.write_json(design_file, design_data)
             return True
         except Exception as e:
             print(f"Error saving design: {e}")
@@ -1743,8 +4460,7 @@ class TicketDesigner:
         if not design_name:
             return False
             
-        data_manager = EnhancedDataManager()
-        saved_designs = data_manager.load_ticket_designs()
+        saved_designs = self.data_manager.load_ticket_designs()
         
         if design_name in saved_designs:
             design_data = saved_designs[design_name]
@@ -1781,10 +4497,10 @@ class TicketDesigner:
                 for element_type, element_data in design_data["elements"].items():
                     for widget in self.ticket_frame.winfo_children():
                         if hasattr(widget, 'element_type') and widget.element_type == element_type:
-                            widget.place(x=element_data.get("x", 50), 
-                                       y=element_data.get("y", 50))
+                            self.show_element(widget, element_data.get("x", 50),
+                                              element_data.get("y", 50))
                             if not element_data.get("visible", True):
-                                widget.place_forget()
+                                self.hide_element(widget)
             
             # تحديث اللوجو
             self.load_ticket_logo()
@@ -1800,8 +4516,7 @@ class TicketDesigner:
     
     def update_designs_dropdown(self):
         """Update designs dropdown menu"""
-        data_manager = EnhancedDataManager()
-        saved_designs = data_manager.load_ticket_designs()
+        saved_designs = self.data_manager.load_ticket_designs()
         
         # تحديث القائمة المنسدلة
         designs_list = list(saved_designs.keys())
@@ -1817,11 +4532,11 @@ class TicketDesigner:
         for widget in self.ticket_frame.winfo_children():
             if hasattr(widget, 'element_type'):
                 if widget.winfo_ismapped():
-                    widget.place_forget()
+                    self.hide_element(widget)
                 else:
                     x = self.ticket_design.get(f"{widget.element_type}_position_x", 50)
                     y = self.ticket_design.get(f"{widget.element_type}_position_y", 50)
-                    widget.place(x=x, y=y)
+                    self.show_element(widget, x, y)
 
     def reset_element_positions(self):
         """Reset all elements to default positions"""
@@ -1846,7 +4561,7 @@ class TicketDesigner:
                     element_type = widget.element_type
                     if element_type in default_positions:
                         x, y = default_positions[element_type]
-                        widget.place(x=x, y=y)
+                        self.show_element(widget, x, y)
                         
                         # تحديث الإعدادات
                         self.ticket_design[f"{element_type}_position_x"] = x
@@ -1887,12 +4602,14 @@ class TicketDesigner:
             
         messagebox.showinfo("Success", "Ticket design saved successfully!")
             
+    def show_rendered_preview(self):
+        """Show the current design through the ticket renderer"""
+        self.update_design_from_ui()
+        TicketPreviewWindow(self.window, self.renderer, 1, self.settings, self.ticket_design)
+    
     def print_test(self):
         """Print test ticket"""
-        data_manager = EnhancedDataManager()
-        printer = EnhancedPrinterService(data_manager)
-        
-        if printer.print_ticket_with_design(999, self.settings, self.ticket_design):
+        if self.printer.print_ticket_with_design(999, self.settings, self.ticket_design):
             messagebox.showinfo("Success", "Test ticket printed successfully!")
         else:
             messagebox.showerror("Error", "Failed to print test ticket!")
@@ -2252,9 +4969,12 @@ class UILayoutDesigner:
 class PremiumQueueSystem:
     """Main application class with enhanced auto-save"""
     
-    def __init__(self):
+    def __init__(self, replication=None):
         self.data_manager = EnhancedDataManager()
-        self.enhanced_printer = EnhancedPrinterService(self.data_manager)
+        self.ticket_renderer = TicketRenderer()
+        self.printer_supervisor = PrinterSupervisor(self.data_manager.logger, PrinterTransportPool())
+        self.enhanced_printer = EnhancedPrinterService(self.data_manager, self.ticket_renderer,
+                                                       self.printer_supervisor)
         self.drag_drop = DragDropManager(self)
         self.auto_save_manager = AutoSaveManager(self)
         
@@ -2272,11 +4992,34 @@ class PremiumQueueSystem:
                 self.current_number = queue_number
                 self.settings["current_number"] = queue_number
         
+        self.day_rollover = DayRolloverEngine(self.data_manager)
+        self.statistics = StatisticsAggregator(self.data_manager.writer, self.data_manager.logger,
+                                               self.statistics_file())
+        self.statistics.load()
+        self.history = TicketHistoryStore(self.data_manager.logger)
+        self.file_worker = ThreadPoolExecutor(max_workers=1)
+        
+        # Shared counter between kiosks, if enabled
+        self.shared_counter = None
+        self.setup_counter_backend()
+        
+        # Leader/follower replication; command line options override settings
+        self.replication_config = dict(self.settings["replication"], **(replication or {}))
+        self.replication_leader = None
+        self.replication_follower = None
+        
         # Store widget references
         self.widgets = {}
         
+        # Fonts from the fonts folder, and the ticket layout with its fonts, ready before the first print
+        font_count = font_registry.discover()
+        if font_count:
+            self.data_manager.logger.info(f"Loaded {font_count} fonts: {', '.join(font_registry.families)}")
+        self.ticket_renderer.get_layout(self.settings, self.settings["ticket_design"])
+        
         # Create main window
         self.root = tk.Tk()
+        self.scheduler = PeriodicScheduler(self.root, self.data_manager.logger)
         self.setup_window()
         self.create_widgets()
         self.create_buttons()
@@ -2286,8 +5029,23 @@ class PremiumQueueSystem:
         if self.settings.get("business_rules", {}).get("auto_save_interval", 10) > 0:
             self.auto_save_manager.start()
         
-        # Setup auto-save timer
-        self.setup_auto_save_timer()
+        # Periodic display jobs
+        self.scheduler.add("clock", self.get_clock_interval(), self.update_time)
+        self.scheduler.add("auto_save_status", 5, self.update_auto_save_status)
+        self.scheduler.add("stats", 5, self.update_stats)
+        self.setup_printer_supervisor()
+        self.printer_supervisor.start()
+        self.scheduler.add("printer_status", 2, self.update_printer_status)
+        self.setup_counter_flush()
+        if self.shared_counter is not None:
+            self.scheduler.add("shared_counter", 0.5, self.poll_shared_counter)
+        self.setup_replication()
+        log_pipeline.configure(self.settings["logging"])
+        self.setup_metrics()
+        self.check_day_rollover()
+        self.scheduler.add("day_rollover", 60, self.check_day_rollover)
+        self.scheduler.add("statistics_flush", 60, self.statistics.flush)
+        self.scheduler.start()
         
         # Setup emergency handlers
         self.setup_emergency_handlers()
@@ -2311,29 +5069,17 @@ class PremiumQueueSystem:
         y = (screen_height // 2) - (height // 2)
         self.root.geometry(f'{width}x{height}+{x}+{y}')
         
-        # Set background
+        # Set background; gradients are redrawn once the window stops resizing
+        self.background_label = None
+        self.background_image = None
+        self.background_key = None
+        self.background_debouncer = Debouncer(self.root, 150, self.render_background)
+        self.root.bind("<Configure>", self.on_root_configure)
         self.update_background()
         
         # Bind close event
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
     
-    def setup_auto_save_timer(self):
-        """Setup periodic auto-save timer"""
-        interval = self.settings.get("business_rules", {}).get("auto_save_interval", 10) * 1000  # Convert to milliseconds
-        self.root.after(interval, self.periodic_auto_save)
-    
-    def periodic_auto_save(self):
-        """Periodic auto-save function"""
-        try:
-            self.save_current_state()
-            
-            # Schedule next auto-save
-            interval = self.settings.get("business_rules", {}).get("auto_save_interval", 10) * 1000
-            self.root.after(interval, self.periodic_auto_save)
-            
-        except Exception as e:
-            self.data_manager.logger.error(f"Error in periodic auto-save: {e}")
-    
     def setup_emergency_handlers(self):
         """Setup emergency handlers for unexpected shutdown"""
         # This is already handled by EnhancedDataManager signal handlers
@@ -2344,14 +5090,49 @@ class PremiumQueueSystem:
         main_settings = self.settings["main_window"]
         
         if main_settings["use_gradient"]:
-            # Create gradient background
-            from_col = main_settings["gradient_start"]
-            to_col = main_settings["gradient_end"]
-            
-            # Simple gradient effect
-            self.root.configure(bg=from_col)
+            # Widgets keep the start colour behind their own backgrounds
+            self.root.configure(bg=main_settings["gradient_start"])
+            self.render_background()
         else:
             self.root.configure(bg=main_settings["bg_color"])
+            if self.background_label is not None:
+                self.background_label.place_forget()
+    
+    def on_root_configure(self, event):
+        """Resize events bubble up from every child; only the window's own count"""
+        if event.widget is self.root:
+            self.background_debouncer()
+    
+    def render_background(self):
+        """Draw the gradient for the current window size, reusing the last image if unchanged"""
+        main_settings = self.settings["main_window"]
+        if not main_settings["use_gradient"]:
+            return
+        
+        width, height = self.root.winfo_width(), self.root.winfo_height()
+        if width <= 1 or height <= 1:
+            # Not mapped yet
+            width = self.settings["ui_layout"]["window_width"]
+            height = self.settings["ui_layout"]["window_height"]
+        key = (width, height, main_settings["gradient_start"], main_settings["gradient_end"])
+        
+        if key != self.background_key:
+            try:
+                size = (width, height)
+                mask = Image.linear_gradient("L").resize(size)
+                gradient = Image.composite(Image.new("RGB", size, main_settings["gradient_end"]),
+                                           Image.new("RGB", size, main_settings["gradient_start"]), mask)
+            except ValueError as e:
+                self.data_manager.logger.error(f"Error drawing gradient background: {e}")
+                return
+            self.background_image = ImageTk.PhotoImage(gradient, master=self.root)
+            self.background_key = key
+            if self.background_label is None:
+                self.background_label = tk.Label(self.root, borderwidth=0, highlightthickness=0)
+            self.background_label.config(image=self.background_image)
+        
+        self.background_label.place(x=0, y=0, relwidth=1, relheight=1)
+        self.background_label.lower()
     
     def create_widgets(self):
         """Create all widgets"""
@@ -2364,12 +5145,11 @@ class PremiumQueueSystem:
         self.widgets["logo"] = self.logo_label
         
         # ========== Title ==========
-        title_font = (main_settings["title_font"], 
-                     main_settings["title_size"], 
-                     "bold" if main_settings["title_bold"] else "normal")
+        title_font = font_registry.tk_font(main_settings["title_font"], main_settings["title_size"],
+                                           main_settings["title_bold"])
         self.title_label = tk.Label(
             self.root,
-            text=self.settings["title"],
+            text=text_shaper.for_tk(self.settings["title"]),
             font=title_font,
             bg=bg_color,
             fg=main_settings["title_color"]
@@ -2377,11 +5157,10 @@ class PremiumQueueSystem:
         self.widgets["title"] = self.title_label
         
         # ========== Company Name ==========
-        company_font = (main_settings["company_font"], 
-                       main_settings["company_size"])
+        company_font = font_registry.tk_font(main_settings["company_font"], main_settings["company_size"])
         self.company_label = tk.Label(
             self.root,
-            text=self.settings.get("company_name", ""),
+            text=text_shaper.for_tk(self.settings.get("company_name", "")),
             font=company_font,
             bg=bg_color,
             fg=main_settings["company_color"]
@@ -2389,8 +5168,7 @@ class PremiumQueueSystem:
         self.widgets["company"] = self.company_label
         
         # ========== Time Display ==========
-        time_font = (main_settings["time_font"], 
-                    main_settings["time_size"])
+        time_font = font_registry.tk_font(main_settings["time_font"], main_settings["time_size"])
         self.time_label = tk.Label(
             self.root,
             font=time_font,
@@ -2414,8 +5192,7 @@ class PremiumQueueSystem:
         self.widgets["number_label"] = self.number_label
         
         # ========== Statistics ==========
-        stats_font = (main_settings["stats_font"], 
-                     main_settings["stats_size"])
+        stats_font = font_registry.tk_font(main_settings["stats_font"], main_settings["stats_size"])
         self.stats_label = tk.Label(
             self.root,
             font=stats_font,
@@ -2426,8 +5203,8 @@ class PremiumQueueSystem:
         self.update_stats()
         
         # ========== Instructions ==========
-        instructions_font = (main_settings["instructions_font"], 
-                           main_settings["instructions_size"])
+        instructions_font = font_registry.tk_font(main_settings["instructions_font"],
+                                                  main_settings["instructions_size"])
         self.instructions_label = tk.Label(
             self.root,
             text="Press Print button to print current ticket | Settings for customization",
@@ -2450,6 +5227,16 @@ class PremiumQueueSystem:
         
         # Update auto-save status periodically
         self.update_auto_save_status()
+        
+        # ========== Printer Status ==========
+        self.printer_status = tk.Label(
+            self.root,
+            text="🖨️ Printer: unknown",
+            font=("Arial", 10),
+            bg=bg_color,
+            fg="#4CAF50"
+        )
+        self.printer_status.place(x=10, y=30)
     
     def update_auto_save_status(self):
         """Update auto-save status display"""
@@ -2457,10 +5244,23 @@ class PremiumQueueSystem:
         save_count = self.settings.get("auto_save", {}).get("save_count", 0)
         
         status_text = f"💾 Auto-save: {save_count} saves | Last: {last_save}"
-        self.auto_save_status.config(text=status_text)
-        
-        # Update every 5 seconds
-        self.root.after(5000, self.update_auto_save_status)
+        self.scheduler.set_label_text(self.auto_save_status, status_text)
+    
+    def setup_printer_supervisor(self):
+        """Point the supervisor at the main and secondary printers"""
+        printer_settings = self.settings["printer_settings"]
+        self.printer_supervisor.configure(
+            [printer_settings.get("port") or Config.SERIAL_PORT, printer_settings.get("secondary_port", "")],
+            printer_settings.get("baud_rate", Config.BAUD_RATE),
+            printer_settings.get("status_poll_interval", 15)
+        )
+    
+    def update_printer_status(self):
+        """Show the supervisor's view of the printers"""
+        primary = self.printer_supervisor.ports[0] if self.printer_supervisor.ports else None
+        healthy = primary is not None and self.printer_supervisor.usable(primary)
+        self.printer_status.config(fg="#4CAF50" if healthy else "#E74C3C")
+        self.scheduler.set_label_text(self.printer_status, self.printer_supervisor.summary())
     
     def create_number_display(self):
         """Create number display (circle or rectangle)"""
@@ -2469,6 +5269,7 @@ class PremiumQueueSystem:
         
         # Remove old number display if exists
         if hasattr(self, 'number_canvas'):
+            self.number_display.cancel()
             self.number_canvas.destroy()
         
         shape = main_settings.get("number_shape", "circle")
@@ -2491,13 +5292,7 @@ class PremiumQueueSystem:
                 width=main_settings["number_border_width"]
             )
             
-            # Draw number
-            self.number_text = self.number_canvas.create_text(
-                150, 150,
-                text=str(self.current_number),
-                font=("Arial", main_settings["number_size"], "bold"),
-                fill=main_settings["number_color"]
-            )
+            number_center = (150, 150)
             
         else:  # rectangle
             width = main_settings.get("number_rectangle_width", 280)
@@ -2522,13 +5317,13 @@ class PremiumQueueSystem:
                 width=main_settings["number_border_width"]
             )
             
-            # Draw number
-            self.number_text = self.number_canvas.create_text(
-                width/2, height/2,
-                text=str(self.current_number),
-                font=("Arial", main_settings["number_size"], "bold"),
-                fill=main_settings["number_color"]
-            )
+            number_center = (width / 2, height / 2)
+        
+        # Draw number
+        self.number_display = NumberDisplay(self.number_canvas, number_center,
+                                            main_settings.get("number_font", "Arial"),
+                                            main_settings["number_size"], main_settings["number_color"])
+        self.number_display.show(str(self.current_number))
         
         self.widgets["number"] = self.number_canvas
     
@@ -2768,14 +5563,20 @@ class PremiumQueueSystem:
                 else:
                     widget.place_forget()
     
+    def get_clock_interval(self):
+        """Tick every second only if the time format shows seconds"""
+        time_format = self.settings["main_window"]["time_format"]
+        if any(directive in time_format for directive in ("%S", "%X", "%c", "%T", "%s")):
+            return 1
+        return 60
+    
     def update_time(self):
         """Update time display"""
         now = datetime.now()
         time_format = self.settings["main_window"]["time_format"]
         time_str = now.strftime(time_format)
         
-        self.time_label.config(text=f"📅 {time_str}")
-        self.root.after(1000, self.update_time)
+        self.scheduler.set_label_text(self.time_label, f"📅 {time_str}")
     
     def update_stats(self):
         """Update statistics display"""
@@ -2784,162 +5585,350 @@ class PremiumQueueSystem:
         Total Printed: {self.queue_data.get('total_printed', 0)} | 
         Current Number: {self.current_number}
         """
-        self.stats_label.config(text=stats)
+        summary = self.statistics.summary()
+        if summary["called_today"]:
+            stats = stats.rstrip() + f" | Avg Wait: {summary['average_wait_today'] / 60:.1f} min\n        "
+        self.scheduler.set_label_text(self.stats_label, stats)
     
     def prev_number(self):
         """Decrease number"""
+        if self.is_follower():
+            return
         start_number = self.settings["business_rules"]["start_number"]
+        if self.shared_counter is not None:
+            self.update_shared_counter(self.shared_counter.advance, -1, start_number)
+            return
         if self.current_number > start_number:
             self.current_number -= 1
             self.update_number_display()
             self.save_current_state()
+            self.publish_state("call")
     
     def next_number(self):
         """Increase number"""
-        self.current_number += 1
+        with log_pipeline.ticket():
+            if self.is_follower():
+                return
+            served = self.called_number()
+            if self.shared_counter is not None:
+                if self.update_shared_counter(self.shared_counter.advance, 1):
+                    self.record_ticket_event("call", served)
+                return
+            self.current_number += 1
+            self.record_ticket_event("call", served)
+            self.update_number_display()
+            self.record_counters()
+            self.publish_state("call")
+    
+    def check_day_rollover(self):
+        """Start a new business day when the rollover time has passed"""
+        if self.replication_follower is not None:
+            return
+        rules = self.settings["business_rules"]
+        due = self.day_rollover.due(self.queue_data, rules)
+        if due is None:
+            return
+        
+        finished_day, new_day = due
+        start_number = rules["start_number"] if rules.get("reset_at_midnight") else None
+        finished = {
+            "current_number": self.current_number,
+            "today_count": self.queue_data.get("today_count", 0),
+            "total_printed": self.queue_data.get("total_printed", 0)
+        }
+        try:
+            if self.shared_counter is not None:
+                # Only the first kiosk to get here archives the day
+                finished = self.shared_counter.rollover(new_day, start_number)
+                self.apply_shared_counters(self.shared_counter.read(), kind="reset")
+            if finished is not None:
+                self.day_rollover.archive(finished_day, finished)
+        except Exception as e:
+            self.data_manager.logger.error(f"Error rolling over business day {finished_day}: {e}")
+            return
+        
+        self.queue_data["business_day"] = new_day
+        if self.shared_counter is None:
+            self.queue_data["today_count"] = 0
+            if start_number is not None:
+                self.current_number = start_number
         self.update_number_display()
         self.save_current_state()
+        self.publish_state("reset")
+        self.data_manager.logger.info(f"New business day {new_day}")
+    
+    def called_number(self):
+        """Number served by the next call: the oldest issued ticket still waiting"""
+        waiting = self.statistics.oldest_waiting()
+        if waiting is not None:
+            return waiting
+        # Nothing issued is waiting; after an auto increment the screen is already one past the last ticket
+        if self.shared_counter is None and self.settings["business_rules"]["auto_increment_after_print"]:
+            return max(self.current_number - 1, self.settings["business_rules"]["start_number"])
+        return self.current_number
+    
+    def record_ticket_event(self, event, number):
+        """Feed an issued or called ticket to statistics and history"""
+        metrics.increment("tickets_issued" if event == "issue" else "tickets_called")
+        if event == "issue":
+            self.statistics.record_issue(number)
+        else:
+            self.statistics.record_call(number)
+        self.history.append(event, number)
+    
+    def export_history(self, parent):
+        """Export ticket history in the background"""
+        file_path = filedialog.asksaveasfilename(
+            parent=parent,
+            defaultextension=".csv",
+            filetypes=[("CSV files", "*.csv"), ("JSON Lines", "*.jsonl")],
+            initialfile=f"tickets_{datetime.now().strftime('%Y%m%d')}.csv"
+        )
+        if not file_path:
+            return
+        start_day = simpledialog.askstring("Export History", "From date (YYYY-MM-DD, empty = all):", parent=parent)
+        end_day = simpledialog.askstring("Export History", "To date (YYYY-MM-DD, empty = all):", parent=parent)
+        services = simpledialog.askstring("Export History", "Services (e.g. 0,2; empty = all):", parent=parent)
+        try:
+            services = [int(part) for part in (services or "").replace(" ", "").split(",") if part] or None
+        except ValueError:
+            messagebox.showerror("Export History", "Services must be numbers separated by commas", parent=parent)
+            return
+        export_format = "jsonl" if file_path.lower().endswith(".jsonl") else "csv"
+        
+        # A separate store, so the export thread never shares the append handle
+        export_store = TicketHistoryStore(self.data_manager.logger)
+        job = self.file_worker.submit(
+            export_store.export, file_path, export_format, start_day or None, end_day or None, services)
+        
+        def check_export():
+            if not job.done():
+                self.root.after(200, check_export)
+                return
+            try:
+                count = job.result()
+                messagebox.showinfo("Export History", f"Exported {count} records to {file_path}", parent=parent)
+            except Exception as e:
+                self.data_manager.logger.error(f"Error exporting history: {e}")
+                messagebox.showerror("Export History", f"Export failed: {e}", parent=parent)
+        
+        check_export()
+    
+    def setup_metrics(self):
+        """Enable instrumentation and its exporters as configured"""
+        metrics_settings = self.settings["metrics"]
+        metrics.enabled = metrics_settings.get("enabled", False)
+        
+        metrics.stop_http()
+        if metrics.enabled and metrics_settings.get("http_port", 0):
+            try:
+                metrics.start_http(int(metrics_settings["http_port"]))
+                self.data_manager.logger.info(f"Metrics served on http://127.0.0.1:{metrics_settings['http_port']}/metrics")
+            except OSError as e:
+                self.data_manager.logger.error(f"Error starting metrics endpoint: {e}")
+        
+        if metrics.enabled and metrics_settings.get("textfile"):
+            self.scheduler.add("metrics_export", 15, self.export_metrics)
+        else:
+            self.scheduler.remove("metrics_export")
+    
+    def export_metrics(self):
+        try:
+            metrics.write_textfile(self.settings["metrics"]["textfile"], self.data_manager.writer)
+        except Exception as e:
+            self.data_manager.logger.error(f"Error writing metrics file: {e}")
+    
+    def setup_replication(self):
+        """Start the replication leader or follower configured for this kiosk"""
+        role = self.replication_config.get("role", "off")
+        host = self.replication_config.get("host", "127.0.0.1")
+        port = int(self.replication_config.get("port", 9300))
+        try:
+            if role == "leader":
+                self.replication_leader = ReplicationLeader(host, port, self.data_manager.logger,
+                                                            self.get_replicated_state())
+                self.replication_leader.start()
+            elif role == "follower":
+                self.replication_follower = ReplicationFollower(host, port, self.data_manager.logger)
+                self.replication_follower.start()
+                self.scheduler.add("replication", 0.1, self.apply_replicated_events)
+        except Exception as e:
+            self.data_manager.logger.error(f"Error starting replication ({role}): {e}")
+    
+    def get_replicated_state(self):
+        return {
+            "current_number": self.current_number,
+            "today_count": self.queue_data.get("today_count", 0),
+            "total_printed": self.queue_data.get("total_printed", 0)
+        }
+    
+    def publish_state(self, kind):
+        """Send the counters to followers if this kiosk is the leader"""
+        if self.replication_leader is not None:
+            self.replication_leader.publish(kind, self.get_replicated_state())
+    
+    def is_follower(self):
+        """Followers only display the leader's numbers"""
+        if self.replication_follower is None:
+            return False
+        leader = f"{self.replication_follower.host}:{self.replication_follower.port}"
+        messagebox.showinfo("Follower", f"This screen follows the leader kiosk at {leader}.")
+        return True
+    
+    def apply_replicated_events(self):
+        """Apply state streamed by the leader"""
+        events = self.replication_follower.drain()
+        if not events:
+            return
+        state = events[-1]["state"]
+        self.current_number = state["current_number"]
+        self.queue_data["today_count"] = state["today_count"]
+        self.queue_data["total_printed"] = state["total_printed"]
+        # Display only: the leader owns the counter files, which may be in this data directory
+        self.update_number_display()
+    
+    def record_counters(self):
+        """Record counters in the mapped counter file; settings follow on the next auto-save"""
+        self.settings["current_number"] = self.current_number
+        self.queue_data["current_number"] = self.current_number
+        
+        flush_ms = self.settings["business_rules"].get("counter_flush_ms", 0)
+        if not self.data_manager.record_counters(self.queue_data, flush=flush_ms <= 0):
+            self.save_current_state()
+    
+    def statistics_file(self):
+        """Statistics path; kiosks sharing a data directory each keep their own file"""
+        if self.settings["business_rules"].get("counter_backend", "local") != "shared":
+            return Config.STATS_FILE
+        kiosk = "".join(c if c.isalnum() or c in "-_" else "_" for c in socket.gethostname())
+        return os.path.join(Config.DATA_DIR, f"statistics_{kiosk}.json")
+    
+    def setup_counter_backend(self):
+        """Open or close the shared counter according to settings"""
+        backend = self.settings["business_rules"].get("counter_backend", "local")
+        if self.statistics.path != self.statistics_file():
+            self.statistics.flush()
+            self.statistics.path = self.statistics_file()
+            self.statistics.dirty = True
+        if backend == "shared" and self.shared_counter is None:
+            try:
+                self.shared_counter = SharedCounterStore(Config.SHARED_COUNTER_FILE)
+                self.queue_data["current_number"] = self.current_number
+                self.shared_counter.seed(self.queue_data)
+                self.apply_shared_counters(self.shared_counter.read())
+                self.shared_counter.changed()
+                self.data_manager.logger.info(f"Shared counter enabled: {Config.SHARED_COUNTER_FILE}")
+            except Exception as e:
+                self.data_manager.logger.error(f"Error opening shared counter: {e}")
+                self.shared_counter = None
+        elif backend != "shared" and self.shared_counter is not None:
+            self.shared_counter.close()
+            self.shared_counter = None
+    
+    def apply_shared_counters(self, counters, refresh=False, kind="call"):
+        """Mirror shared counters locally"""
+        self.current_number = counters["current_number"]
+        self.queue_data["today_count"] = counters["today_count"]
+        self.queue_data["total_printed"] = counters["total_printed"]
+        # The shared store is the durable copy; writing the local counter files too would race other kiosks
+        self.publish_state(kind)
+        if refresh:
+            self.update_number_display()
+    
+    def update_shared_counter(self, operation, *args, kind="call"):
+        """Run a shared counter operation and show the result"""
+        try:
+            self.apply_shared_counters(operation(*args), refresh=True, kind=kind)
+            return True
+        except Exception as e:
+            self.data_manager.logger.error(f"Error updating shared counter: {e}")
+            messagebox.showerror("Error", f"Shared counter unavailable: {e}")
+            return False
+    
+    def poll_shared_counter(self):
+        """Pick up numbers issued by other kiosks"""
+        if self.shared_counter is None:
+            self.scheduler.remove("shared_counter")
+            return
+        try:
+            if self.shared_counter.changed():
+                counters = self.shared_counter.read()
+                if counters and counters["current_number"] != self.current_number:
+                    self.apply_shared_counters(counters, refresh=True)
+                elif counters:
+                    self.apply_shared_counters(counters)
+                    self.update_stats()
+        except Exception as e:
+            self.data_manager.logger.error(f"Error polling shared counter: {e}")
+    
+    def setup_counter_flush(self):
+        """Flush deferred counter writes on the configured cadence"""
+        flush_ms = self.settings["business_rules"].get("counter_flush_ms", 0)
+        if flush_ms > 0:
+            self.scheduler.add("counter_flush", flush_ms / 1000, self.data_manager.flush_counters)
+        else:
+            self.scheduler.remove("counter_flush")
     
     def update_number_display(self):
         """Update number display"""
-        self.number_canvas.itemconfig(self.number_text, text=str(self.current_number))
+        # Pulse the new number; rapid changes restart one animation instead of stacking
+        self.number_display.pulse(str(self.current_number))
         self.update_stats()
-        
-        # Animation effect
-        original_size = self.settings["main_window"]["number_size"]
-        self.number_canvas.itemconfig(self.number_text, 
-                                     font=("Arial", int(original_size * 1.1), "bold"))
-        self.root.after(200, lambda: self.number_canvas.itemconfig(self.number_text, 
-                                                                  font=("Arial", original_size, "bold")))
     
     def print_ticket(self):
         """Print current ticket with current design"""
-        if self.enhanced_printer.print_ticket_with_design(self.current_number, self.settings):
-            # Update statistics
-            self.queue_data["today_count"] = self.queue_data.get("today_count", 0) + 1
-            self.queue_data["total_printed"] = self.queue_data.get("total_printed", 0) + 1
-            
-            # Auto increment if enabled
-            if self.settings["business_rules"]["auto_increment_after_print"]:
-                self.next_number()
-            else:
-                self.update_stats()
-                self.save_current_state()
-            
+        if self.is_follower():
+            return
+        if self.shared_counter is not None:
+            self.print_shared_ticket()
+            return
+        
+        with log_pipeline.ticket():
+            printed = self.enhanced_printer.print_ticket_with_design(self.current_number, self.settings)
+            if printed:
+                # Update statistics
+                self.record_ticket_event("issue", self.current_number)
+                self.queue_data["today_count"] = self.queue_data.get("today_count", 0) + 1
+                self.queue_data["total_printed"] = self.queue_data.get("total_printed", 0) + 1
+                
+                # Auto increment if enabled
+                if self.settings["business_rules"]["auto_increment_after_print"]:
+                    self.current_number += 1
+                    self.update_number_display()
+                else:
+                    self.update_stats()
+                self.record_counters()
+                self.publish_state("issue")
+        
+        if printed:
             messagebox.showinfo("Success", f"Ticket #{self.current_number} printed successfully!")
         else:
             messagebox.showerror("Error", "Failed to print. Please check printer settings.")
     
-    def preview_ticket(self):
-        """Preview ticket with visual design"""
-        preview_win = tk.Toplevel(self.root)
-        preview_win.title("Ticket Preview - Visual Design")
-        preview_win.geometry("600x700")
-        preview_win.configure(bg="white")
-        
-        # Create frame for ticket
-        ticket_frame = tk.Frame(preview_win, bg="white", width=550, height=650)
-        ticket_frame.pack_propagate(False)
-        ticket_frame.pack(pady=20)
-        
-        # Draw border
-        border_frame = tk.Frame(ticket_frame, bg="black", width=554, height=654)
-        border_frame.place(x=-2, y=-2)
-        
-        inner_frame = tk.Frame(ticket_frame, bg="white", width=550, height=650)
-        inner_frame.place(x=0, y=0)
-        
-        design = self.settings["ticket_design"]
-        
-        # Display logo if enabled
-        if design.get("show_logo", True) and os.path.exists(self.settings["logo"]):
-            try:
-                img = Image.open(self.settings["logo"])
-                width = design.get("logo_width", 150)
-                height = design.get("logo_height", 100)
-                img = img.resize((width, height), Image.Resampling.LANCZOS)
-                photo = ImageTk.PhotoImage(img)
-                logo_label = tk.Label(inner_frame, image=photo, bg="white")
-                logo_label.image = photo
-                logo_label.place(x=design.get("logo_position_x", 50), 
-                                y=design.get("logo_position_y", 50))
-            except:
-                pass
-        
-        # Display company info if enabled
-        if design.get("company_info", True):
-            company_font = ("Arial", design.get("company_font_size", 18))
-            company_label = tk.Label(inner_frame, text=self.settings["company_name"],
-                                    font=company_font, bg="white", fg="black")
-            company_label.place(x=design.get("company_position_x", 200),
-                              y=design.get("company_position_y", 50))
-            
-            address_label = tk.Label(inner_frame, text=self.settings["company_address"],
-                                    font=("Arial", 12), bg="white", fg="black")
-            address_label.place(x=design.get("company_position_x", 200),
-                               y=design.get("company_position_y", 80))
-        
-        # Ticket number
-        prefix_label = tk.Label(inner_frame, text=design.get("number_prefix", "Ticket #"),
-                               font=("Arial", 14), bg="white", fg="black")
-        prefix_label.place(x=design.get("number_position_x", 50),
-                          y=design.get("number_position_y", 150))
-        
-        number_label = tk.Label(inner_frame, text=f"{self.current_number:04d}",
-                               font=("Arial", design.get("number_size", 72), "bold"),
-                               bg="white", fg="#FF5722")
-        number_label.place(x=design.get("number_position_x", 50),
-                          y=design.get("number_position_y", 180))
-        
-        # Messages
-        if design.get("thank_message"):
-            thank_label = tk.Label(inner_frame, text=design["thank_message"],
-                                  font=("Arial", design.get("thank_font_size", 14)),
-                                  bg="white", fg="black")
-            thank_label.place(x=design.get("thank_position_x", 50),
-                            y=design.get("thank_position_y", 280))
-        
-        if design.get("warning_message"):
-            warning_label = tk.Label(inner_frame, text=design["warning_message"],
-                                    font=("Arial", design.get("warning_font_size", 12)),
-                                    bg="white", fg="black")
-            warning_label.place(x=design.get("warning_position_x", 50),
-                              y=design.get("warning_position_y", 320))
-        
-        if design.get("custom_message"):
-            custom_label = tk.Label(inner_frame, text=design["custom_message"],
-                                   font=("Arial", design.get("message_font_size", 12)),
-                                   bg="white", fg="black")
-            custom_label.place(x=design.get("custom_position_x", 50),
-                             y=design.get("custom_position_y", 450))
-        
-        # Date and time
-        now = datetime.now()
-        if design.get("show_date", True):
-            date_label = tk.Label(inner_frame, 
-                                 text=f"Date: {now.strftime(design.get('date_format', '%Y-%m-%d'))}",
-                                 font=("Arial", 12), bg="white", fg="black")
-            date_label.place(x=design.get("date_position_x", 50),
-                            y=design.get("date_position_y", 370))
-        
-        if design.get("show_time", True):
-            time_label = tk.Label(inner_frame,
-                                 text=f"Time: {now.strftime(design.get('time_format', '%H:%M:%S'))}",
-                                 font=("Arial", 12), bg="white", fg="black")
-            time_label.place(x=design.get("time_position_x", 50),
-                            y=design.get("time_position_y", 400))
+    def print_shared_ticket(self):
+        """Claim a number from the shared counter, then print it"""
+        try:
+            ticket_no, counters = self.shared_counter.claim()
+            self.apply_shared_counters(counters, refresh=True)
+        except Exception as e:
+            self.data_manager.logger.error(f"Error claiming shared number: {e}")
+            messagebox.showerror("Error", f"Shared counter unavailable: {e}")
+            return
         
-        # Watermark
-        if design.get("watermark", True) and design.get("watermark_text"):
-            watermark_label = tk.Label(inner_frame, text=design["watermark_text"],
-                                      font=("Arial", design.get("watermark_font_size", 10)),
-                                      bg="white", fg="#888888")
-            watermark_label.place(x=design.get("watermark_position_x", 200),
-                                 y=design.get("watermark_position_y", 500))
+        with log_pipeline.ticket():
+            printed = self.enhanced_printer.print_ticket_with_design(ticket_no, self.settings)
+            if printed:
+                self.record_ticket_event("issue", ticket_no)
+                self.update_shared_counter(self.shared_counter.mark_printed, kind="issue")
         
-        # Close button
-        tk.Button(preview_win, text="Close", command=preview_win.destroy,
-                 bg="#E74C3C", fg="white", font=("Arial", 12)).pack(pady=10)
+        if printed:
+            messagebox.showinfo("Success", f"Ticket #{ticket_no} printed successfully!")
+        else:
+            messagebox.showerror("Error", f"Failed to print ticket #{ticket_no}. Please check printer settings.")
+    
+    def preview_ticket(self):
+        """Preview ticket with visual design"""
+        TicketPreviewWindow(self.root, self.ticket_renderer, self.current_number, self.settings)
     
     def save_current_design(self):
         """Save current ticket design from main window"""
@@ -2983,7 +5972,8 @@ class PremiumQueueSystem:
             messagebox.showerror("Access Denied", "Incorrect password!")
             return
         
-        designer = TicketDesigner(self.root, self.settings, self.on_design_saved)
+        designer = TicketDesigner(self.root, self.settings, self.on_design_saved,
+                                  self.data_manager, self.enhanced_printer)
     
     def on_design_saved(self, new_design):
         """Callback when design is saved"""
@@ -2999,14 +5989,24 @@ class PremiumQueueSystem:
     
     def reset_counter(self):
         """Reset counter to start number"""
+        if self.is_follower():
+            return
         if messagebox.askyesno("Confirm", "Reset counter to start number?"):
+            if self.shared_counter is not None and not self.update_shared_counter(
+                    self.shared_counter.set_current, self.settings["business_rules"]["start_number"],
+                    kind="reset"):
+                return
             self.current_number = self.settings["business_rules"]["start_number"]
             self.update_number_display()
             self.save_current_state()
+            self.publish_state("reset")
             messagebox.showinfo("Done", "Counter reset successfully")
     
     def save_current_state(self):
         """Save current state with enhanced auto-save"""
+        if self.replication_follower is not None or self.shared_counter is not None:
+            # Replayed or shared numbers are owned elsewhere; keep only this kiosk's settings
+            return self.data_manager.save_settings(self.settings)
         try:
             # Update settings with current number
             self.settings["current_number"] = self.current_number
@@ -3780,6 +6780,16 @@ class PremiumQueueSystem:
         tk.Checkbutton(business_scrollable_frame, text="Auto increment after printing", 
                       variable=auto_var, font=("Arial", 12)).pack(pady=10)
         
+        # Day rollover
+        reset_midnight_var = tk.BooleanVar(value=self.settings["business_rules"].get("reset_at_midnight", False))
+        tk.Checkbutton(business_scrollable_frame, text="Reset number to start at day rollover", 
+                      variable=reset_midnight_var, font=("Arial", 12)).pack(pady=10)
+        tk.Label(business_scrollable_frame, text="Day Rollover Time (HH:MM):", 
+                font=("Arial", 12)).pack(pady=5)
+        rollover_time_var = tk.StringVar(value=self.settings["business_rules"].get("day_rollover_time", "00:00"))
+        tk.Entry(business_scrollable_frame, textvariable=rollover_time_var,
+                width=10, font=("Arial", 12)).pack(pady=5)
+        
         # Auto-save settings
         tk.Label(business_scrollable_frame, text="Auto-Save Settings:", 
                 font=("Arial", 16, "bold")).pack(pady=20)
@@ -3794,6 +6804,80 @@ class PremiumQueueSystem:
         tk.Checkbutton(business_scrollable_frame, text="Create automatic backups", 
                       variable=create_backups_var, font=("Arial", 12)).pack(pady=10)
         
+        tk.Label(business_scrollable_frame, text="Storage Format:", 
+                font=("Arial", 12)).pack(pady=5)
+        storage_format_var = tk.StringVar(value=self.settings["business_rules"].get("storage_format", "json"))
+        ttk.Combobox(business_scrollable_frame, textvariable=storage_format_var,
+                    values=["json", "snapshot"], state="readonly",
+                    width=10, font=("Arial", 12)).pack(pady=5)
+        
+        tk.Label(business_scrollable_frame, text="Counter Backend (shared = several kiosks, one data folder):", 
+                font=("Arial", 12)).pack(pady=5)
+        counter_backend_var = tk.StringVar(value=self.settings["business_rules"].get("counter_backend", "local"))
+        ttk.Combobox(business_scrollable_frame, textvariable=counter_backend_var,
+                    values=["local", "shared"], state="readonly",
+                    width=10, font=("Arial", 12)).pack(pady=5)
+        
+        tk.Label(business_scrollable_frame, text="Counter Flush Interval (ms, 0 = every ticket):", 
+                font=("Arial", 12)).pack(pady=5)
+        counter_flush_var = tk.IntVar(value=self.settings["business_rules"].get("counter_flush_ms", 0))
+        tk.Scale(business_scrollable_frame, from_=0, to=5000, resolution=100, variable=counter_flush_var,
+                orient="horizontal", length=300).pack(pady=5)
+        
+        # Replication between screens
+        tk.Label(business_scrollable_frame, text="Replication (applies after restart):", 
+                font=("Arial", 16, "bold")).pack(pady=20)
+        replication_role_var = tk.StringVar(value=self.settings["replication"].get("role", "off"))
+        ttk.Combobox(business_scrollable_frame, textvariable=replication_role_var,
+                    values=["off", "leader", "follower"], state="readonly",
+                    width=10, font=("Arial", 12)).pack(pady=5)
+        tk.Label(business_scrollable_frame, text="Leader Host:", font=("Arial", 12)).pack(pady=5)
+        replication_host_var = tk.StringVar(value=self.settings["replication"].get("host", "127.0.0.1"))
+        tk.Entry(business_scrollable_frame, textvariable=replication_host_var,
+                width=15, font=("Arial", 12)).pack(pady=5)
+        tk.Label(business_scrollable_frame, text="Port:", font=("Arial", 12)).pack(pady=5)
+        replication_port_var = tk.IntVar(value=self.settings["replication"].get("port", 9300))
+        tk.Spinbox(business_scrollable_frame, from_=1024, to=65535, textvariable=replication_port_var,
+                  width=10, font=("Arial", 12)).pack(pady=5)
+        
+        # Performance metrics
+        tk.Label(business_scrollable_frame, text="Performance Metrics:", 
+                font=("Arial", 16, "bold")).pack(pady=20)
+        metrics_enabled_var = tk.BooleanVar(value=self.settings["metrics"].get("enabled", False))
+        tk.Checkbutton(business_scrollable_frame, text="Record save, print and render timings", 
+                      variable=metrics_enabled_var, font=("Arial", 12)).pack(pady=5)
+        tk.Label(business_scrollable_frame, text="Prometheus Text File (empty = off):", font=("Arial", 12)).pack(pady=5)
+        metrics_textfile_var = tk.StringVar(value=self.settings["metrics"].get("textfile", ""))
+        tk.Entry(business_scrollable_frame, textvariable=metrics_textfile_var,
+                width=40, font=("Arial", 12)).pack(pady=5)
+        tk.Label(business_scrollable_frame, text="HTTP Port for /metrics (0 = off):", font=("Arial", 12)).pack(pady=5)
+        metrics_port_var = tk.IntVar(value=self.settings["metrics"].get("http_port", 0))
+        tk.Spinbox(business_scrollable_frame, from_=0, to=65535, textvariable=metrics_port_var,
+                  width=10, font=("Arial", 12)).pack(pady=5)
+        
+        # Logging
+        tk.Label(business_scrollable_frame, text="Logging:", 
+                font=("Arial", 16, "bold")).pack(pady=20)
+        tk.Label(business_scrollable_frame, text="Level:", font=("Arial", 12)).pack(pady=5)
+        log_level_var = tk.StringVar(value=self.settings["logging"].get("level", "INFO"))
+        ttk.Combobox(business_scrollable_frame, textvariable=log_level_var,
+                    values=["DEBUG", "INFO", "WARNING", "ERROR"], state="readonly",
+                    width=10, font=("Arial", 12)).pack(pady=5)
+        tk.Label(business_scrollable_frame, text="Log Format:", font=("Arial", 12)).pack(pady=5)
+        log_format_var = tk.StringVar(value=self.settings["logging"].get("format", "text"))
+        ttk.Combobox(business_scrollable_frame, textvariable=log_format_var,
+                    values=["text", "jsonl"], state="readonly",
+                    width=10, font=("Arial", 12)).pack(pady=5)
+        tk.Label(business_scrollable_frame, text="Rotate Log At (KB):", font=("Arial", 12)).pack(pady=5)
+        log_size_var = tk.IntVar(value=self.settings["logging"].get("max_bytes", 1048576) // 1024)
+        tk.Spinbox(business_scrollable_frame, from_=64, to=102400, increment=64, textvariable=log_size_var,
+                  width=10, font=("Arial", 12)).pack(pady=5)
+        tk.Label(business_scrollable_frame, text="Info Lines Per Ticket (0 = unlimited):", 
+                font=("Arial", 12)).pack(pady=5)
+        log_budget_var = tk.IntVar(value=self.settings["logging"].get("ticket_budget", 3))
+        tk.Spinbox(business_scrollable_frame, from_=0, to=50, textvariable=log_budget_var,
+                  width=10, font=("Arial", 12)).pack(pady=5)
+        
         tk.Label(business_scrollable_frame, text="Backup Interval (seconds):", 
                 font=("Arial", 12)).pack(pady=5)
         backup_interval_var = tk.IntVar(value=self.settings["business_rules"].get("backup_interval", 60))
@@ -3852,28 +6936,109 @@ class PremiumQueueSystem:
         tk.Label(printer_scrollable_frame, text="Printer Settings", font=("Arial", 20, "bold")).pack(pady=20)
         
         # Port selection
-        tk.Label(printer_scrollable_frame, text="Serial Port:", font=("Arial", 12)).pack(pady=5)
-        port_var = tk.StringVar(value=Config.SERIAL_PORT)
+        tk.Label(printer_scrollable_frame, text="Printer Port (COM3, /dev/ttyUSB0, 192.168.1.50:9100 or file:/path):", 
+                font=("Arial", 12)).pack(pady=5)
+        port_var = tk.StringVar(value=self.settings["printer_settings"].get("port") or Config.SERIAL_PORT)
         port_entry = tk.Entry(printer_scrollable_frame, textvariable=port_var,
-                             width=15, font=("Arial", 12))
+                             width=30, font=("Arial", 12))
         port_entry.pack(pady=5)
         
         # Baud rate
         tk.Label(printer_scrollable_frame, text="Baud Rate:", font=("Arial", 12)).pack(pady=5)
-        baud_var = tk.IntVar(value=Config.BAUD_RATE)
+        baud_var = tk.IntVar(value=self.settings["printer_settings"].get("baud_rate", Config.BAUD_RATE))
         baud_combo = ttk.Combobox(printer_scrollable_frame, textvariable=baud_var,
                                  values=[9600, 19200, 38400, 57600, 115200],
                                  width=10, font=("Arial", 12))
         baud_combo.pack(pady=5)
         
+        def test_printer_connection():
+            """Probe the printer in the background so the dialog stays responsive"""
+            port, baud = port_var.get().strip(), baud_var.get()
+            test_button.config(state="disabled", text="🖨️ Testing...")
+            scanner = PrinterPortScanner(self.enhanced_printer.transports, timeout=1.0)
+            job = self.file_worker.submit(scanner.probe, port, baud)
+            
+            def check_test():
+                if not job.done():
+                    self.root.after(100, check_test)
+                    return
+                test_button.config(state="normal", text="🖨️ Test Printer Connection")
+                try:
+                    answered = job.result()
+                except Exception as e:
+                    messagebox.showerror("Error", f"Failed to connect to printer: {str(e)}", parent=settings_win)
+                    return
+                if answered:
+                    messagebox.showinfo("Success", f"Printer connected successfully on {port}", parent=settings_win)
+                else:
+                    messagebox.showwarning("No Reply", f"{port} opened, but no printer answered at {baud} baud",
+                                           parent=settings_win)
+            
+            check_test()
+        
+        self.test_printer_connection = test_printer_connection
+        
+        def auto_detect_printer():
+            """Probe every serial port in the background and offer what answers"""
+            detect_button.config(state="disabled", text="🔍 Searching...")
+            job = self.file_worker.submit(PrinterPortScanner(self.enhanced_printer.transports).scan)
+            
+            def check_scan():
+                if not job.done():
+                    self.root.after(200, check_scan)
+                    return
+                detect_button.config(state="normal", text="🔍 Auto-Detect Printer")
+                try:
+                    found = job.result()
+                except Exception as e:
+                    self.data_manager.logger.error(f"Printer auto-detect failed: {e}")
+                    messagebox.showerror("Auto-Detect", f"Search failed: {e}", parent=settings_win)
+                    return
+                if not found:
+                    messagebox.showwarning("Auto-Detect", "No printer answered on any port", parent=settings_win)
+                    return
+                port, baud = found[0]
+                others = "".join(f"\n  {p} @ {b}" for p, b in found[1:])
+                if messagebox.askyesno("Auto-Detect", f"Found a printer on {port} at {baud} baud."
+                                       + (f"\nAlso answering:{others}" if others else "")
+                                       + "\n\nUse it?", parent=settings_win):
+                    port_var.set(port)
+                    baud_var.set(baud)
+            
+            check_scan()
+        
+        detect_button = tk.Button(printer_scrollable_frame, text="🔍 Auto-Detect Printer",
+                                  command=auto_detect_printer,
+                                  bg="#8E44AD", fg="white", font=("Arial", 12), width=25)
+        detect_button.pack(pady=5)
+        
+        # Failover printer
+        tk.Label(printer_scrollable_frame, text="Secondary Port (empty = none):", font=("Arial", 12)).pack(pady=5)
+        secondary_port_var = tk.StringVar(value=self.settings["printer_settings"].get("secondary_port", ""))
+        tk.Entry(printer_scrollable_frame, textvariable=secondary_port_var,
+                width=30, font=("Arial", 12)).pack(pady=5)
+        tk.Label(printer_scrollable_frame, text="Status Check Interval (seconds):", font=("Arial", 12)).pack(pady=5)
+        status_poll_var = tk.IntVar(value=self.settings["printer_settings"].get("status_poll_interval", 15))
+        tk.Spinbox(printer_scrollable_frame, from_=2, to=300, textvariable=status_poll_var,
+                  width=10, font=("Arial", 12)).pack(pady=5)
+        
         # Encoding
         tk.Label(printer_scrollable_frame, text="Encoding:", font=("Arial", 12)).pack(pady=5)
         encoding_var = tk.StringVar(value=self.settings["printer_settings"]["encoding"])
         encoding_combo = ttk.Combobox(printer_scrollable_frame, textvariable=encoding_var,
-                                     values=["cp437", "cp850", "cp852", "cp1256", "utf-8"],
+                                     values=list(Config.ESC_T_CODEPAGES),
                                      width=15, font=("Arial", 12))
         encoding_combo.pack(pady=5)
         
+        # Print mode
+        tk.Label(printer_scrollable_frame, text="Print Mode (raster matches the design but sends ~31 KB, ~3.5 s at 115200 baud):",
+                 font=("Arial", 12)).pack(pady=5)
+        print_mode_var = tk.StringVar(value=self.settings["printer_settings"].get("print_mode", "text"))
+        print_mode_combo = ttk.Combobox(printer_scrollable_frame, textvariable=print_mode_var,
+                                       values=["text", "raster"], state="readonly",
+                                       width=10, font=("Arial", 12))
+        print_mode_combo.pack(pady=5)
+        
         # Paper width
         tk.Label(printer_scrollable_frame, text="Paper Width (chars):", font=("Arial", 12)).pack(pady=5)
         paper_var = tk.IntVar(value=self.settings["printer_settings"]["paper_width"])
@@ -3923,10 +7088,11 @@ class PremiumQueueSystem:
                       variable=double_height_var, font=("Arial", 12)).pack(anchor="w", pady=5)
         
         # Test printer button
-        tk.Button(printer_scrollable_frame, text="🖨️ Test Printer Connection", 
-                 command=self.test_printer_connection,
-                 bg="#3498DB", fg="white", font=("Arial", 12),
-                 height=2, width=25).pack(pady=20)
+        test_button = tk.Button(printer_scrollable_frame, text="🖨️ Test Printer Connection",
+                                command=test_printer_connection,
+                                bg="#3498DB", fg="white", font=("Arial", 12),
+                                height=2, width=25)
+        test_button.pack(pady=20)
         
         # ========== Ticket Designs Tab ==========
         designs_tab = ttk.Frame(notebook)
@@ -4013,12 +7179,62 @@ class PremiumQueueSystem:
                  bg="#27AE60", fg="white", font=("Arial", 12),
                  height=2, width=25).pack(pady=20)
         
+        # ========== Statistics Tab ==========
+        stats_tab = ttk.Frame(notebook)
+        notebook.add(stats_tab, text="Statistics")
+        
+        summary = self.statistics.summary()
+        tk.Label(stats_tab, text="Ticket Statistics", 
+                font=("Arial", 20, "bold")).pack(pady=20)
+        
+        peak_hour = f"{summary['peak_hour']:02d}:00" if summary["peak_hour"] is not None else "N/A"
+        summary_text = (f"Issued today: {summary['issued_today']}    "
+                        f"Called today: {summary['called_today']}    "
+                        f"Average wait: {summary['average_wait_today'] / 60:.1f} min\n"
+                        f"Issue rate: {summary['issue_rate_per_hour']:.1f} / hour    "
+                        f"Peak hour (30 days): {peak_hour}")
+        tk.Label(stats_tab, text=summary_text, font=("Arial", 12), justify="left").pack(pady=10)
+        
+        # Tickets by hour of day over the last 30 days
+        tk.Label(stats_tab, text="Tickets by Hour (last 30 days):", 
+                font=("Arial", 14, "bold")).pack(pady=10)
+        chart = tk.Canvas(stats_tab, width=720, height=220, bg="white")
+        chart.pack(pady=5)
+        by_hour = summary["by_hour_of_day"]
+        tallest = max(by_hour) or 1
+        for hour, count in enumerate(by_hour):
+            x = 10 + hour * 29
+            height = int(170 * count / tallest)
+            chart.create_rectangle(x, 190 - height, x + 22, 190, fill="#3498DB", outline="")
+            chart.create_text(x + 11, 204, text=f"{hour:02d}", font=("Arial", 8))
+            if count:
+                chart.create_text(x + 11, 182 - height, text=str(count), font=("Arial", 8))
+        
+        # Last seven days
+        tk.Label(stats_tab, text="Last 7 Days:", 
+                font=("Arial", 14, "bold")).pack(pady=10)
+        for day, issued, called, average_wait in self.statistics.day_totals(7):
+            tk.Label(stats_tab, text=f"{day}    Issued: {issued}    Called: {called}    "
+                                    f"Avg wait: {average_wait / 60:.1f} min",
+                    font=("Arial", 11)).pack()
+        
+        tk.Button(stats_tab, text="📤 Export Ticket History", 
+                 command=lambda: self.export_history(settings_win),
+                 bg="#27AE60", fg="white", font=("Arial", 12),
+                 height=2, width=25).pack(pady=20)
+        
         # ========== Bottom Control Frame ==========
         bottom_frame = tk.Frame(settings_win, bg="#f0f0f0", height=80)
         bottom_frame.pack(side="bottom", fill="x", pady=10, padx=20)
         
         def save_all_settings():
             """Save all settings"""
+            try:
+                datetime.strptime(rollover_time_var.get().strip(), "%H:%M")
+            except ValueError:
+                messagebox.showerror("Error", "Day rollover time must be HH:MM (e.g. 00:00)")
+                return
+            
             # General
             self.settings["title"] = title_var.get()
             self.settings["company_name"] = company_var.get()
@@ -4087,12 +7303,30 @@ class PremiumQueueSystem:
             self.settings["business_rules"]["auto_increment_after_print"] = auto_var.get()
             self.settings["business_rules"]["auto_save_interval"] = auto_save_interval_var.get()
             self.settings["business_rules"]["create_backups"] = create_backups_var.get()
+            self.settings["business_rules"]["storage_format"] = storage_format_var.get()
+            self.settings["business_rules"]["counter_flush_ms"] = counter_flush_var.get()
+            self.settings["business_rules"]["counter_backend"] = counter_backend_var.get()
+            self.settings["business_rules"]["reset_at_midnight"] = reset_midnight_var.get()
+            self.settings["business_rules"]["day_rollover_time"] = rollover_time_var.get().strip()
+            self.settings["replication"]["role"] = replication_role_var.get()
+            self.settings["replication"]["host"] = replication_host_var.get()
+            self.settings["replication"]["port"] = replication_port_var.get()
+            self.settings["metrics"]["enabled"] = metrics_enabled_var.get()
+            self.settings["metrics"]["textfile"] = metrics_textfile_var.get().strip()
+            self.settings["metrics"]["http_port"] = metrics_port_var.get()
+            self.settings["logging"]["level"] = log_level_var.get()
+            self.settings["logging"]["format"] = log_format_var.get()
+            self.settings["logging"]["max_bytes"] = log_size_var.get() * 1024
+            self.settings["logging"]["ticket_budget"] = log_budget_var.get()
             self.settings["business_rules"]["backup_interval"] = backup_interval_var.get()
             
             # Printer settings
-            Config.SERIAL_PORT = port_var.get()
-            Config.BAUD_RATE = baud_var.get()
+            self.settings["printer_settings"]["port"] = port_var.get().strip()
+            self.settings["printer_settings"]["baud_rate"] = baud_var.get()
+            self.settings["printer_settings"]["secondary_port"] = secondary_port_var.get().strip()
+            self.settings["printer_settings"]["status_poll_interval"] = status_poll_var.get()
             self.settings["printer_settings"]["encoding"] = encoding_var.get()
+            self.settings["printer_settings"]["print_mode"] = print_mode_var.get()
             self.settings["printer_settings"]["paper_width"] = paper_var.get()
             self.settings["printer_settings"]["cut_after_print"] = cut_var.get()
             self.settings["printer_settings"]["print_quality"] = quality_var.get()
@@ -4119,21 +7353,21 @@ class PremiumQueueSystem:
                 self.update_background()
                 
                 # Update title
-                title_font = (self.settings["main_window"]["title_font"], 
-                            self.settings["main_window"]["title_size"], 
-                            "bold" if self.settings["main_window"]["title_bold"] else "normal")
+                title_font = font_registry.tk_font(self.settings["main_window"]["title_font"],
+                                                   self.settings["main_window"]["title_size"],
+                                                   self.settings["main_window"]["title_bold"])
                 self.title_label.config(
-                    text=self.settings["title"],
+                    text=text_shaper.for_tk(self.settings["title"]),
                     font=title_font,
                     fg=self.settings["main_window"]["title_color"],
                     bg=self.root.cget("bg")
                 )
                 
                 # Update company
-                company_font = (self.settings["main_window"]["company_font"], 
-                              self.settings["main_window"]["company_size"])
+                company_font = font_registry.tk_font(self.settings["main_window"]["company_font"],
+                                                     self.settings["main_window"]["company_size"])
                 self.company_label.config(
-                    text=self.settings["company_name"],
+                    text=text_shaper.for_tk(self.settings["company_name"]),
                     font=company_font,
                     fg=self.settings["main_window"]["company_color"],
                     bg=self.root.cget("bg")
@@ -4160,9 +7394,13 @@ class PremiumQueueSystem:
                 self.auto_save_manager.stop()
                 if self.settings["business_rules"]["auto_save_interval"] > 0:
                     self.auto_save_manager.start()
-                
-                # Update auto-save timer
-                self.setup_auto_save_timer()
+                self.setup_counter_flush()
+                self.setup_counter_backend()
+                self.setup_printer_supervisor()
+                log_pipeline.configure(self.settings["logging"])
+                self.setup_metrics()
+                if self.shared_counter is not None:
+                    self.scheduler.add("shared_counter", 0.5, self.poll_shared_counter)
                 
                 settings_win.destroy()
                 messagebox.showinfo("Success", "Settings saved successfully!")
@@ -4176,24 +7414,6 @@ class PremiumQueueSystem:
             else:
                 messagebox.showerror("Error", "Printer test failed!")
         
-        def test_printer_connection():
-            """Test printer connection"""
-            try:
-                ser = serial.Serial(
-                    Config.SERIAL_PORT,
-                    Config.BAUD_RATE,
-                    timeout=2,
-                    bytesize=serial.EIGHTBITS,
-                    parity=serial.PARITY_NONE,
-                    stopbits=serial.STOPBITS_ONE
-                )
-                ser.close()
-                messagebox.showinfo("Success", f"Printer connected successfully on {Config.SERIAL_PORT}")
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to connect to printer: {str(e)}")
-        
-        self.test_printer_connection = test_printer_connection
-        
         # Save button
         save_button = tk.Button(bottom_frame, text="💾 Save Settings", 
                                command=save_all_settings,
@@ -4333,8 +7553,24 @@ class PremiumQueueSystem:
     def on_closing(self):
         """Handle window closing"""
         try:
-            # Stop auto-save manager
+            # Stop periodic jobs
             self.auto_save_manager.stop()
+            self.scheduler.stop()
+            self.printer_supervisor.stop()
+            self.printer_supervisor.transports.close_all()
+            self.background_debouncer.cancel()
+            if self.shared_counter is not None:
+                self.shared_counter.close()
+            if self.replication_leader is not None:
+                self.replication_leader.stop()
+            if self.replication_follower is not None:
+                self.replication_follower.stop()
+            self.statistics.flush()
+            self.history.close()
+            self.file_worker.shutdown(wait=False)
+            metrics.stop_http()
+            if metrics.enabled and self.settings["metrics"].get("textfile"):
+                self.export_metrics()
             
             # Save current state
             self.save_current_state()
@@ -4363,8 +7599,28 @@ if __name__ == "__main__":
     ╚══════════════════════════════════════════════════════════╝
     """)
     
+    parser = argparse.ArgumentParser(description="Premium Queue System")
+    parser.add_argument("--role", choices=["off", "leader", "follower"],
+                        help="replication role for this kiosk (overrides settings)")
+    parser.add_argument("--host", help="leader address to listen on or connect to")
+    parser.add_argument("--port", type=int, help="replication TCP port")
+    parser.add_argument("--export", metavar="FILE", help="export ticket history to FILE and exit")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv", help="export format")
+    parser.add_argument("--from", dest="start_day", metavar="YYYY-MM-DD", help="first day to export")
+    parser.add_argument("--to", dest="end_day", metavar="YYYY-MM-DD", help="last day to export")
+    parser.add_argument("--service", type=int, action="append", help="service to export (repeatable)")
+    args = parser.parse_args()
+    
+    if args.export:
+        count = TicketHistoryStore(logging.getLogger(__name__)).export(
+            args.export, args.format, args.start_day, args.end_day, args.service)
+        print(f"Exported {count} records to {args.export}")
+        sys.exit(0)
+    replication = {key: value for key, value in
+                   (("role", args.role), ("host", args.host), ("port", args.port)) if value is not None}
+    
     try:
-        app = PremiumQueueSystem()
+        app = PremiumQueueSystem(replication)
         app.run()
     except Exception as e:
         print(f"Error starting application: {e}")
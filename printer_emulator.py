@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+ESC/POS Printer Emulator
+========================
+Stands in for the receipt printer so printing can be tested and benchmarked
+without hardware. Listens on a pseudo-terminal (POSIX) or a TCP socket,
+parses the ESC/POS stream, answers DLE EOT status requests, throttles input
+to a configurable baud rate and renders each cut ticket to a PNG.
+
+Usage:
+    python printer_emulator.py --pty --output tickets
+    python printer_emulator.py --tcp 9100 --baud 9600 --paper-width 58
+
+While running, type "paper-out", "cover-open" or "ready" to change state.
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:
+    Image = None
+
+ESC = 0x1B
+GS = 0x1D
+DLE = 0x10
+LF = 0x0A
+
+# ESC t code page numbers (Epson numbering) and their Python codecs
+CODEPAGES = {
+    0: "cp437", 2: "cp850", 16: "cp1252", 17: "cp866",
+    18: "cp852", 19: "cp858", 37: "cp864", 50: "cp1256"
+}
+
+PAPER_DOTS = {58: 384, 80: 576}
+
+
+# ======================= Parser =======================
+class EscPosParser:
+    """Incremental ESC/POS parser that collects printed items until a cut"""
+
+    # Commands taking one parameter byte: ESC <cmd> n
+    ESC_ONE_ARG = b"-EGJMRdtUV{a!3"
+
+    def __init__(self, on_ticket, respond=None, status=None):
+        self.on_ticket = on_ticket
+        self.respond = respond or (lambda data: None)
+        self.status = status or (lambda: {"paper_out": False, "cover_open": False})
+        self.buffer = bytearray()
+        self.items = []
+        self.line = bytearray()
+        self.ticket_bytes = 0
+        self.ticket_started = None
+        self.dropped_bytes = 0
+        self.unknown_commands = 0
+        self.reset()
+
+    def reset(self):
+        """ESC @: back to default formatting"""
+        self.align = 0
+        self.mode = 0
+        self.size = 0
+        self.bold = False
+        self.codepage = 0
+
+    def offline(self):
+        state = self.status()
+        return state["paper_out"] or state["cover_open"]
+
+    def feed(self, data):
+        """Consume bytes; incomplete commands wait for the next call"""
+        if self.ticket_started is None:
+            self.ticket_started = time.perf_counter()
+        self.ticket_bytes += len(data)
+        self.buffer += data
+
+        buffer = self.buffer
+        pos = 0
+        end = len(buffer)
+        while pos < end:
+            byte = buffer[pos]
+            if byte == LF:
+                self.end_line()
+                pos += 1
+            elif byte == ESC:
+                used = self.parse_esc(buffer, pos, end)
+                if used == 0:
+                    break
+                pos += used
+            elif byte == GS:
+                used = self.parse_gs(buffer, pos, end)
+                if used == 0:
+                    break
+                pos += used
+            elif byte == DLE:
+                if end - pos < 3:
+                    break
+                if buffer[pos + 1] == 0x04:
+                    self.respond(bytes([self.status_byte(buffer[pos + 2])]))
+                    pos += 3
+                else:
+                    pos += 1
+            elif byte < 0x20 and byte not in (0x09,):
+                pos += 1  # Other control bytes are ignored
+            else:
+                # Run of printable bytes
+                start = pos
+                while pos < end and (buffer[pos] >= 0x20 or buffer[pos] == 0x09):
+                    pos += 1
+                self.line += buffer[start:pos]
+        del buffer[:pos]
+
+    def parse_esc(self, buffer, pos, end):
+        if end - pos < 2:
+            return 0
+        command = buffer[pos + 1]
+        if command == ord("@"):
+            self.line.clear()
+            self.reset()
+            return 2
+        if command in self.ESC_ONE_ARG:
+            if end - pos < 3:
+                return 0
+            value = buffer[pos + 2]
+            if command == ord("a"):
+                self.align = value - 48 if value >= 48 else value & 3
+            elif command == ord("!"):
+                self.mode = value
+            elif command == ord("E"):
+                self.bold = bool(value & 1)
+            elif command == ord("t"):
+                self.codepage = value
+            elif command == ord("d"):
+                self.end_line()
+                for _ in range(max(0, value - 1)):
+                    self.add_item(("text", "", self.align, 0, False))
+            return 3
+        self.unknown_commands += 1
+        return 2
+
+    def parse_gs(self, buffer, pos, end):
+        if end - pos < 2:
+            return 0
+        command = buffer[pos + 1]
+        if command == ord("V"):
+            if end - pos < 3:
+                return 0
+            function = buffer[pos + 2]
+            used = 4 if function in (65, 66) else 3
+            if end - pos < used:
+                return 0
+            self.cut()
+            return used
+        if command == ord("v"):
+            # GS v 0 m xL xH yL yH d1...dk
+            if end - pos < 8:
+                return 0
+            width_bytes = buffer[pos + 4] | (buffer[pos + 5] << 8)
+            height = buffer[pos + 6] | (buffer[pos + 7] << 8)
+            size = width_bytes * height
+            if end - pos < 8 + size:
+                return 0
+            self.end_line()
+            self.add_item(("image", bytes(buffer[pos + 8:pos + 8 + size]), width_bytes, height, self.align))
+            return 8 + size
+        if command in (ord("!"), ord("B"), ord("h"), ord("w"), ord("H"), ord("f")):
+            if end - pos < 3:
+                return 0
+            if command == ord("!"):
+                self.size = buffer[pos + 2]
+            return 3
+        self.unknown_commands += 1
+        return 2
+
+    def status_byte(self, request):
+        """Reply to DLE EOT n"""
+        state = self.status()
+        value = 0x12  # Bits 1 and 4 are always set
+        if request == 1 and (state["paper_out"] or state["cover_open"]):
+            value |= 0x08  # Offline
+        elif request == 2:
+            if state["cover_open"]:
+                value |= 0x04
+            if state["paper_out"]:
+                value |= 0x20
+        elif request == 4 and state["paper_out"]:
+            value |= 0x6C  # Near end and end sensors
+        return value
+
+    def add_item(self, item):
+        if self.offline():
+            self.dropped_bytes += len(item[1]) if isinstance(item[1], (bytes, str)) else 0
+            return
+        self.items.append(item)
+
+    def end_line(self):
+        encoding = CODEPAGES.get(self.codepage, "cp437")
+        text = bytes(self.line).decode(encoding, errors="replace")
+        self.line.clear()
+        self.add_item(("text", text, self.align, self.mode | ((self.size & 0x01) << 4) | ((self.size & 0x10) << 1), self.bold))
+
+    def cut(self):
+        if self.line:
+            self.end_line()
+        ticket = {
+            "items": self.items,
+            "bytes": self.ticket_bytes,
+            "seconds": time.perf_counter() - self.ticket_started if self.ticket_started else 0.0
+        }
+        self.items = []
+        self.ticket_bytes = 0
+        self.ticket_started = None
+        self.on_ticket(ticket)
+
+
+# ======================= Rendering =======================
+class TicketImageRenderer:
+    """Draws parsed ticket items onto a paper-width image"""
+
+    LINE_HEIGHT = 24
+
+    def __init__(self, dots=576):
+        self.dots = dots
+        self.font = self.load_font(20)
+
+    @staticmethod
+    def load_font(size):
+        for name in ("DejaVuSansMono.ttf", "cour.ttf", "LiberationMono-Regular.ttf"):
+            try:
+                return ImageFont.truetype(name, size)
+            except OSError:
+                continue
+        try:
+            return ImageFont.load_default(size)
+        except TypeError:
+            return ImageFont.load_default()
+
+    def render(self, ticket):
+        blocks = []
+        for item in ticket["items"]:
+            if item[0] == "image":
+                _, data, width_bytes, height, align = item
+                image = Image.frombytes("1", (width_bytes * 8, height), data, "raw", "1;I")
+                blocks.append((image.convert("L"), align))
+            else:
+                _, text, align, mode, bold = item
+                blocks.append((self.render_text(text, mode, bold), align))
+
+        height = sum(block.height for block, _ in blocks) + 20
+        page = Image.new("L", (self.dots, max(height, 40)), 255)
+        y = 10
+        for block, align in blocks:
+            block = block.crop((0, 0, min(block.width, self.dots), block.height))
+            x = {1: (self.dots - block.width) // 2, 2: self.dots - block.width}.get(align, 0)
+            page.paste(block, (x, y))
+            y += block.height
+        return page
+
+    def render_text(self, text, mode, bold):
+        width_scale = 2 if mode & 0x20 else 1
+        height_scale = 2 if mode & 0x10 else 1
+        if not text:
+            return Image.new("L", (1, self.LINE_HEIGHT * height_scale), 255)
+        length = max(1, int(self.font.getlength(text)) + 2)
+        line = Image.new("L", (length, self.LINE_HEIGHT), 255)
+        draw = ImageDraw.Draw(line)
+        draw.text((0, 0), text, font=self.font, fill=0)
+        if bold:
+            draw.text((1, 0), text, font=self.font, fill=0)
+        if width_scale > 1 or height_scale > 1:
+            line = line.resize((length * width_scale, self.LINE_HEIGHT * height_scale))
+        return line
+
+
+# ======================= Transports =======================
+class Throttle:
+    """Limits reading to what a serial line at the given baud rate could deliver"""
+
+    def __init__(self, baud):
+        self.bytes_per_second = baud / 10 if baud else 0
+        self.next_time = 0.0
+
+    def wait(self, count):
+        if not self.bytes_per_second:
+            return
+        now = time.perf_counter()
+        self.next_time = max(self.next_time, now) + count / self.bytes_per_second
+        delay = self.next_time - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class PrinterEmulator:
+    """Fake ESC/POS printer on a pseudo-terminal or TCP port"""
+
+    CHUNK = 256
+
+    def __init__(self, paper_width=80, baud=0, output_dir=None, verbose=False):
+        self.dots = PAPER_DOTS.get(paper_width, 576)
+        self.throttle = Throttle(baud)
+        self.output_dir = output_dir
+        self.verbose = verbose
+        self.state = {"paper_out": False, "cover_open": False}
+        self.tickets = []
+        self.received = 0
+        self.running = False
+        self.port = None
+        self.respond = lambda data: None
+        self.parser = EscPosParser(self.on_ticket, lambda data: self.respond(data), lambda: self.state)
+        self.renderer = TicketImageRenderer(self.dots) if Image is not None and output_dir else None
+        self.ticket_event = threading.Condition()
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+    def set_state(self, paper_out=None, cover_open=None):
+        if paper_out is not None:
+            self.state["paper_out"] = paper_out
+        if cover_open is not None:
+            self.state["cover_open"] = cover_open
+
+    def on_ticket(self, ticket):
+        index = len(self.tickets) + 1
+        summary = {"index": index, "bytes": ticket["bytes"], "seconds": ticket["seconds"],
+                   "items": len(ticket["items"])}
+        if self.renderer is not None:
+            path = os.path.join(self.output_dir, f"ticket_{index:04d}.png")
+            self.renderer.render(ticket).save(path)
+            summary["image"] = path
+        with self.ticket_event:
+            self.tickets.append(summary)
+            self.ticket_event.notify_all()
+        if self.verbose:
+            print(f"Ticket {index}: {ticket['bytes']} bytes, {len(ticket['items'])} items, "
+                  f"{ticket['seconds']:.3f} s" + (f" -> {summary['image']}" if "image" in summary else ""))
+
+    def wait_for_tickets(self, count, timeout=10):
+        """Block until count tickets have been cut"""
+        deadline = time.time() + timeout
+        with self.ticket_event:
+            while len(self.tickets) < count:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.ticket_event.wait(remaining)
+        return True
+
+    def handle(self, data):
+        self.received += len(data)
+        self.throttle.wait(len(data))
+        self.parser.feed(data)
+
+    def start_pty(self):
+        """Serve on a new pseudo-terminal; returns its device path"""
+        import pty
+        import tty
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self.respond = lambda data: os.write(master, data)
+        self.running = True
+
+        def serve():
+            while self.running:
+                try:
+                    data = os.read(master, self.CHUNK)
+                except OSError:
+                    break
+                if not data:
+                    break
+                self.handle(data)
+
+        self.close_handles = lambda: (os.close(slave), os.close(master))
+        threading.Thread(target=serve, daemon=True).start()
+        return self.port
+
+    def start_tcp(self, port=9100, host="127.0.0.1"):
+        """Serve on a TCP port, one connection at a time like a network printer"""
+        server = socket.create_server((host, port))
+        self.port = f"{host}:{server.getsockname()[1]}"
+        self.running = True
+
+        def serve():
+            while self.running:
+                try:
+                    connection, _ = server.accept()
+                except OSError:
+                    break
+                self.respond = lambda data: connection.sendall(data)
+                with connection:
+                    while self.running:
+                        try:
+                            data = connection.recv(self.CHUNK)
+                        except OSError:
+                            break
+                        if not data:
+                            break
+                        self.handle(data)
+
+        self.close_handles = server.close
+        threading.Thread(target=serve, daemon=True).start()
+        return self.port
+
+    def stop(self):
+        self.running = False
+        try:
+            self.close_handles()
+        except (AttributeError, OSError):
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ESC/POS printer emulator")
+    transport = parser.add_mutually_exclusive_group(required=True)
+    transport.add_argument("--pty", action="store_true", help="serve on a pseudo-terminal (POSIX)")
+    transport.add_argument("--tcp", type=int, metavar="PORT", help="serve on a TCP port")
+    parser.add_argument("--host", default="127.0.0.1", help="address for --tcp")
+    parser.add_argument("--baud", type=int, default=0, help="simulated line speed (0 = unlimited)")
+    parser.add_argument("--paper-width", type=int, choices=[58, 80], default=80)
+    parser.add_argument("--output", metavar="DIR", help="save each ticket as a PNG in DIR")
+    parser.add_argument("--paper-out", action="store_true", help="start with no paper")
+    parser.add_argument("--cover-open", action="store_true", help="start with the cover open")
+    args = parser.parse_args()
+
+    emulator = PrinterEmulator(args.paper_width, args.baud, args.output, verbose=True)
+    emulator.set_state(paper_out=args.paper_out, cover_open=args.cover_open)
+    port = emulator.start_pty() if args.pty else emulator.start_tcp(args.tcp, args.host)
+    print(f"Printer emulator listening on {port}")
+    print('Commands: "paper-out", "cover-open", "ready", "quit"')
+
+    commands = {
+        "paper-out": {"paper_out": True},
+        "cover-open": {"cover_open": True},
+        "ready": {"paper_out": False, "cover_open": False}
+    }
+    try:
+        for line in sys.stdin:
+            command = line.strip()
+            if command == "quit":
+                break
+            if command in commands:
+                emulator.set_state(**commands[command])
+                print(f"State: {emulator.state}")
+    except KeyboardInterrupt:
+        pass
+    emulator.stop()
+
+
+if __name__ == "__main__":
+    main()